@@ -1,12 +1,15 @@
-import struct
 from pathlib import Path
 from typing import Optional, Union
 
 import librosa
 import numpy as np
-import webrtcvad
 from scipy.ndimage.morphology import binary_dilation
 
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
 from encoder.params_data import *
 
 int16_max = (2 ** 15) - 1
@@ -57,6 +60,41 @@ def wav_to_mel_spectrogram(wav):
     return frames.astype(np.float32).T
 
 
+def voice_flags_webrtcvad(wav, samples_per_window):
+    """
+    Runs webrtcvad on every window of the waveform.
+
+    :param wav: the raw waveform as a numpy array of floats, its length a multiple of 
+    samples_per_window
+    :return: a boolean array with one flag per window
+    """
+    # Convert the float waveform to 16-bit mono PCM, windows are zero-copy slices of the buffer
+    pcm_wave = memoryview(np.round(wav * int16_max).astype(np.int16).tobytes())
+    window_bytes = samples_per_window * 2
+
+    vad = webrtcvad.Vad(mode=3)
+    return np.array([vad.is_speech(pcm_wave[start:start + window_bytes], sample_rate=sampling_rate)
+                     for start in range(0, len(pcm_wave), window_bytes)], dtype=bool)
+
+
+def voice_flags_energy(wav, samples_per_window, threshold_dB=-35, floor_dBFS=-60):
+    """
+    Energy based voice detection, used when webrtcvad is not installed. All the windows are 
+    computed at once: a window is voiced if its level is within <threshold_dB> of the loudest 
+    window and above <floor_dBFS>.
+
+    :param wav: the raw waveform as a numpy array of floats, its length a multiple of 
+    samples_per_window
+    :return: a boolean array with one flag per window
+    """
+    windows = wav.reshape(-1, samples_per_window).astype(np.float64)
+    rms = np.sqrt(np.mean(windows ** 2, axis=1))
+    level_dBFS = 20 * np.log10(np.maximum(rms, 1e-10))
+    if len(level_dBFS) == 0:
+        return np.zeros(0, dtype=bool)
+    return (level_dBFS > level_dBFS.max() + threshold_dB) & (level_dBFS > floor_dBFS)
+
+
 def trim_long_silences(wav):
     """
     Ensures that segments without voice in the waveform remain no longer than a 
@@ -71,17 +109,11 @@ def trim_long_silences(wav):
     # Trim the end of the audio to have a multiple of the window size
     wav = wav[:len(wav) - (len(wav) % samples_per_window)]
 
-    # Convert the float waveform to 16-bit mono PCM
-    pcm_wave = struct.pack("%dh" % len(wav), *(np.round(wav * int16_max)).astype(np.int16))
-
     # Perform voice activation detection
-    voice_flags = []
-    vad = webrtcvad.Vad(mode=3)
-    for window_start in range(0, len(wav), samples_per_window):
-        window_end = window_start + samples_per_window
-        voice_flags.append(vad.is_speech(pcm_wave[window_start * 2:window_end * 2],
-                                         sample_rate=sampling_rate))
-    voice_flags = np.array(voice_flags)
+    if webrtcvad is not None:
+        voice_flags = voice_flags_webrtcvad(wav, samples_per_window)
+    else:
+        voice_flags = voice_flags_energy(wav, samples_per_window)
 
     # Smooth the voice detection with a moving average
     def moving_average(array, width):
@@ -91,7 +123,7 @@ def trim_long_silences(wav):
         return ret[width - 1:] / width
 
     audio_mask = moving_average(voice_flags, vad_moving_average_width)
-    audio_mask = np.round(audio_mask).astype(np.bool)
+    audio_mask = np.round(audio_mask).astype(bool)
 
     # Dilate the voiced regions
     audio_mask = binary_dilation(audio_mask, np.ones(vad_max_silence_length + 1))
@@ -109,3 +141,40 @@ def normalize_volume(wav, target_dBFS, increase_only=False, decrease_only=False)
     if dBFS_change < 0 and increase_only or dBFS_change > 0 and decrease_only:
         return wav
     return wav * (10 ** (dBFS_change / 20))
+
+
+if __name__ == "__main__":
+    import struct
+    import time
+
+    # Parity with the struct.pack implementation and timing on 10 minutes of audio
+    samples_per_window = (vad_window_length * sampling_rate) // 1000
+    t = np.arange(sampling_rate * 600) / sampling_rate
+    phase = 2 * np.pi * np.cumsum(150 + 30 * np.sin(2 * np.pi * 0.5 * t)) / sampling_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 30))
+    envelope = (np.sin(2 * np.pi * 0.2 * t) > 0) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t))
+    wav = 0.1 * voiced * envelope + 0.001 * np.random.randn(len(t))
+    wav = wav[:len(wav) - (len(wav) % samples_per_window)].astype(np.float32)
+
+    start = time.time()
+    pcm_wave = struct.pack("%dh" % len(wav), *(np.round(wav * int16_max)).astype(np.int16))
+    flags_ref = []
+    vad = webrtcvad.Vad(mode=3)
+    for window_start in range(0, len(wav), samples_per_window):
+        window_end = window_start + samples_per_window
+        flags_ref.append(vad.is_speech(pcm_wave[window_start * 2:window_end * 2], sample_rate=sampling_rate))
+    time_ref = time.time() - start
+
+    start = time.time()
+    flags = voice_flags_webrtcvad(wav, samples_per_window)
+    time_webrtcvad = time.time() - start
+
+    start = time.time()
+    flags_energy = voice_flags_energy(wav, samples_per_window)
+    time_energy = time.time() - start
+
+    assert np.array_equal(np.array(flags_ref), flags)
+    print("parity ok, energy VAD agreement with webrtcvad: %.3f" % np.mean(flags_energy == flags))
+    print("struct.pack + webrtcvad: %.3fs" % time_ref)
+    print("tobytes + webrtcvad: %.3fs" % time_webrtcvad)
+    print("energy VAD: %.3fs" % time_energy)
@@ -6,11 +6,11 @@ from encoder.data_objects.utterance import Utterance
 
 # Contains the set of utterances of a single speaker
 class Speaker:
-    def __init__(self, root: Path):
+    def __init__(self, root: Path, utterances=None):
         self.root = root
         self.name = root.name
-        self.utterances = None
-        self.utterance_cycler = None
+        self.utterances = utterances
+        self.utterance_cycler = None if utterances is None else RandomCycler(utterances)
 
     def _load_utterances(self):
         with self.root.joinpath("_sources.txt").open("r") as sources_file:
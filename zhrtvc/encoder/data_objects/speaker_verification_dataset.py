@@ -5,6 +5,7 @@ from torch.utils.data import Dataset, DataLoader
 from encoder.data_objects.random_cycler import RandomCycler
 from encoder.data_objects.speaker import Speaker
 from encoder.data_objects.speaker_batch import SpeakerBatch
+from encoder.data_objects.utterance import ShardUtterance
 from encoder.params_data import partials_n_frames
 
 
@@ -12,14 +13,27 @@ from encoder.params_data import partials_n_frames
 
 class SpeakerVerificationDataset(Dataset):
     def __init__(self, datasets_root: Path):
+        from mellotron.shards import ShardReader
+
         self.root = datasets_root
-        speaker_dirs = [f for f in self.root.glob("*") if f.is_dir()]
-        if len(speaker_dirs) == 0:
+        if ShardReader.is_shard(self.root):
+            self.speakers = self._load_shard_speakers(ShardReader(self.root))
+        else:
+            speaker_dirs = [f for f in self.root.glob("*") if f.is_dir()]
+            self.speakers = [Speaker(speaker_dir) for speaker_dir in speaker_dirs]
+        if len(self.speakers) == 0:
             raise Exception("No speakers found. Make sure you are pointing to the directory "
                             "containing all preprocessed speaker directories.")
-        self.speakers = [Speaker(speaker_dir) for speaker_dir in speaker_dirs]
         self.speaker_cycler = RandomCycler(self.speakers)
 
+    def _load_shard_speakers(self, reader):
+        # Group the packed utterances by speaker, the frames stay memory-mapped
+        utterances = {}
+        for index in range(len(reader)):
+            utterance = ShardUtterance(reader, index, reader.get_meta(index, "source"))
+            utterances.setdefault(reader.get_meta(index, "speaker"), []).append(utterance)
+        return [Speaker(self.root.joinpath(name), utts) for name, utts in utterances.items()]
+
     def __len__(self):
         return int(1e10)
 
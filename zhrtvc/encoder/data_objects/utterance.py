@@ -24,3 +24,17 @@ class Utterance:
             start = np.random.randint(0, frames.shape[0] - n_frames)
         end = start + n_frames
         return frames[start:end], (start, end)
+
+
+class ShardUtterance(Utterance):
+    """
+    Utterance whose frames are a memory-mapped view into a packed shard (see mellotron.shards).
+    """
+
+    def __init__(self, reader, index, wave_fpath):
+        super().__init__(None, wave_fpath)
+        self.reader = reader
+        self.index = index
+
+    def get_frames(self):
+        return self.reader.get(self.index, "frames")
@@ -111,9 +111,9 @@ def compute_partial_slices(n_samples, partial_utterance_n_frames=partials_n_fram
 
 def embed_utterance(wav, using_partials=True, return_partials=False, **kwargs):
     """
-    Computes an embedding for a single utterance.
+    Computes an embedding for a single utterance. See embed_utterances() to embed several 
+    utterances in the same forward passes.
     
-    # TODO: handle multiple wavs to benefit from batching on GPU
     :param wav: a preprocessed (see audio.py) utterance waveform as a numpy array of float32
     :param using_partials: if True, then the utterance is split in partial utterances of 
     <partial_utterance_n_frames> frames and the utterance embedding is computed from their 
@@ -136,24 +136,55 @@ def embed_utterance(wav, using_partials=True, return_partials=False, **kwargs):
             return embed, None, None
         return embed
 
-    # Compute where to split the utterance into partials and pad if necessary
-    wave_slices, mel_slices = compute_partial_slices(len(wav), **kwargs)
-    max_wave_length = wave_slices[-1].stop
-    if max_wave_length >= len(wav):
-        wav = np.pad(wav, (0, max_wave_length - len(wav)), "constant")
+    embeds, partial_embeds, wave_slices = embed_utterances([wav], return_partials=True, **kwargs)
+    if return_partials:
+        return embeds[0], partial_embeds[0], wave_slices[0]
+    return embeds[0]
 
-    # Split the utterance into partials
-    frames = audio.wav_to_mel_spectrogram(wav)
-    frames_batch = np.array([frames[s] for s in mel_slices])
-    partial_embeds = embed_frames_batch(frames_batch)
 
-    # Compute the utterance embedding from the partial embeddings
-    raw_embed = np.mean(partial_embeds, axis=0)
-    embed = raw_embed / np.linalg.norm(raw_embed, 2)
+def embed_utterances(wavs, return_partials=False, max_batch_size=256, **kwargs):
+    """
+    Computes the embeddings of several utterances. The partial utterances of all the waveforms 
+    are stacked and fed to the network in batches of at most <max_batch_size> partials, then 
+    averaged back per utterance. Each embedding is the same normalized average of partial 
+    embeddings as computed by embed_utterance().
+    
+    :param wavs: a list of preprocessed (see audio.py) utterance waveforms as numpy arrays of 
+    float32
+    :param return_partials: if True, the partial embeddings of each utterance will also be 
+    returned along with the wav slices that correspond to the partial embeddings.
+    :param max_batch_size: the maximum number of partial utterances in one forward pass.
+    :param kwargs: additional arguments to compute_partial_splits()
+    :return: the embeddings as a numpy array of float32 of shape (n_wavs, model_embedding_size). 
+    If <return_partials> is True, a list of the partial embeddings of each utterance and a list 
+    of the wav slices of each utterance will also be returned.
+    """
+    frames_batches, wave_slices_lst = [], []
+    for wav in wavs:
+        # Compute where to split the utterance into partials and pad if necessary
+        wave_slices, mel_slices = compute_partial_slices(len(wav), **kwargs)
+        max_wave_length = wave_slices[-1].stop
+        if max_wave_length >= len(wav):
+            wav = np.pad(wav, (0, max_wave_length - len(wav)), "constant")
+
+        # Split the utterance into partials
+        frames = audio.wav_to_mel_spectrogram(wav)
+        frames_batches.append(np.array([frames[s] for s in mel_slices]))
+        wave_slices_lst.append(wave_slices)
+
+    # Forward the partials of all the utterances together
+    frames_all = np.concatenate(frames_batches, axis=0)
+    partial_embeds_all = np.concatenate([embed_frames_batch(frames_all[i:i + max_batch_size])
+                                         for i in range(0, len(frames_all), max_batch_size)], axis=0)
+
+    # Compute the utterance embeddings from the partial embeddings
+    partial_embeds = np.split(partial_embeds_all, np.cumsum([len(f) for f in frames_batches])[:-1])
+    raw_embeds = np.array([np.mean(p, axis=0) for p in partial_embeds])
+    embeds = raw_embeds / np.linalg.norm(raw_embeds, 2, axis=1, keepdims=True)
 
     if return_partials:
-        return embed, partial_embeds, wave_slices
-    return embed
+        return embeds, partial_embeds, wave_slices_lst
+    return embeds
 
 
 def embed_speaker():
@@ -176,3 +176,21 @@ def preprocess_voxceleb2(datasets_root: Path, out_dir: Path, skip_existing=False
     speaker_dirs = list(dataset_root.joinpath("dev", "aac").glob("*"))
     _preprocess_speaker_dirs(speaker_dirs, dataset_name, datasets_root, out_dir, "m4a",
                              skip_existing, logger)
+
+
+def pack_shards(clean_data_root: Path, shard_dir: Path):
+    """
+    Packs the preprocessed speaker directories of <clean_data_root> into a single shard (see
+    mellotron.shards) that SpeakerVerificationDataset can read with memory-mapped views.
+    """
+    from mellotron.shards import ShardWriter
+
+    speaker_dirs = [f for f in clean_data_root.glob("*") if f.joinpath("_sources.txt").is_file()]
+    with ShardWriter(shard_dir, fields=["frames"]) as writer:
+        for speaker_dir in tqdm(speaker_dirs, "Packing", unit="speakers"):
+            with speaker_dir.joinpath("_sources.txt").open("r") as sources_file:
+                sources = [line.strip().split(",") for line in sources_file]
+            for frames_fname, wave_fpath in sources:
+                frames = np.load(speaker_dir.joinpath(frames_fname))
+                writer.add({"frames": frames}, speaker=speaker_dir.name, source=wave_fpath)
+    print("Packed %d speakers into %s." % (len(speaker_dirs), shard_dir))
@@ -6,20 +6,24 @@
 """
 
 import json
+import warnings
+from pathlib import Path
 
 import numpy as np
 import torch
 import yaml
 
+from utils.torchscript import script_path, is_torchscript, copy_model
 from .mel2wav.interface import MelVocoder, get_default_device
 from .mel2wav.modules import Generator
 
 _model = None
 
 
-def load_melgan_model(model_path, args_path, device=None):
+def load_melgan_model(model_path, args_path, device=None, quantize=False):
     """
     导入训练得到的checkpoint模型文件。
+    quantize为True时用quantize_generator转为CPU推理的模型。
     """
     global _model
     if device is None:
@@ -33,20 +37,87 @@ def load_melgan_model(model_path, args_path, device=None):
     ratios = [int(w) for w in args['ratios'].split()]
     _model = Generator(args['n_mel_channels'], args['ngf'], args['n_residual_layers'], ratios=ratios).to(device)
     _model.load_state_dict(torch.load(model_path, map_location=device))
+    if quantize:
+        _model = quantize_generator(_model)
     return _model
 
 
-def load_melgan_torch(model_path, device=None):
+def load_melgan_torch(model_path, device=None, quantize=False):
     """
     用torch.load直接导入模型文件，不需要导入模型代码。
+    如果有export_torchscript导出的<name>.script.pt，优先导入TorchScript模型。
+    quantize为True时用quantize_generator转为CPU推理的模型，save_melgan_torch保存的模型已经转换过，直接导入即可。
+    TorchScript模型不能再量化，quantize为True时给出警告并按原样导入。
     """
     global _model
     if device is None:
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    fpath = script_path(model_path)
+    if quantize or not fpath.is_file():
+        fpath = Path(model_path)
+    if is_torchscript(fpath):
+        if quantize:
+            warnings.warn('<{}> is a TorchScript model and can not be quantized, it is loaded as is.'.format(fpath))
+        _model = torch.jit.load(str(fpath), map_location=device)
+        return _model
+
     _model = torch.load(model_path, map_location=device)
+    if quantize:
+        _model = quantize_generator(_model)
     return _model
 
 
+def remove_weight_norm(model):
+    """
+    去掉模型中所有的weight norm，把权重合并为普通的权重。
+    """
+    for module in model.modules():
+        if hasattr(module, 'weight_g'):
+            torch.nn.utils.remove_weight_norm(module)
+    return model
+
+
+def quantize_generator(model):
+    """
+    CPU推理用的模型：去掉weight norm（把权重合并为普通的卷积权重），再对支持的层做int8动态量化。
+    torch的动态量化只支持Linear和RNN类的层，Generator全部是卷积，这时没有层被量化，
+    给出警告并返回去掉weight norm的fp32模型。
+    卷积的静态量化在CPU上比fp32慢而且音质损失大，所以不做。
+    """
+    model = remove_weight_norm(model.cpu().eval())
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU},
+                                                dtype=torch.qint8, inplace=True)
+    if count_quantized(model) == 0:
+        warnings.warn('No layer of the model can be dynamically quantized, '
+                      'the fp32 model without weight norm is returned.')
+    return model
+
+
+def count_quantized(model):
+    """
+    模型中量化过的层数。
+    """
+    return sum(type(module).__module__.startswith(('torch.ao.nn.quantized', 'torch.nn.quantized'))
+               for module in model.modules())
+
+
+def export_torchscript(model, outpath):
+    """
+    去掉weight norm后用torch.jit.script编译Generator并保存，导入时不需要模型代码。
+    """
+    model = remove_weight_norm(copy_model(model).eval())
+    script = torch.jit.script(model)
+    torch.jit.save(script, str(outpath))
+    return script
+
+
+def save_melgan_torch(outpath):
+    """
+    保存当前导入的模型，可以用load_melgan_torch直接导入。
+    """
+    torch.save(_model, outpath)
+
+
 def is_loaded():
     """
     判断模型是否已经被导入。
@@ -103,4 +174,40 @@ def save_model(model: MelVocoder, outpath):
 
 
 if __name__ == "__main__":
-    print(__file__)
+    # 量化模型和原模型的频谱距离和速度。
+    # python -m melgan.inference [model.pt [mel.npy ...]]
+    import sys
+    import tempfile
+    import time
+
+    from .mel2wav.interface import audio2mel
+
+    if len(sys.argv) > 1:
+        load_melgan_torch(sys.argv[1], device='cpu')
+    else:
+        _model = Generator(80, 32, 3).eval()
+    if len(sys.argv) > 2:
+        mels = [torch.from_numpy(np.load(w)[None]).float() for w in sys.argv[2:]]
+    else:
+        rng = np.random.RandomState(0)
+        mels = [torch.from_numpy(np.cumsum(rng.randn(1, 80, n), axis=2) * 0.1 - 5).float() for n in (200, 400)]
+
+    def run():
+        outs = []
+        start = time.time()
+        with torch.no_grad():
+            for mel in mels:
+                outs.append(_model(mel).squeeze(1))
+        return outs, time.time() - start
+
+    run()
+    ref_wavs, ref_time = run()
+    _model = quantize_generator(_model)
+    outpath = tempfile.mktemp(suffix='.pt')
+    save_melgan_torch(outpath)
+    load_melgan_torch(outpath, device='cpu')
+    run()
+    wavs, quant_time = run()
+    dist = np.mean([(audio2mel(a) - audio2mel(b)).abs().mean().item() for a, b in zip(ref_wavs, wavs)])
+    print('quantized layers {}, original {:.3f}s, quantize_generator {:.3f}s ({:.2f}x), log-mel L1 {:.2e}'.format(
+        count_quantized(_model), ref_time, quant_time, ref_time / quant_time, dist))
@@ -5,9 +5,9 @@ import numpy as np
 import torch
 import yaml
 from aukit import Dict2Obj
-from aukit.audio_griffinlim import mel_spectrogram, default_hparams
+from aukit.audio_griffinlim import default_hparams
 
-from .modules import Generator, Audio2Mel
+from .modules import Generator, Audio2Mel, MelFrontend
 
 
 def get_default_device():
@@ -69,7 +69,8 @@ class MelVocoder:
             mode='default',
     ):
         if mode == 'default':
-            self.fft = audio2mel
+            self.audio2mel = Audio2Mel().to(device)
+            self.fft = self._audio2mel
         elif mode == 'synthesizer':
             self.fft = audio2mel_synthesizer
         elif mode == 'mellotron':
@@ -99,7 +100,10 @@ class MelVocoder:
         Returns:
             torch.tensor: log-mel-spectrogram computed on input audio (batch_size, 80, timesteps)
         """
-        return self.fft(audio)
+        return self.fft(audio.to(self.device))
+
+    def _audio2mel(self, src):
+        return self.audio2mel(src.unsqueeze(1))
 
     def inverse(self, mel):
         """
@@ -120,6 +124,23 @@ class MelVocoder:
         return self.inverse(mel)
 
 
+# 按参数、设备和数据类型缓存的Audio2Mel，避免每次调用都重新计算mel_basis和window。
+_audio2mel_cache = {}
+
+
+def get_audio2mel(n_fft=1024, hop_length=256, win_length=1024, sampling_rate=22050, n_mel_channels=80,
+                  mel_fmin=0.0, mel_fmax=None, device="cpu", dtype=torch.float32):
+    key = (n_fft, hop_length, win_length, sampling_rate, n_mel_channels, mel_fmin, mel_fmax,
+           torch.device(device), dtype)
+    fft = _audio2mel_cache.get(key)
+    if fft is None:
+        fft = Audio2Mel(n_fft=n_fft, hop_length=hop_length, win_length=win_length, sampling_rate=sampling_rate,
+                        n_mel_channels=n_mel_channels, mel_fmin=mel_fmin, mel_fmax=mel_fmax)
+        fft = fft.to(device=device, dtype=dtype)
+        _audio2mel_cache[key] = fft
+    return fft
+
+
 def audio2mel(src):
     """
     训练中使用。
@@ -127,7 +148,7 @@ def audio2mel(src):
     :return:
     """
     src = src.unsqueeze(1)
-    mel = Audio2Mel()(src)
+    mel = get_audio2mel(device=src.device, dtype=src.dtype)(src)
     return mel
 
 
@@ -152,6 +173,24 @@ synthesizer_hparams = {k: v for k, v in default_hparams.items()}
 synthesizer_hparams = {**synthesizer_hparams, **my_hp}
 synthesizer_hparams = Dict2Obj(synthesizer_hparams)
 
+# 按aukit参数、设备和数据类型缓存的MelFrontend。
+_mel_frontend_cache = {}
+
+_mel_frontend_keys = ("num_mels", "n_fft", "hop_size", "win_size", "sample_rate", "preemphasize", "preemphasis",
+                      "center", "signal_normalization", "allow_clipping_in_normalization", "symmetric_mels",
+                      "max_abs_value", "min_level_db", "ref_level_db", "fmin", "fmax")
+
+
+def get_mel_frontend(hparams, pad_len=0, scale=1.0, device="cpu", dtype=torch.float32):
+    key = tuple(hparams.get(k) for k in _mel_frontend_keys) + (pad_len, scale, torch.device(device), dtype)
+    if hparams.get("mel_basis") is not None:
+        key = key + (id(hparams.mel_basis),)
+    frontend = _mel_frontend_cache.get(key)
+    if frontend is None:
+        frontend = MelFrontend(hparams, pad_len=pad_len, scale=scale).to(device=device, dtype=dtype)
+        _mel_frontend_cache[key] = frontend
+    return frontend
+
 
 def audio2mel_synthesizer(src):
     """
@@ -160,14 +199,8 @@ def audio2mel_synthesizer(src):
     :return:
     """
     _pad_len = (synthesizer_hparams.n_fft - synthesizer_hparams.hop_size) // 2
-    wavs = src.cpu().numpy()
-    mels = []
-    for wav in wavs:
-        wav = np.pad(wav.flatten(), (_pad_len, _pad_len), mode="reflect")
-        mel = mel_spectrogram(wav, synthesizer_hparams)
-        mel = mel / 20
-        mels.append(mel)
-    mels = torch.from_numpy(np.array(mels).astype(np.float32))
+    fft = get_mel_frontend(synthesizer_hparams, pad_len=_pad_len, scale=20, device=src.device)
+    mels = fft(src.reshape(src.shape[0], -1))
     return mels
 
 
@@ -177,11 +210,66 @@ def audio2mel_mellotron(src):
     :param src:
     :return:
     """
-    wavs = src.cpu().numpy()
-    mels = []
-    for wav in wavs:
-        wav = wav.flatten()[:-1]  # 避免生成多一个空帧频谱
-        mel = mel_spectrogram(wav, default_hparams)
-        mels.append(mel)
-    mels = torch.from_numpy(np.array(mels).astype(np.float32))
+    wavs = src.reshape(src.shape[0], -1)[:, :-1]  # 避免生成多一个空帧频谱
+    mels = get_mel_frontend(default_hparams, device=src.device)(wavs)
     return mels
+
+
+if __name__ == "__main__":
+    # 和aukit的逐条numpy计算对比结果，并测试吞吐量。
+    # python -m melgan.mel2wav.interface [wav ...]
+    import sys
+    import time
+
+    import librosa
+    import numpy as np
+    from aukit.audio_griffinlim import mel_spectrogram
+
+    if len(sys.argv) > 1:
+        fixtures = [librosa.load(w, sr=_sr)[0] for w in sys.argv[1:]]
+    else:
+        rng = np.random.RandomState(0)
+        fixtures = []
+        for num, sec in enumerate([0.5, 1.3, 2.0, 3.7]):
+            t = np.arange(int(sec * _sr)) / _sr
+            wav = 0.3 * np.sin(2 * np.pi * (120 + 80 * num) * t * (1 + t)) + 0.02 * rng.randn(len(t))
+            wav[:len(wav) // 8] = 0  # 静音段，检查min_level的截断
+            fixtures.append(wav.astype(np.float32))
+
+    # 检查实际使用的get_mel_frontend，center的pad_mode跟着安装的librosa走。
+    _pad_len = (synthesizer_hparams.n_fft - synthesizer_hparams.hop_size) // 2
+    cases = [("synthesizer", synthesizer_hparams, _pad_len, 20),
+             ("mellotron", default_hparams, 0, 1)]
+    for name, hp, pad_len, scale in cases:
+        fft = get_mel_frontend(hp, pad_len=pad_len, scale=scale)
+        diff = 0.
+        for wav in fixtures:
+            ref = mel_spectrogram(np.pad(wav, (pad_len, pad_len), mode="reflect"), hp) / scale
+            out = fft(torch.from_numpy(wav)).numpy()
+            assert out.shape == ref.shape, (out.shape, ref.shape)
+            diff = max(diff, float(np.abs(out - ref).max()))
+        print("{}: center_pad_mode {}, max abs diff {:.2e}".format(name, fft.center_pad_mode, diff))
+        assert diff < 1e-3
+
+    # 吞吐量：训练时的batch，每条8192个采样点。
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    for batch_size in [4, 16, 64]:
+        wavs = np.random.RandomState(1).randn(batch_size, 8192).astype(np.float32) * 0.1
+        t0 = time.time()
+        for wav in wavs:
+            mel_spectrogram(np.pad(wav, (_pad_len, _pad_len), mode="reflect"), synthesizer_hparams)
+        t_ref = time.time() - t0
+        for device in devices:
+            src = torch.from_numpy(wavs).to(device)
+            audio2mel_synthesizer(src)
+            n_iter = 10
+            if device == "cuda":
+                torch.cuda.synchronize()
+            t0 = time.time()
+            for _ in range(n_iter):
+                audio2mel_synthesizer(src)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            t_new = (time.time() - t0) / n_iter
+            print("batch {:3d} {}: aukit {:.4f}s, MelFrontend {:.4f}s, {:.1f}x".format(
+                batch_size, device, t_ref, t_new, t_ref / t_new))
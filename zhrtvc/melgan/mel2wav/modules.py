@@ -1,8 +1,12 @@
+import inspect
+
+import librosa
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from librosa.filters import mel as librosa_mel_fn
+from scipy import signal
 from torch.nn.utils import weight_norm
 
 
@@ -51,7 +55,7 @@ class Audio2Mel(nn.Module):
         p = (self.n_fft - self.hop_length) // 2
         audio = F.pad(audio, (p, p), "reflect").squeeze(1)
         fft = torch.stft(audio, n_fft=self.n_fft, hop_length=self.hop_length, win_length=self.win_length,
-                         window=self.window, center=False)
+                         window=self.window, center=False, return_complex=False)
         real_part, imag_part = fft.unbind(-1)
         magnitude = torch.sqrt(real_part ** 2 + imag_part ** 2)
         mel_output = torch.matmul(self.mel_basis, magnitude)
@@ -59,6 +63,122 @@ class Audio2Mel(nn.Module):
         return log_mel_spec
 
 
+def librosa_stft_pad_mode():
+    """
+    aukit用librosa.stft的默认pad_mode做center的padding：librosa 0.8是reflect，0.9以后是constant。
+    """
+    return inspect.signature(librosa.stft).parameters["pad_mode"].default
+
+
+class MelFrontend(nn.Module):
+    """
+    aukit.audio_griffinlim.mel_spectrogram的torch实现，可以在GPU上批量计算。
+
+    按hparams依次做preemphasis、center的padding、stft、mel、dB和normalization，
+    pad_len是在这之前两边额外做的reflect padding，输出再除以scale。
+    center_pad_mode对应librosa.stft的pad_mode，为None时和当前安装的librosa的默认值一致。
+    """
+
+    def __init__(self, hparams, pad_len=0, scale=1.0, center_pad_mode=None):
+        super().__init__()
+        if center_pad_mode is None:
+            center_pad_mode = librosa_stft_pad_mode()
+        if hparams.get("mel_basis") is not None:
+            mel_basis = np.asarray(hparams.mel_basis)
+        else:
+            mel_basis = librosa_mel_fn(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels,
+                                       fmin=hparams.fmin, fmax=hparams.fmax)
+        self.register_buffer("mel_basis", torch.from_numpy(mel_basis).float())
+        self.register_buffer("inv_mel_basis", torch.pinverse(self.mel_basis), persistent=False)
+        self.register_buffer("window", torch.hann_window(hparams.win_size).float())
+        self.n_fft = hparams.n_fft
+        self.hop_length = hparams.hop_size
+        self.win_length = hparams.win_size
+        self.preemphasis = hparams.preemphasis if hparams.preemphasize else 0.
+        self.center = hparams.center
+        self.center_pad_mode = center_pad_mode
+        self.min_level = float(np.exp(hparams.min_level_db / 20 * np.log(10)))
+        self.ref_level_db = hparams.ref_level_db
+        self.signal_normalization = hparams.signal_normalization
+        self.symmetric_mels = hparams.symmetric_mels
+        self.allow_clipping = hparams.allow_clipping_in_normalization
+        self.max_abs_value = hparams.max_abs_value
+        self.min_level_db = hparams.min_level_db
+        self.power = hparams.power
+        self.pad_len = pad_len
+        self.scale = scale
+
+    def forward(self, audio):
+        """
+        :param audio: (timesteps,)、(batch_size, timesteps)或(batch_size, 1, timesteps)
+        :return: (num_mels, frames)或(batch_size, num_mels, frames)
+        """
+        squeeze = audio.dim() == 1
+        audio = audio.reshape(-1, audio.shape[-1]).to(self.window.dtype)
+        if self.pad_len:
+            audio = F.pad(audio.unsqueeze(1), (self.pad_len, self.pad_len), "reflect").squeeze(1)
+        if self.preemphasis:
+            audio = torch.cat([audio[:, :1], audio[:, 1:] - self.preemphasis * audio[:, :-1]], dim=1)
+        if self.center:
+            p = self.n_fft // 2
+            audio = F.pad(audio.unsqueeze(1), (p, p), self.center_pad_mode).squeeze(1)
+        fft = torch.stft(audio, n_fft=self.n_fft, hop_length=self.hop_length, win_length=self.win_length,
+                         window=self.window, center=False, return_complex=False)
+        real_part, imag_part = fft.unbind(-1)
+        magnitude = torch.sqrt(real_part ** 2 + imag_part ** 2)
+        mel = torch.matmul(self.mel_basis, magnitude)
+        mel = 20 * torch.log10(torch.clamp(mel, min=self.min_level)) - self.ref_level_db
+        if self.signal_normalization:
+            ma, mi = self.max_abs_value, self.min_level_db
+            if self.symmetric_mels:
+                mel = (2 * ma) * ((mel - mi) / (-mi)) - ma
+                if self.allow_clipping:
+                    mel = torch.clamp(mel, -ma, ma)
+            else:
+                mel = ma * ((mel - mi) / (-mi))
+                if self.allow_clipping:
+                    mel = torch.clamp(mel, 0, ma)
+        if self.scale != 1:
+            mel = mel / self.scale
+        return mel.squeeze(0) if squeeze else mel
+
+    def inverse(self, mel, n_iters=30, momentum=0.99, lengths=None):
+        """
+        forward的逆变换，对应aukit.audio_griffinlim.inv_mel_spectrogram，
+        mel的伪逆矩阵只计算一次，用批量的快速Griffin-Lim重建语音。
+
+        :param mel: (num_mels, frames)或(batch_size, num_mels, frames)
+        :param lengths: 每条mel的有效帧数，为None时都是frames
+        :return: (timesteps,)或(batch_size, timesteps)
+        """
+        from mellotron.audio_processing import fast_griffin_lim
+
+        squeeze = mel.dim() == 2
+        mel = mel.reshape(-1, *mel.shape[-2:]).to(self.mel_basis.dtype)
+        if self.scale != 1:
+            mel = mel * self.scale
+        if self.signal_normalization:
+            ma, mi = self.max_abs_value, self.min_level_db
+            if self.symmetric_mels:
+                if self.allow_clipping:
+                    mel = torch.clamp(mel, -ma, ma)
+                mel = (mel + ma) * -mi / (2 * ma) + mi
+            else:
+                if self.allow_clipping:
+                    mel = torch.clamp(mel, 0, ma)
+                mel = mel * -mi / ma + mi
+        magnitude = torch.pow(10.0, (mel + self.ref_level_db) * 0.05)
+        magnitude = torch.clamp(torch.matmul(self.inv_mel_basis, magnitude), min=1e-10) ** self.power
+        audio = fast_griffin_lim(magnitude, self.n_fft, self.hop_length, self.win_length, self.window,
+                                 n_iters=n_iters, momentum=momentum, lengths=lengths)
+        if self.preemphasis:
+            audio = torch.from_numpy(signal.lfilter([1], [1, -self.preemphasis], audio.cpu().numpy(), axis=-1))
+            audio = audio.to(self.mel_basis)
+        if self.pad_len:
+            audio = audio[:, self.pad_len:-self.pad_len]
+        return audio.squeeze(0) if squeeze else audio
+
+
 class ResnetBlock(nn.Module):
     def __init__(self, dim, dilation=1):
         super().__init__()
@@ -55,23 +55,67 @@ def window_sumsquare(window, n_frames, hop_length=200, win_length=800, n_fft=800
     return x
 
 
-def griffin_lim(magnitudes, stft_fn, n_iters=30):
+def fast_griffin_lim(magnitudes, n_fft, hop_length, win_length=None, window=None, n_iters=32, momentum=0.99,
+                     lengths=None):
     """
+    Batched fast Griffin-Lim (Perraudin et al., 2013) on torch.stft.
+    The momentum term on the rebuilt spectrum converges in far fewer
+    iterations than plain Griffin-Lim, momentum=0 is plain Griffin-Lim.
+
     PARAMS
     ------
-    magnitudes: spectrogram magnitudes
-    stft_fn: STFT class with transform (STFT) and inverse (ISTFT) methods
+    magnitudes: (B, n_fft // 2 + 1, T) linear magnitudes
+    window: (win_length,) tensor, periodic hann by default
+    lengths: number of valid frames of each item, the frames and samples
+        past them are masked out so padding does not leak into the signal
+    RETURNS
+    -------
+    signal: (B, (T - 1) * hop_length)
     """
+    win_length = win_length or n_fft
+    if window is None:
+        window = torch.hann_window(win_length, dtype=magnitudes.dtype, device=magnitudes.device)
+    n_frames = magnitudes.size(-1)
+    n_samples = (n_frames - 1) * hop_length
+
+    mask = None
+    if lengths is not None:
+        lengths = torch.as_tensor(lengths, device=magnitudes.device)[:, None]
+        magnitudes = magnitudes * (torch.arange(n_frames, device=magnitudes.device) < lengths)[:, None, :]
+        mask = (torch.arange(n_samples, device=magnitudes.device) < (lengths - 1) * hop_length).to(magnitudes.dtype)
+
+    def inverse(angles):
+        signal = torch.istft(magnitudes * angles, n_fft, hop_length=hop_length, win_length=win_length,
+                             window=window, length=n_samples)
+        return signal if mask is None else signal * mask
+
+    angles = torch.exp(2j * np.pi * torch.rand_like(magnitudes))
+    rebuilt_prev = None
+    for i in range(n_iters):
+        rebuilt = torch.stft(inverse(angles), n_fft, hop_length=hop_length, win_length=win_length, window=window,
+                             pad_mode='reflect', return_complex=True)
+        angles = rebuilt
+        if momentum and rebuilt_prev is not None:
+            angles = angles - rebuilt_prev * (momentum / (1 + momentum))
+        angles = angles / (angles.abs() + 1e-16)
+        rebuilt_prev = rebuilt
+    return inverse(angles)
 
-    angles = np.angle(np.exp(2j * np.pi * np.random.rand(*magnitudes.size())))
-    angles = angles.astype(np.float32)
-    angles = torch.autograd.Variable(torch.from_numpy(angles))
-    signal = stft_fn.inverse(magnitudes, angles).squeeze(1)
 
-    for i in range(n_iters):
-        _, angles = stft_fn.transform(signal)
-        signal = stft_fn.inverse(magnitudes, angles).squeeze(1)
-    return signal
+def griffin_lim(magnitudes, stft_fn, n_iters=30, momentum=0.99, lengths=None):
+    """
+    PARAMS
+    ------
+    magnitudes: spectrogram magnitudes
+    stft_fn: STFT class, its filter_length, hop_length, win_length and window are used
+    """
+    if stft_fn.window is None:
+        window = torch.ones(stft_fn.win_length)
+    else:
+        window = torch.from_numpy(get_window(stft_fn.window, stft_fn.win_length, fftbins=True))
+    window = window.to(dtype=magnitudes.dtype, device=magnitudes.device)
+    return fast_griffin_lim(magnitudes, stft_fn.filter_length, stft_fn.hop_length, stft_fn.win_length,
+                            window=window, n_iters=n_iters, momentum=momentum, lengths=lengths)
 
 
 def dynamic_range_compression(x, C=1, clip_val=1e-5):
@@ -90,3 +134,50 @@ def dynamic_range_decompression(x, C=1):
     C: compression factor used to compress
     """
     return torch.exp(x) / C
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    import librosa
+
+    # 比较Griffin-Lim和快速Griffin-Lim收敛到同样质量需要的迭代次数和耗时，质量用spectral convergence衡量。
+    # python mellotron/audio_processing.py [wav_path ...]
+    n_fft, hop_length = 1024, 256
+    paths = sys.argv[1:] or [librosa.example('trumpet')]
+    wavs = [torch.from_numpy(librosa.load(path, sr=22050)[0]) for path in paths]
+    window = torch.hann_window(n_fft)
+    specs = [torch.stft(w, n_fft, hop_length=hop_length, window=window, return_complex=True).abs() for w in wavs]
+    lengths = [s.shape[-1] for s in specs]
+    magnitudes = torch.zeros(len(specs), n_fft // 2 + 1, max(lengths))
+    for num, spec in enumerate(specs):
+        magnitudes[num, :, :spec.shape[-1]] = spec
+
+    def convergence(signal):
+        out = []
+        for num, n_frames in enumerate(lengths):
+            wav = signal[num, :(n_frames - 1) * hop_length]
+            rebuilt = torch.stft(wav, n_fft, hop_length=hop_length, window=window, return_complex=True).abs()
+            out.append((torch.norm(rebuilt - specs[num]) / torch.norm(specs[num])).item())
+        return np.mean(out)
+
+    torch.manual_seed(0)
+    print('{:>6} {:>18} {:>18}'.format('iters', 'GLA conv (time)', 'FGLA conv (time)'))
+    for n_iters in [4, 8, 16, 32, 64, 128]:
+        row = []
+        for momentum in [0, 0.99]:
+            start = time.time()
+            signal = fast_griffin_lim(magnitudes, n_fft, hop_length, n_iters=n_iters, momentum=momentum,
+                                      lengths=lengths)
+            row.append('{:.4f} ({:.2f}s)'.format(convergence(signal), time.time() - start))
+        print('{:>6} {:>18} {:>18}'.format(n_iters, *row))
+
+    start = time.time()
+    for num, n_frames in enumerate(lengths):
+        fast_griffin_lim(magnitudes[num:num + 1, :, :n_frames], n_fft, hop_length, n_iters=32)
+    t_loop = time.time() - start
+    start = time.time()
+    fast_griffin_lim(magnitudes, n_fft, hop_length, n_iters=32, lengths=lengths)
+    print('32 iters, {} utterances: one by one {:.2f}s, batched {:.2f}s'.format(
+        len(lengths), t_loop, time.time() - start))
@@ -211,6 +211,13 @@ class TextMelLoader(torch.utils.data.Dataset):
 
         self.speaker_ids = speaker_ids
 
+        self.feature_cache = None
+        if hparams.get('feature_cache_dir') and self.mode:
+            from mellotron.feature_cache import FeatureCache
+            max_gb = hparams.get('feature_cache_max_gb')
+            self.feature_cache = FeatureCache(hparams.feature_cache_dir, hparams=hparams,
+                                              max_bytes=int(max_gb * 2 ** 30) if max_gb else None)
+
         if self.speaker_ids is None:
             self.speaker_ids = self.create_speaker_lookup_table(self.audiopaths_and_text)
 
@@ -245,7 +252,7 @@ class TextMelLoader(torch.utils.data.Dataset):
         return out
 
     def get_data_train_v2(self, data_dir):
-        text_data, mel_data, speaker_data, f0_data = self.get_data(data_dir)
+        text_data, mel_data, speaker_data, f0_data = self.get_data_cached(data_dir)
         assert mel_data.shape[1] < self.max_decoder_steps
         embed_data = np.zeros(256)  # 临时
 
@@ -295,6 +302,29 @@ class TextMelLoader(torch.utils.data.Dataset):
         embed = encoder.embed_utterance(wav_)
         return embed
 
+    def get_data_cached(self, audiopath_and_text):
+        """
+        rtvc模式的说话人向量每次随机截取2秒语音计算（数据增强），不缓存，命中时重新读语音计算。
+        """
+        from mellotron.utils import load_wav_to_torch
+
+        if self.feature_cache is None:
+            return self.get_data(audiopath_and_text)
+
+        audiopath, text, speaker = audiopath_and_text
+        key = self.feature_cache.key(audiopath, text, speaker)
+        out = self.feature_cache.get(key)
+        rtvc = self.hparams.train_mode.endswith('rtvc')
+        if out is None:
+            out = self.get_data(audiopath_and_text)
+            text, mel, speaker, f0 = out
+            self.feature_cache.put(key, (text, mel, None if rtvc else speaker, f0))
+        elif rtvc:
+            audio_norm, _ = load_wav_to_torch(audiopath, sr_force=self.stft.sampling_rate)
+            embed = self.get_embed(audio_norm.cpu().numpy())
+            out = (out[0], out[1], torch.from_numpy(embed)[None], out[3])
+        return out
+
     def get_data(self, audiopath_and_text):
         from mellotron.utils import load_wav_to_torch
 
@@ -372,16 +402,180 @@ class TextMelLoader(torch.utils.data.Dataset):
                 traceback.print_exc()
                 return
 
+    def get_lengths(self):
+        """
+        频谱长度，用于分桶。有特征缓存时读取缓存的mel帧数，
+        没有缓存的语音用文本长度乘以已缓存语音的帧数/文本长度的中位数估计，都没有缓存时直接用文本长度。
+        """
+        text_lengths = np.array([len(x[1]) if len(x) >= 2 else 0 for x in self.audiopaths_and_text])
+        if self.feature_cache is None:
+            return text_lengths
+
+        mel_lengths = np.zeros(len(text_lengths), dtype=np.int64)
+        for num, audiopath_and_text in enumerate(self.audiopaths_and_text):
+            try:
+                key = self.feature_cache.key(*audiopath_and_text)
+            except (OSError, TypeError, ValueError):
+                continue
+            mel_lengths[num] = self.feature_cache.get_mel_length(key) or 0
+
+        cached = (mel_lengths > 0) & (text_lengths > 0)
+        if not cached.any():
+            return text_lengths
+        ratio = np.median(mel_lengths[cached] / text_lengths[cached])
+        return np.where(mel_lengths > 0, mel_lengths, np.round(text_lengths * ratio).astype(np.int64))
+
     def __len__(self):
         return len(self.audiopaths_and_text)
 
 
+class TextMelShardLoader(torch.utils.data.Dataset):
+    """
+        从preprocess.py生成的分片读取训练数据，数据是np.memmap的视图，不需要每条数据打开文件。
+        返回的数据和TextMelLoader训练模式的一致。
+    """
+    def __init__(self, shard_dir, hparams, speaker_ids=None, indices=None):
+        from mellotron.layers import TacotronSTFT
+        from mellotron.shards import ShardReader
+
+        self.hparams = hparams
+        self.reader = ShardReader(shard_dir)
+        self.stft = TacotronSTFT(hparams.filter_length, hparams.hop_length, hparams.win_length, hparams.n_mel_channels,
+                                 hparams.sampling_rate, hparams.mel_fmin, hparams.mel_fmax)
+        self.speaker_ids = speaker_ids or self.reader.info.get('speaker_ids', {})
+
+        if indices is None:
+            indices = range(len(self.reader))
+        # 过长的语音不参与训练，长度直接从分片的offsets得到。
+        mel_lengths = self.reader.lengths('mel')
+        self.indices = [idx for idx in indices if mel_lengths[idx] < hparams.max_decoder_steps]
+
+    def get_data_train(self, index):
+        f0 = self.reader.get(index, 'f0')
+        return transform_data_train(
+            hparams=self.hparams,
+            text_data=self.reader.get(index, 'text'),
+            mel_data=self.reader.get(index, 'mel').T,
+            speaker_data=self.reader.get(index, 'speaker'),
+            f0_data=None if f0 is None else f0.T,
+            embed_data=self.reader.get(index, 'embed') if 'embed' in self.reader.fields else np.zeros(256))
+
+    def get_lengths(self):
+        """频谱长度，从分片的offsets得到。"""
+        return self.reader.lengths('mel')[self.indices]
+
+    def __getitem__(self, index):
+        return self.get_data_train(self.indices[index])
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+        按长度分桶的BatchSampler，把长度相近的语音放在同一个batch，减少pad。
+        1) 每个epoch用seed + epoch打乱，切成batch_size * bucket_size_multiplier大小的桶，桶内按长度排序后切分batch；
+        2) max_frames > 0时按帧数预算组batch：batch的样本数 * 最大长度不超过max_frames；
+        3) 分布式训练时和DistributedSampler一样，每个rank取batch的一个子集，各rank的batch数相同。
+    """
+    def __init__(self, lengths, batch_size, max_frames=0, num_replicas=None, rank=None, shuffle=True, seed=0,
+                 drop_last=True, bucket_size_multiplier=100):
+        if num_replicas is None:
+            num_replicas = torch.distributed.get_world_size() if torch.distributed.is_initialized() else 1
+        if rank is None:
+            rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_frames = max_frames
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.bucket_size = batch_size * bucket_size_multiplier
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._batches = None
+
+    def _split_bucket(self, bucket):
+        batches = []
+        if self.max_frames > 0:
+            batch, max_len = [], 0
+            for idx in bucket:
+                length = max(self.lengths[idx], 1)
+                if batch and max(max_len, length) * (len(batch) + 1) > self.max_frames:
+                    batches.append(batch)
+                    batch, max_len = [], 0
+                batch.append(idx)
+                max_len = max(max_len, length)
+            if batch:
+                batches.append(batch)
+        else:
+            batches = [bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size)]
+            if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+                batches = batches[:-1]
+        return batches
+
+    def create_batches(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = indices[start:start + self.bucket_size]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind='stable')].tolist()
+            batches.extend(self._split_bucket(bucket))
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # 各rank的batch数要一致。
+        n_batches = len(batches) // self.num_replicas * self.num_replicas
+        return batches[self.rank:n_batches:self.num_replicas]
+
+    def get_batches(self):
+        if self._batches is None:
+            self._batches = self.create_batches()
+        return self._batches
+
+    def __iter__(self):
+        return iter(self.get_batches())
+
+    def __len__(self):
+        return len(self.get_batches())
+
+
 class TextMelCollate:
     """ Zero-pads model inputs and targets based on number of frames per setep
     """
-    def __init__(self, n_frames_per_step, mode='train'):
+    def __init__(self, n_frames_per_step, mode='train', pin_memory=False, n_buffers=0):
+        """
+        pin_memory: 在锁页内存中组batch，便于异步拷贝到显卡，只在collate运行在主进程（num_workers=0）时有效。
+        n_buffers: batch轮流复用n_buffers块内存，0则每个batch新分配。
+            每块内存按用到的最大大小（取2的幂）分配，切出需要的部分，总内存不随batch形状的种类增长。
+            复用时，一个batch要在之后第n_buffers个batch生成前用完。
+        """
         self.n_frames_per_step = n_frames_per_step
         self.train_mode = mode == 'train'
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.n_buffers = n_buffers
+        self._buffers = {}
+
+    def _get_buffer(self, numel, dtype):
+        # 返回的内存没有清零，由调用方写满。
+        if self.n_buffers <= 0:
+            return torch.empty(numel, dtype=dtype, pin_memory=self.pin_memory)
+
+        ring, num = self._buffers.get(dtype, ([None] * self.n_buffers, 0))
+        slot = num % self.n_buffers
+        if ring[slot] is None or ring[slot].numel() < numel:
+            ring[slot] = torch.empty(1 << max(numel - 1, 0).bit_length(), dtype=dtype, pin_memory=self.pin_memory)
+        self._buffers[dtype] = (ring, num + 1)
+        return ring[slot][:numel]
 
     def __call__(self, batch):
         """Collate's training batch from normalized text and mel-spectrogram
@@ -389,6 +583,85 @@ class TextMelCollate:
         ------
         batch: [text_normalized, mel_normalized]
         """
+        n_batch = len(batch)
+        text_lengths = torch.LongTensor([len(x[0]) for x in batch])
+        if self.train_mode:
+            input_lengths, ids_sorted_decreasing = torch.sort(text_lengths, dim=0, descending=True)
+            batch = [batch[i] for i in ids_sorted_decreasing.tolist()]
+        else:
+            # 推理模式不要排序
+            input_lengths = text_lengths
+        max_input_len = int(input_lengths.max())
+
+        texts = [x[0] for x in batch]
+        mels = [x[1] for x in batch]
+        speakers = [x[2] for x in batch]
+        f0s = [x[3] for x in batch]
+
+        num_mels = mels[0].size(0)
+        output_lengths = torch.LongTensor([mel.size(1) for mel in mels])
+        max_target_len = int(output_lengths.max())
+        if max_target_len % self.n_frames_per_step != 0:
+            max_target_len += self.n_frames_per_step - max_target_len % self.n_frames_per_step
+            assert max_target_len % self.n_frames_per_step == 0
+
+        with_f0 = [isinstance(f0, torch.Tensor) for f0 in f0s]
+        if any(with_f0) and not all(with_f0):
+            raise ValueError('The f0 of a batch must be all tensors or all None.')
+        num_f0s = f0s[0].size(0) if with_f0[0] else 0
+        # speaker为(1,)的整数id或者(1, dim)的向量
+        num_speaker_ids = speakers[0].size(1) if speakers[0].dim() == 2 else 0
+
+        # 浮点数和整数各用一块连续内存，切分为各个输出。
+        # include mel padded, gate padded and speaker ids
+        # mel频谱pad很小的负数才是静音，pad数字0是很大声的噪声
+        # 如果pad为很小的负数，训练不起来，原因未知
+        sizes_float = [n_batch * num_mels * max_target_len, n_batch * max_target_len,
+                       n_batch * num_f0s * max_target_len, n_batch * num_speaker_ids]
+        sizes_long = [n_batch * max_input_len, n_batch, 0 if num_speaker_ids else n_batch]
+        buf_float = self._get_buffer(sum(sizes_float), torch.float)
+        buf_long = self._get_buffer(sum(sizes_long), torch.long)
+        mel_padded, gate_padded, f0_padded, speaker_float = buf_float.split(sizes_float)
+        text_padded, output_lengths_buf, speaker_long = buf_long.split(sizes_long)
+
+        text_padded = text_padded.view(n_batch, max_input_len)
+        mel_padded = mel_padded.view(n_batch, num_mels, max_target_len)
+        gate_padded = gate_padded.view(n_batch, max_target_len)
+
+        text_mask = torch.arange(max_input_len)[None] < input_lengths[:, None]
+        text_padded.zero_()[text_mask] = torch.cat(texts).long()
+
+        frames = torch.arange(max_target_len)[None]
+        gate_padded.copy_(frames >= (output_lengths - 1)[:, None])
+        if num_speaker_ids == 0:
+            speaker_ids = speaker_long.copy_(torch.cat(speakers))
+        else:
+            speaker_ids = speaker_float.view(n_batch, num_speaker_ids).copy_(torch.cat(speakers))
+
+        # 频谱是batch中最大的数据，逐条拷贝只写一遍内存，比掩码赋值快；只把pad的部分清零。
+        if num_f0s:
+            f0_padded = f0_padded.view(n_batch, num_f0s, max_target_len)
+        for i, (mel, f0) in enumerate(zip(mels, f0s)):
+            mel_padded[i, :, :mel.size(1)].copy_(mel)
+            mel_padded[i, :, mel.size(1):].zero_()
+            if num_f0s:
+                f0_padded[i, :, :f0.size(1)].copy_(f0)
+                f0_padded[i, :, f0.size(1):].zero_()
+        if not num_f0s:
+            f0_padded = None
+        output_lengths = output_lengths_buf.copy_(output_lengths)
+
+        # fixme 为了推理能够用batch
+        input_lengths = torch.ones_like(input_lengths) * max_input_len
+
+        return text_padded, input_lengths, mel_padded, gate_padded, output_lengths, speaker_ids, f0_padded
+
+    def collate_loop(self, batch):
+        """Collate's training batch with per-sample copies, reference of __call__
+        PARAMS
+        ------
+        batch: [text_normalized, mel_normalized]
+        """
         # Right zero-pad all one-hot text sequences to max input length
         input_lengths, ids_sorted_decreasing = torch.sort(torch.LongTensor([len(x[0]) for x in batch]), dim=0,
                                                           descending=True)
@@ -455,3 +728,35 @@ class TextMelCollate:
         input_lengths = torch.ones_like(input_lengths) * max_input_len
 
         return text_padded, input_lengths, mel_padded, gate_padded, output_lengths, speaker_ids, f0_padded
+
+
+if __name__ == "__main__":
+    import time
+
+    # 对比逐条拷贝的collate，并测试速度。
+    n_mels = 80
+    for n_frames_per_step, with_f0, spk_dim in [(1, True, 0), (2, False, 32)]:
+        collate = TextMelCollate(n_frames_per_step)
+        for batch_size in [16, 32, 64, 128]:
+            batch = []
+            for _ in range(batch_size):
+                n_text, n_frame = np.random.randint(20, 150), np.random.randint(100, 800)
+                speaker = torch.randn(1, spk_dim) if spk_dim else torch.IntTensor([np.random.randint(10)])
+                f0 = torch.randn(1, n_frame - np.random.randint(3)) if with_f0 else None
+                batch.append((torch.randint(0, 145, (n_text,)).int(), torch.randn(n_mels, n_frame), speaker, f0))
+
+            outs_loop = collate.collate_loop(batch)
+            outs = collate(batch)
+            for a, b in zip(outs_loop, outs):
+                assert (a is None and b is None) or torch.equal(a, b.to(a.dtype))
+
+            n_loop = 20
+            t0 = time.perf_counter()
+            for _ in range(n_loop):
+                collate.collate_loop(batch)
+            t1 = time.perf_counter()
+            for _ in range(n_loop):
+                collate(batch)
+            t2 = time.perf_counter()
+            print('batch_size: {}, f0: {}, collate_loop: {:.2f}ms, collate: {:.2f}ms'.format(
+                batch_size, with_f0, (t1 - t0) / n_loop * 1000, (t2 - t1) / n_loop * 1000))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+训练特征的本地缓存。
+
+把TextMelLoader.get_data得到的text/mel/speaker/f0保存为npz文件，
+键由语音路径、语音文件的mtime和size、文本、说话人以及相关的hparams决定，
+第二轮及以后的epoch直接读取缓存，不再解码语音、计算频谱和基频。
+"""
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+import torch
+
+from mellotron.npz_store import NpzStore
+
+# 影响特征结果的hparams，修改其中任意一个都会使缓存失效。
+feature_hparams_keys = ('sampling_rate', 'max_wav_value', 'filter_length', 'hop_length', 'win_length',
+                        'n_mel_channels', 'mel_fmin', 'mel_fmax', 'f0_min', 'f0_max', 'harm_thresh',
+                        'prenet_f0_dim', 'text_cleaners', 'train_mode', 'encoder_model_fpath')
+
+_fields = ('text', 'mel', 'speaker', 'f0')
+
+
+def hash_hparams(hparams, keys=feature_hparams_keys):
+    """
+    相关hparams的md5。
+    """
+    obj = {k: str(hparams.get(k)) for k in keys}
+    return hashlib.md5(json.dumps(obj, sort_keys=True).encode('utf8')).hexdigest()
+
+
+class FeatureCache(NpzStore):
+    """
+    按内容寻址的特征缓存，多个DataLoader的worker可以共用同一个目录，文件的读写和淘汰见NpzStore。
+    """
+
+    def __init__(self, cache_dir, hparams, max_bytes=None):
+        super().__init__(cache_dir, max_bytes=max_bytes)
+        self.hparams_hash = hash_hparams(hparams)
+
+    def key(self, audiopath, text, speaker):
+        stat = os.stat(audiopath)
+        obj = [os.path.abspath(audiopath), stat.st_mtime_ns, stat.st_size, text, speaker, self.hparams_hash]
+        return hashlib.md5(json.dumps(obj, ensure_ascii=False).encode('utf8')).hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存，没有则返回None。
+        """
+        return self.load(key, lambda data: tuple(torch.from_numpy(data[k]) if k in data else None for k in _fields))
+
+    def get_mel_length(self, key):
+        """
+        缓存的mel帧数，只读取npz中mel.npy的文件头，没有则返回None。
+        """
+        try:
+            with zipfile.ZipFile(self.path(key)) as zf, zf.open('mel.npy') as fin:
+                if np.lib.format.read_magic(fin) == (1, 0):
+                    shape = np.lib.format.read_array_header_1_0(fin)[0]
+                else:
+                    shape = np.lib.format.read_array_header_2_0(fin)[0]
+        except (FileNotFoundError, OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        return shape[-1]
+
+    def put(self, key, data):
+        """
+        保存(text, mel, speaker, f0)，值为None的项不保存。
+        """
+        arrays = {k: v.cpu().numpy() if isinstance(v, torch.Tensor) else np.asarray(v)
+                  for k, v in zip(_fields, data) if v is not None}
+        self.save(key, arrays)
@@ -43,6 +43,9 @@ def create_hparams(hparams_string=None, level=2):
         text_cleaners='hanzi',  # ['chinese_cleaners'],
         p_arpabet=1.0,
         cmudict_path=None,  # "data/cmu_dictionary",
+        shards_dir=None,  # preprocess.py生成的分片目录，设置则训练时从分片读取数据。
+        feature_cache_dir=None,  # 设置目录则缓存训练特征，第二轮epoch开始不再重新计算频谱和基频。
+        feature_cache_max_gb=50,  # 特征缓存的最大占用空间，超过则删除最久没用的缓存。
 
         # Audio Parameters
         max_wav_value=32768.0,
@@ -120,6 +123,8 @@ def create_hparams(hparams_string=None, level=2):
         weight_decay=1e-6,
         grad_clip_thresh=1.0,
         batch_size=32,  # 32,
+        bucket_batch=False,  # 按长度分桶组batch，减少pad。
+        batch_max_frames=0,  # 分桶时每个batch的帧数预算（样本数*最大帧数），0则用batch_size。
         mask_padding=True,  # set model's padded outputs to padded values
     ))
 
@@ -16,6 +16,7 @@ from tqdm import tqdm
 
 from .data_utils import TextMelLoader, TextMelCollate
 from .hparams import create_hparams, Dict2Obj
+from .inference_cache import InferenceCache, ResultStore
 from .layers import TacotronSTFT
 from .model import load_model
 
@@ -23,6 +24,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(Path(__file__).stem)
 
 _model = None
+_cache = None
 _device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 
@@ -63,16 +65,36 @@ def is_loaded():
     return _model is not None
 
 
-def generate_mel(text, style, speaker, f0, **kwargs):
+def enable_cache(max_memory=256, max_outputs_memory=256, store_dir='', max_store_memory=0, trust_version=True):
     """
-    用语音合成模型把文本转为mel频谱。
+    generate_mel缓存重复文本的encoder输出，prenet不用dropout或者给了seed时还缓存整个输出。
+    缓存的键里有模型参数的md5，默认按参数的版本号判断参数是否修改过。
+    通过.data原地修改参数（例如fp16_optimizer的step）不改变版本号，这时要把trust_version设为False，
+    或者修改后调用返回的缓存的clear，否则会继续返回旧参数的结果。
+
+    :param max_memory: encoder输出缓存的内存上限（MB），为0则关闭缓存。
+    :param max_outputs_memory: 整个输出缓存的内存上限（MB）。
+    :param store_dir: 整个输出同时保存到这个目录，为空则不保存到磁盘。
+    :param max_store_memory: 磁盘上保存的结果的大小上限（MB），为0则不限制。
+    :param trust_version: 为False时每次请求都按参数内容计算模型的md5（Tacotron2单线程CPU约75ms）。
+    """
+    global _cache
+    store = ResultStore(store_dir, max_store_memory * 2 ** 20 or None) if store_dir else None
+    _cache = InferenceCache(max_memory * 2 ** 20, max_outputs_memory * 2 ** 20, store=store,
+                            trust_version=trust_version) if max_memory else None
+    return _cache
+
+
+def generate_mel(text, style, speaker, f0, seed=None, **kwargs):
+    """
+    用语音合成模型把文本转为mel频谱，给了seed时prenet的dropout用这个种子，结果可以复现。
     """
     global _model
     if not is_loaded():
         load_mellotron_torch(**kwargs)
 
     with torch.no_grad():
-        mels, mels_postnet, gates, alignments = _model.inference((text, style, speaker, f0))
+        mels, mels_postnet, gates, alignments = _model.inference((text, style, speaker, f0), cache=_cache, seed=seed)
         gates = torch.sigmoid(gates)
         alignments = alignments.permute(0, 2, 1)
         return mels, mels_postnet, gates, alignments
@@ -94,9 +116,9 @@ def generate_mel_batch(model, inpath, batch_size, hparams, **kwargs):
         mels, mels_postnet, gates, alignments = [], [], [], []
         for i, batch in enumerate(tqdm(val_loader, 'mellotron', ncols=100)):
             x, y = model.parse_batch(batch)  # y: 2部分
-            y_pred = model.inference((x[0], x[2], x[5], x[6]))
+            y_pred = model.inference_batch((x[0], x[2], x[5], x[6]), input_lengths=x[1])
 
-            mel_outputs, mel_outputs_postnet, gate_outputs, alignment_outputs = y_pred
+            mel_outputs, mel_outputs_postnet, gate_outputs, alignment_outputs, output_lengths = y_pred
 
             # wav_outputs = valset.stft.griffin_lim(mel_outputs_postnet, n_iters=5, denoiser_strength=0)
 
@@ -106,9 +128,8 @@ def generate_mel_batch(model, inpath, batch_size, hparams, **kwargs):
             out_gates = torch.sigmoid(gate_outputs.data).cpu().numpy()
             # out_wavs = wav_outputs.data.cpu().numpy()
 
-            for out_mel, out_mel_postnet, out_align, out_gate in zip(out_mels, out_mels_postnet, out_aligns, out_gates):
-                end_idx = np.argmax(out_gate > 0.5) or out_gate.shape[0]
-
+            for out_mel, out_mel_postnet, out_align, out_gate, end_idx in zip(
+                    out_mels, out_mels_postnet, out_aligns, out_gates, output_lengths.tolist()):
                 out_mel = out_mel[:, :end_idx]
                 out_mel_postnet = out_mel_postnet[:, :end_idx]
                 out_align = out_align.T[:, :end_idx]
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Mellotron推理的缓存。
+
+线上的请求有大量重复的文本（问候语、IVR提示音、换说话人的固定模板），
+Tacotron2.inference每次都要重新计算embedding、encoder、说话人和GST的编码以及attention的memory_layer。
+InferenceCache分两级缓存：
+    memory: (文本, 风格, 说话人) -> (encoder_outputs, processed_memory)；
+    outputs: (文本, 风格, 说话人, 基频, 种子) -> 整个inference的输出，只在解码确定（prenet不用dropout或者给了种子）时使用。
+
+两级都按占用的字节数做LRU淘汰，键里带有模型参数的md5，参数被修改（load_state_dict、训练）后旧的缓存不再命中。
+
+整个输出还可以保存到磁盘（ResultStore），多个进程和重启后共用，重复的请求只需要读文件的时间。
+"""
+import hashlib
+import weakref
+from collections import OrderedDict
+
+import torch
+
+from mellotron import model as mellotron_model
+from mellotron.npz_store import NpzStore
+
+
+def tensor_hash(x):
+    """
+    张量（或者int、None）内容的md5。
+    """
+    if not isinstance(x, torch.Tensor):
+        return repr(x)
+    x = x.detach().cpu().contiguous()
+    md5 = hashlib.md5('{}{}'.format(x.dtype, tuple(x.shape)).encode('utf8'))
+    md5.update(x.numpy().tobytes())
+    return md5.hexdigest()
+
+
+def weights_key(model):
+    """
+    模型参数的指纹，由每个参数的地址和版本号（原地修改一次加1）决定，不读取参数的数据。
+    通过.data原地修改（例如fp16_optimizer把fp32参数拷回模型）时地址和版本号都不变，指纹也不变。
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    obj = [(w.data_ptr(), w._version) for w in tensors]
+    return hashlib.md5(repr(obj).encode('utf8')).hexdigest()
+
+
+_model_hashes = weakref.WeakKeyDictionary()
+
+
+def model_hash(model, trust_version=True):
+    """
+    模型参数内容的md5，和设备、进程无关。
+    trust_version为True时按weights_key记住结果，参数没有修改时不重新计算；
+    为False时每次都读取参数计算（Tacotron2约7M参数，单线程CPU约75ms）。
+    """
+    key = weights_key(model)
+    cached = _model_hashes.get(model)
+    if trust_version and cached is not None and cached[0] == key:
+        return cached[1]
+    md5 = hashlib.md5()
+    for name, value in model.state_dict().items():
+        md5.update(name.encode('utf8'))
+        md5.update(tensor_hash(value).encode('utf8'))
+    _model_hashes[model] = (key, md5.hexdigest())
+    return _model_hashes[model][1]
+
+
+def nbytes(value):
+    return sum(w.element_size() * w.nelement() for w in value if isinstance(w, torch.Tensor))
+
+
+class LRUCache:
+    """
+    按字节数限制大小的LRU缓存，值为张量的tuple或list。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return
+        if key in self.data:
+            self.size -= nbytes(self.data.pop(key))
+        self.data[key] = value
+        self.size += size
+        while self.size > self.max_bytes:
+            _, old = self.data.popitem(last=False)
+            self.size -= nbytes(old)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.data)
+
+
+_output_names = ('mel_outputs', 'mel_outputs_postnet', 'gate_outputs', 'alignments')
+
+
+class ResultStore(NpzStore):
+    """
+    磁盘上的合成结果，每个结果一个npz文件，多个进程可以共用同一个目录，文件的读写和淘汰见NpzStore。
+    """
+    # 结果的保存格式或者键的含义改变时加1，旧的文件不再命中，由LRU淘汰。
+    format_version = 1
+
+    def name(self, key):
+        return hashlib.md5(repr((self.format_version,) + tuple(key)).encode('utf8')).hexdigest()
+
+    def get(self, key, device=None):
+        """
+        读取结果[mel_outputs, mel_outputs_postnet, gate_outputs, alignments]，没有则返回None。
+        """
+        return self.load(self.name(key), lambda data: [torch.from_numpy(data[k]).to(device) for k in _output_names])
+
+    def put(self, key, outputs):
+        self.save(self.name(key), {k: v.detach().cpu().numpy() for k, v in zip(_output_names, outputs)})
+
+
+class InferenceCache:
+    """
+    Tacotron2.inference的缓存，用法：model.inference(inputs, cache=cache)。
+    缓存的张量直接返回，不要原地修改。
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, max_outputs_bytes=256 * 2 ** 20, store=None, trust_version=True):
+        """
+        :param max_bytes: encoder_outputs和processed_memory缓存的字节数上限。
+        :param max_outputs_bytes: 整个输出缓存的字节数上限，为0则不缓存输出。
+        :param store: ResultStore，内存中没有命中的输出再到磁盘上找。
+        :param trust_version: 为True时用参数的版本号判断参数是否修改过；
+            模型参数会通过.data原地修改（例如一边用fp16_optimizer训练一边合成）时设为False，
+            每次请求都按参数内容计算模型的md5，或者在修改后调用clear。
+        """
+        self.memory = LRUCache(max_bytes)
+        self.outputs = LRUCache(max_outputs_bytes)
+        self.store = store
+        self.trust_version = trust_version
+
+    def memory_key(self, model, text, style_input, speaker_ids):
+        """
+        (模型参数md5, 设备, 文本, 风格, 说话人)，磁盘上的键不含设备。
+        """
+        device = str(next(model.parameters()).device)
+        return model_hash(model, self.trust_version), device, tensor_hash(text), tensor_hash(style_input), tensor_hash(speaker_ids)
+
+    def get_memory(self, model, text, style_input, speaker_ids):
+        """
+        (encoder_outputs, processed_memory)，没有命中时用模型计算并缓存。
+        """
+        key = self.memory_key(model, text, style_input, speaker_ids)
+        value = self.memory.get(key)
+        if value is None:
+            encoder_outputs = model.encode(text, style_input, speaker_ids)
+            value = (encoder_outputs, model.decoder.attention_layer.memory_layer(encoder_outputs))
+            self.memory.put(key, value)
+        return value
+
+    def outputs_key(self, model, inputs, seed=None):
+        """
+        seed为prenet dropout的随机数种子，prenet不用dropout时为None。
+        除了输入，键里还有影响解码结果的设置：prenet的drop_rate、每步的帧数、最多步数和gate的阈值。
+        """
+        text, style_input, speaker_ids, f0s = inputs
+        decoder = model.decoder
+        return self.memory_key(model, text, style_input, speaker_ids) + (
+            tensor_hash(f0s), seed, mellotron_model.drop_rate, decoder.n_frames_per_step,
+            decoder.max_decoder_steps, decoder.gate_threshold)
+
+    def get_outputs(self, key, device=None):
+        outputs = self.outputs.get(key) if self.outputs.max_bytes else None
+        if outputs is None and self.store is not None:
+            outputs = self.store.get(key[:1] + key[2:], device)
+            if outputs is not None and self.outputs.max_bytes:
+                self.outputs.put(key, outputs)
+        return outputs
+
+    def put_outputs(self, key, outputs):
+        if self.outputs.max_bytes:
+            self.outputs.put(key, list(outputs))
+        if self.store is not None:
+            self.store.put(key[:1] + key[2:], outputs)
+
+    def clear(self):
+        """
+        通过.data原地修改参数时版本号不变，trust_version为True的缓存发现不了，修改后需要调用clear。
+        """
+        self.memory.clear()
+        self.outputs.clear()
+        _model_hashes.clear()
+
+    def stats(self):
+        out = {name: {'hits': c.hits, 'misses': c.misses, 'evictions': c.evictions, 'items': len(c),
+                      'bytes': c.size}
+               for name, c in [('memory', self.memory), ('outputs', self.outputs)]}
+        if self.store is not None:
+            out['store'] = {'hits': self.store.hits, 'misses': self.store.misses}
+        return out
+
+
+if __name__ == "__main__":
+    import time
+
+    from mellotron.hparams import create_hparams
+
+    # 重复的提示语：不缓存、只缓存memory（prenet有dropout）、缓存整个输出（关掉dropout）的耗时。
+    torch.manual_seed(0)
+    hparams = create_hparams()
+    hparams.max_decoder_steps = 200
+    model = mellotron_model.Tacotron2(hparams).eval()
+    decoder = model.decoder
+    decoder.gate_layer.forward = lambda x: (decoder.attention_weights_cum.sum(1, keepdim=True)
+                                            - 4 * (decoder.attention_weights_cum > 0).sum(1, keepdim=True) + 0.5)
+    prompts = [torch.randint(1, hparams.n_symbols, (1, n)) for n in (20, 35, 50)]
+    speakers = [torch.randn(1, hparams.n_speakers) for _ in range(2)]
+    requests = [(prompts[k % 3], speakers[k % 2]) for k in range(30)]
+
+    def run(cache):
+        start = time.time()
+        with torch.no_grad():
+            outputs = [model.inference((text, 0, speaker, None), cache=cache) for text, speaker in requests]
+        return outputs, time.time() - start
+
+    _, t_none = run(None)
+    cache = InferenceCache()
+    _, t_memory = run(cache)
+    print('dropout on: no cache {:.2f}s, memory cache {:.2f}s'.format(t_none, t_memory))
+    print(cache.stats())
+
+    mellotron_model.drop_rate = 0.
+    outputs_none, t_none = run(None)
+    cache = InferenceCache()
+    outputs, t_outputs = run(cache)
+    diff = max((a[1] - b[1]).abs().max().item() for a, b in zip(outputs_none, outputs))
+    print('dropout off: no cache {:.2f}s, outputs cache {:.2f}s, max diff {:.2e}'.format(t_none, t_outputs, diff))
+    print(cache.stats())
+
+    # 修改参数后缓存失效
+    state_dict = model.state_dict()
+    state_dict['decoder.linear_projection.linear_layer.weight'] = state_dict[
+        'decoder.linear_projection.linear_layer.weight'] * 1.01
+    model.load_state_dict(state_dict)
+    run(cache)
+    print('after load_state_dict:', cache.stats())
+
+    # 打开dropout，用种子合成：同样的种子结果相同；磁盘上的结果换一个InferenceCache（相当于重启）后还能命中。
+    import tempfile
+
+    mellotron_model.drop_rate = 0.5
+    with torch.no_grad():
+        text, speaker = requests[0]
+        a, b, c = [model.inference((text, 0, speaker, None), seed=seed)[1] for seed in (1, 1, 2)]
+    print('seed 1 vs seed 1: {:.2e}, seed 1 vs seed 2: {:.2e}'.format((a - b).abs().max().item(),
+                                                                    (a - c).abs().max().item()))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def run_seeded(cache):
+            start = time.time()
+            with torch.no_grad():
+                for k, (text, speaker) in enumerate(requests[:6]):
+                    model.inference((text, 0, speaker, None), cache=cache, seed=k)
+            return time.time() - start
+
+        t_first = run_seeded(InferenceCache(store=ResultStore(tmpdir)))
+        cache = InferenceCache(store=ResultStore(tmpdir))
+        t_store = run_seeded(cache)
+        print('seeded, 6 requests: synthesize and store {:.2f}s, read from store {:.3f}s'.format(t_first, t_store))
+        print(cache.stats())
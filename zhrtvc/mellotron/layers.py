@@ -1,3 +1,8 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
 import torch
 from librosa.filters import mel as librosa_mel_fn
 
@@ -57,9 +62,10 @@ class TacotronSTFT(torch.nn.Module):
         self.register_buffer('mel_basis', mel_basis)
         self.denoiser = None
         self.denoiser_mode = ''
+        self.denoisers = {}
 
     def create_denoiser(self, vocoder=None, mode='zeros'):
-        voc = vocoder or self.griffin_lim_
+        voc = vocoder or self.griffin_lim
         self.denoiser_mode = mode
         self.denoiser = Denoiser(vocoder=voc, stft=self.stft_fn, mode=mode)
 
@@ -89,55 +95,159 @@ class TacotronSTFT(torch.nn.Module):
         mel_output = self.spectral_normalize(mel_output)
         return mel_output
 
-    def griffin_lim(self, x, n_iters=5):
-        mel_decompress = self.spectral_de_normalize(x)
-        mel_decompress = mel_decompress.transpose(1, 2).data.cpu()
+    def griffin_lim(self, x, n_iters=5, lengths=None):
+        """
+        Batched on the device of x, lengths are the valid frames of each mel.
+        """
+        mel_decompress = self.spectral_de_normalize(x.data.to(self.mel_basis))
         spec_from_mel_scaling = 100
-        mel_batch = []
-        for mel_one in mel_decompress:
-            spec_from_mel = torch.mm(mel_one, self.mel_basis)
-            spec_from_mel = spec_from_mel.transpose(0, 1).unsqueeze(0)
-            spec_from_mel = spec_from_mel * spec_from_mel_scaling
-            mel_batch.append(spec_from_mel)
-
-        mel_batch = torch.cat(mel_batch, dim=0)
-
-        return griffin_lim(torch.autograd.Variable(mel_batch[:, :, :-1]), self.stft_fn, n_iters)
+        magnitudes = torch.matmul(self.mel_basis.t(), mel_decompress) * spec_from_mel_scaling
+        return griffin_lim(magnitudes, self.stft_fn, n_iters, lengths=lengths)
 
     def griffin_lim_denoiser(self, x, n_iters=5, denoiser_mode='zeros', denoiser_strength=0):
-        wav_outputs = self.griffin_lim_(x, n_iters=n_iters)
-        if self.denoiser_mode != denoiser_mode or self.denoiser is None:
-            voc = lambda x: self.griffin_lim_(x, n_iters=n_iters)
+        wav_outputs = self.griffin_lim(x, n_iters=n_iters)
+        # one denoiser per (mode, n_iters), switching modes does not recompute the bias
+        key = (denoiser_mode, n_iters)
+        if key not in self.denoisers:
+            voc = lambda x: self.griffin_lim(x, n_iters=n_iters)
             self.create_denoiser(vocoder=voc, mode=denoiser_mode)
+            self.denoisers[key] = self.denoiser
+        self.denoiser = self.denoisers[key]
+        self.denoiser_mode = denoiser_mode
 
         wav_outputs = self.denoiser(wav_outputs, denoiser_strength)
 
         return wav_outputs.squeeze(1)
 
 
+_bias_spec_cache = {}
+
+
+def checkpoint_hash(model_path):
+    """
+    Fingerprint of a checkpoint file from its size and mtime, cheap enough
+    to compute on every load.
+    """
+    stat = os.stat(model_path)
+    return hashlib.md5('{}-{}'.format(stat.st_size, stat.st_mtime_ns).encode('utf8')).hexdigest()
+
+
+def bias_spec_path(model_path, mode, stft):
+    """
+    xxx.pt -> xxx.denoiser-<mode>-<filter_length>-<hop_length>-<win_length>.pt
+    """
+    return Path(model_path).with_suffix('.denoiser-{}-{}-{}-{}.pt'.format(
+        mode, stft.filter_length, stft.hop_length, stft.win_length))
+
+
+def compute_bias_spec(vocoder, stft, mode='zeros', dtype=torch.float, device=None):
+    """
+    Magnitude of the audio the vocoder produces for a silent (zeros) or
+    random (normal) mel, first frame only, as float on cpu.
+    """
+    if mode == 'zeros':
+        mel_input = torch.zeros((1, 80, 88), dtype=dtype, device=device)
+    elif mode == 'normal':
+        mel_input = torch.randn((1, 80, 88), dtype=dtype, device=device)
+    else:
+        raise Exception("Mode {} if not supported".format(mode))
+
+    with torch.no_grad():
+        bias_audio = vocoder(mel_input)
+        bias_spec, _ = stft.transform(bias_audio.to(stft.forward_basis))
+
+    return bias_spec[:, :, 0][:, :, None].float().cpu()
+
+
+def get_bias_spec(vocoder, stft, mode='zeros', model_path=None, dtype=torch.float, device=None):
+    """
+    Bias spectrum computed once per (checkpoint hash, mode, STFT params):
+    kept in memory for the process and saved next to the checkpoint, so
+    later loads of the same checkpoint do not run the vocoder at all.
+    Without model_path it is computed on every call.
+    """
+    if not model_path:
+        return compute_bias_spec(vocoder, stft, mode, dtype=dtype, device=device)
+
+    model_hash = checkpoint_hash(model_path)
+    key = (model_hash, mode, stft.filter_length, stft.hop_length, stft.win_length)
+    if key in _bias_spec_cache:
+        return _bias_spec_cache[key]
+
+    fpath = bias_spec_path(model_path, mode, stft)
+    bias_spec = None
+    if fpath.is_file():
+        data = torch.load(fpath, map_location='cpu')
+        if data.get('model_hash') == model_hash:
+            bias_spec = data['bias_spec']
+
+    if bias_spec is None:
+        bias_spec = compute_bias_spec(vocoder, stft, mode, dtype=dtype, device=device)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=fpath.parent)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                torch.save({'model_hash': model_hash, 'bias_spec': bias_spec}, fout)
+            os.replace(tmp_path, fpath)
+        except OSError:
+            # read-only model directory, keep the in-memory copy only
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    _bias_spec_cache[key] = bias_spec
+    return bias_spec
+
+
 class Denoiser(torch.nn.Module):
     """ Removes model bias from audio produced with waveglow """
 
-    def __init__(self, vocoder, stft, mode='zeros'):
+    def __init__(self, vocoder, stft, mode='zeros', model_path=None):
         super(Denoiser, self).__init__()
-        self.vocoder = vocoder
-        self.stft = stft
-        if mode == 'zeros':
-            mel_input = torch.zeros((1, 80, 88), dtype=torch.float, device=None)
-        elif mode == 'normal':
-            mel_input = torch.randn((1, 80, 88), dtype=torch.float, device=None)
-        else:
+        if mode not in {'zeros', 'normal'}:
             raise Exception("Mode {} if not supported".format(mode))
-
-        with torch.no_grad():
-            bias_audio = self.vocoder(mel_input).float()
-            bias_spec, _ = self.stft.transform(bias_audio)
-
-        self.register_buffer('bias_spec', bias_spec[:, :, 0][:, :, None])
+        self.vocoder = vocoder
+        # own copy, so casting it to the audio dtype does not touch the caller's STFT
+        self.stft = STFT(stft.filter_length, stft.hop_length, stft.win_length, stft.window)
+        self.mode = mode
+        self.model_path = model_path
+        # computed or loaded lazily on the first call
+        self.register_buffer('bias_spec', None)
 
     def forward(self, audio, strength=0.1):
-        audio_spec, audio_angles = self.stft.transform(audio.float())
+        if self.stft.forward_basis.dtype != audio.dtype or self.stft.forward_basis.device != audio.device:
+            self.stft.to(audio)
+        if self.bias_spec is None:
+            # the vocoder runs where its audio lives, the result comes back as float on cpu
+            self.bias_spec = get_bias_spec(self.vocoder, self.stft, self.mode, self.model_path,
+                                           dtype=audio.dtype, device=audio.device)
+        if self.bias_spec.dtype != audio.dtype or self.bias_spec.device != audio.device:
+            self.bias_spec = self.bias_spec.to(audio)
+
+        audio_spec, audio_angles = self.stft.transform(audio)
         audio_spec_denoised = audio_spec - self.bias_spec * strength
         audio_spec_denoised = torch.clamp(audio_spec_denoised, 0.0)
 
         return self.stft.inverse(audio_spec_denoised, audio_angles)
+
+
+if __name__ == "__main__":
+    # Denoiser after .to(device): the lazily computed bias_spec must follow the audio.
+    # python -m mellotron.layers
+    class _Vocoder(torch.nn.Module):
+        def __init__(self):
+            super(_Vocoder, self).__init__()
+            self.proj = torch.nn.Linear(80, 256)
+
+        def forward(self, mel):
+            return self.proj(mel.transpose(1, 2)).flatten(1)
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        for dtype in [torch.float, torch.double]:
+            vocoder = _Vocoder().to(device=device, dtype=dtype)
+            denoiser = Denoiser(vocoder, STFT(1024, 256, 1024)).to(device)
+            audio = vocoder(torch.randn(1, 80, 50, device=device, dtype=dtype))
+            with torch.no_grad():
+                out = denoiser(audio, strength=0.1)
+            assert denoiser.bias_spec.device == audio.device and denoiser.bias_spec.dtype == audio.dtype
+            assert out.device == audio.device and out.dtype == audio.dtype
+            print('Denoiser {} {}: ok, output {}'.format(device, dtype, tuple(out.shape)))
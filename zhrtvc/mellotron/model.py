@@ -104,6 +104,35 @@ class Attention(nn.Module):
         return attention_context, attention_weights
 
 
+class StopChecker:
+    """
+    Reads a scalar flag of the decoding loop on the host.
+    On CUDA the value is copied into pinned memory without blocking and is
+    read at the next call once the copy has landed, so the loop never
+    waits for the device; the answer is then one check late. Elsewhere it
+    is read directly.
+    """
+
+    def __init__(self, device):
+        self.use_event = torch.device(device).type == 'cuda'
+        if self.use_event:
+            self.host = torch.zeros((), dtype=torch.long).pin_memory()
+            self.event = None
+        self.value = 0
+
+    def __call__(self, flag):
+        if not self.use_event:
+            return int(flag)
+        if self.event is not None and self.event.query():
+            self.value = int(self.host)
+            self.event = None
+        if self.event is None:
+            self.host.copy_(flag, non_blocking=True)
+            self.event = torch.cuda.Event()
+            self.event.record()
+        return self.value
+
+
 class Prenet(nn.Module):
     def __init__(self, in_dim, sizes):
         super(Prenet, self).__init__()
@@ -112,9 +141,23 @@ class Prenet(nn.Module):
             [LinearNorm(in_size, out_size, bias=False)
              for (in_size, out_size) in zip(in_sizes, sizes)])
 
-    def forward(self, x):
+    def forward(self, x, generator=None):
+        """
+        Dropout stays on at inference, as in the original Tacotron2. With a
+        generator (a torch.Generator, or a list with one per row where None
+        uses the global RNG) the masks are drawn from it, so a seeded
+        inference is reproducible.
+        """
         for linear in self.layers:
-            x = F.dropout(F.relu(linear(x)), p=drop_rate, training=True)
+            x = F.relu(linear(x))
+            if generator is None or drop_rate == 0:
+                x = F.dropout(x, p=drop_rate, training=True)
+            elif isinstance(generator, torch.Generator):
+                x = x * torch.empty_like(x).bernoulli_(1 - drop_rate, generator=generator) / (1 - drop_rate)
+            else:
+                mask = torch.stack([torch.empty_like(w).bernoulli_(1 - drop_rate, generator=g)
+                                    for w, g in zip(x, generator)])
+                x = x * mask / (1 - drop_rate)
         return x
 
 
@@ -156,9 +199,17 @@ class Postnet(nn.Module):
                 nn.BatchNorm1d(hparams.n_mel_channels))
         )
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
+        """
+        mask: (B, 1, T) of a padded batch, the padding is zeroed before every
+        convolution so each row gets the same result as when it is run alone
+        """
         for i in range(len(self.convolutions) - 1):
+            if mask is not None:
+                x = x * mask
             x = F.dropout(torch.tanh(self.convolutions[i](x)), drop_rate, self.training)
+        if mask is not None:
+            x = x * mask
         x = F.dropout(self.convolutions[-1](x), drop_rate, self.training)
 
         return x
@@ -208,14 +259,33 @@ class Encoder(nn.Module):
 
         return outputs
 
-    def inference(self, x):
+    def inference(self, x, input_lengths=None):
+        """
+        input_lengths: true lengths of a padded batch, the padding is zeroed
+        before every convolution and skipped by the LSTM, so each row gets the
+        same result as when it is run alone. None for an unpadded input.
+        """
+        mask = None
+        if input_lengths is not None:
+            mask = torch.arange(x.size(2), device=x.device)[None, None] < input_lengths[:, None, None]
+            mask = mask.to(x.dtype)
         for conv in self.convolutions:
+            if mask is not None:
+                x = x * mask
             x = F.dropout(F.relu(conv(x)), drop_rate, self.training)
 
         x = x.transpose(1, 2)
 
         self.lstm.flatten_parameters()
+        if input_lengths is None:
+            outputs, _ = self.lstm(x)
+            return outputs
+
+        x = nn.utils.rnn.pack_padded_sequence(
+            x, input_lengths.cpu(), batch_first=True, enforce_sorted=False)
         outputs, _ = self.lstm(x)
+        outputs, _ = nn.utils.rnn.pad_packed_sequence(
+            outputs, batch_first=True, total_length=mask.size(-1))
 
         return outputs
 
@@ -288,7 +358,16 @@ class Decoder(nn.Module):
         dummy = Variable(f0s.data.new(B, f0s.size(1), 1).zero_())  # 获取最后一个f0，最后1维为1。
         return dummy
 
-    def initialize_decoder_states(self, memory, mask):
+    def parse_f0s(self, f0s):
+        """ (B, prenet_f0_dim, T) f0s -> (T + 1, B, prenet_f0_dim) prenet_f0 outputs, None stays None """
+        if not isinstance(f0s, torch.Tensor):
+            return f0s
+        f0_dummy = self.get_end_f0(f0s)
+        f0s = torch.cat((f0s, f0_dummy), dim=2)
+        f0s = F.relu(self.prenet_f0(f0s))
+        return f0s.permute(2, 0, 1)
+
+    def initialize_decoder_states(self, memory, mask, processed_memory=None):
         """ Initializes attention rnn states, decoder rnn states, attention
         weights, attention cumulative weights, attention context, stores memory
         and stores processed memory
@@ -296,6 +375,7 @@ class Decoder(nn.Module):
         ------
         memory: Encoder outputs
         mask: Mask for padded data if training, expects None for inference
+        processed_memory: precomputed attention_layer.memory_layer(memory)
         """
         B = memory.size(0)
         MAX_TIME = memory.size(1)
@@ -318,7 +398,9 @@ class Decoder(nn.Module):
             B, self.encoder_embedding_dim).zero_())
 
         self.memory = memory
-        self.processed_memory = self.attention_layer.memory_layer(memory)
+        if processed_memory is None:
+            processed_memory = self.attention_layer.memory_layer(memory)
+        self.processed_memory = processed_memory
         self.mask = mask
 
     def parse_decoder_inputs(self, decoder_inputs):
@@ -355,17 +437,20 @@ class Decoder(nn.Module):
         gate_outpust: gate output energies
         alignments:
         """
+        if isinstance(mel_outputs, list):
+            mel_outputs = torch.stack(mel_outputs)
+            gate_outputs = torch.stack(gate_outputs)
+            alignments = torch.stack(alignments)
         # (T_out, B) -> (B, T_out)
-        alignments = torch.stack(alignments).transpose(0, 1)
+        alignments = alignments.transpose(0, 1)
         # (T_out, B) -> (B, T_out)
-        gate_outputs = torch.stack(gate_outputs)
         if len(gate_outputs.size()) > 1:
             gate_outputs = gate_outputs.transpose(0, 1)
         else:
             gate_outputs = gate_outputs[None]
         gate_outputs = gate_outputs.contiguous()
         # (T_out, B, n_mel_channels) -> (B, T_out, n_mel_channels)
-        mel_outputs = torch.stack(mel_outputs).transpose(0, 1).contiguous()
+        mel_outputs = mel_outputs.transpose(0, 1).contiguous()
         # decouple frames per step
         mel_outputs = mel_outputs.view(
             mel_outputs.size(0), -1, self.n_mel_channels)
@@ -475,11 +560,15 @@ class Decoder(nn.Module):
 
         return mel_outputs, gate_outputs, alignments
 
-    def inference(self, memory, f0s):
+    def inference(self, memory, f0s, check_every=8, processed_memory=None, generator=None):
         """ Decoder inference
         PARAMS
         ------
         memory: Encoder outputs
+        check_every: steps between two checks of the stop condition, the
+            only points where the loop waits for the device
+        processed_memory: precomputed attention_layer.memory_layer(memory)
+        generator: draws the prenet dropout masks, see Prenet.forward
 
         RETURNS
         -------
@@ -489,45 +578,128 @@ class Decoder(nn.Module):
         """
         decoder_input = self.get_go_frame(memory)
 
-        self.initialize_decoder_states(memory, mask=None)
-        if isinstance(f0s, torch.Tensor):
-            f0_dummy = self.get_end_f0(f0s)
-            f0s = torch.cat((f0s, f0_dummy), dim=2)
-            f0s = F.relu(self.prenet_f0(f0s))
-            f0s = f0s.permute(2, 0, 1)
+        self.initialize_decoder_states(memory, mask=None, processed_memory=processed_memory)
+        f0s = self.parse_f0s(f0s)
 
-        mel_outputs, gate_outputs, alignments = [], [], []
-        while True:
+        mel_outputs, gate_outputs, alignments = self.get_output_buffers(memory)
+        # 支持batch的推理：第一个整个batch的gate都超过阈值的步，在设备上记录，每check_every步读取一次
+        max_steps = self.max_decoder_steps
+        stop_step = torch.full((), max_steps, dtype=torch.long, device=memory.device)
+        stop_checker = StopChecker(memory.device)
+        for step in range(max_steps):
+            if isinstance(f0s, torch.Tensor):
+                if step < len(f0s):
+                    f0 = f0s[step]
+                else:
+                    f0 = f0s[-1] * 0
+
+                decoder_input = torch.cat((self.prenet(decoder_input, generator), f0), dim=1)
+            else:
+                decoder_input = self.prenet(decoder_input, generator)
+            mel_output, gate_output, alignment = self.decode(decoder_input)
+
+            mel_outputs[step] = mel_output
+            gate_outputs[step] = gate_output
+            alignments[step] = alignment
+
+            stopped = torch.sigmoid(torch.min(gate_output.data)) > self.gate_threshold
+            stop_step = torch.min(stop_step, max_steps - stopped.long() * (max_steps - step))
+            if (step + 1) % check_every == 0 and stop_checker(stop_step) < max_steps:
+                break
+
+            decoder_input = mel_output
+
+        n_steps = min(int(stop_step) + 1, max_steps)
+        mel_outputs, gate_outputs, alignments = self.parse_decoder_outputs(
+            mel_outputs[:n_steps], gate_outputs[:n_steps], alignments[:n_steps])
+
+        return mel_outputs, gate_outputs, alignments
+
+    def inference_batch(self, memory, f0s, memory_lengths, check_every=8):
+        """ Batched decoder inference over padded memory
+        PARAMS
+        ------
+        memory: Encoder outputs, padded
+        memory_lengths: true lengths of memory, the padding is masked out of the attention
+        check_every: steps between two checks of the stop condition
+
+        RETURNS
+        -------
+        mel_outputs: mel outputs from the decoder
+        gate_outputs: gate outputs from the decoder
+        alignments: sequence of attention weights from the decoder
+        output_lengths: frames of each row up to and including the one its
+            gate fired on, the states of a finished row stay frozen once
+            a check has seen it finish
+        """
+        decoder_input = self.get_go_frame(memory)
+
+        mask = torch.arange(memory.size(1), device=memory.device)[None] >= memory_lengths[:, None]
+        self.initialize_decoder_states(memory, mask=mask)
+        f0s = self.parse_f0s(f0s)
+
+        mel_outputs, gate_outputs, alignments = self.get_output_buffers(memory)
+        finished = torch.zeros(memory.size(0), dtype=torch.bool, device=memory.device)
+        output_lengths = torch.zeros(memory.size(0), dtype=torch.long, device=memory.device)
+        stop_checker = StopChecker(memory.device)
+        any_finished = False
+        for step in range(self.max_decoder_steps):
             if isinstance(f0s, torch.Tensor):
-                if len(mel_outputs) < len(f0s):
-                    f0 = f0s[len(mel_outputs)]
+                if step < len(f0s):
+                    f0 = f0s[step]
                 else:
                     f0 = f0s[-1] * 0
 
                 decoder_input = torch.cat((self.prenet(decoder_input), f0), dim=1)
             else:
                 decoder_input = self.prenet(decoder_input)
+
+            # rows are independent, freezing only keeps finished rows from running on
+            frozen = self.get_decoder_states() if any_finished else None
             mel_output, gate_output, alignment = self.decode(decoder_input)
+            if frozen is not None:
+                self.freeze_decoder_states(frozen, finished)
 
-            mel_outputs += [mel_output.squeeze(1)]
-            gate_outputs += [gate_output]
-            alignments += [alignment]
+            mel_outputs[step] = mel_output
+            gate_outputs[step] = gate_output
+            alignments[step] = alignment
 
-            # 支持batch的推理
-            v_min = torch.sigmoid(torch.min(gate_output.data)).cpu().numpy()
-            if v_min > self.gate_threshold:
-                break
-            elif len(mel_outputs) >= self.max_decoder_steps:
-                # print("Warning! Reached max decoder steps")
-                break
+            output_lengths += (~finished).long()
+            finished |= torch.sigmoid(gate_output.data[:, 0]) > self.gate_threshold
+            if (step + 1) % check_every == 0:
+                n_finished = stop_checker(finished.sum())
+                if n_finished == len(finished):
+                    break
+                any_finished = n_finished > 0
 
             decoder_input = mel_output
 
+        n_steps = int(output_lengths.max())
         mel_outputs, gate_outputs, alignments = self.parse_decoder_outputs(
-            mel_outputs, gate_outputs, alignments)
+            mel_outputs[:n_steps], gate_outputs[:n_steps], alignments[:n_steps])
 
+        return mel_outputs, gate_outputs, alignments, output_lengths
+
+    def get_output_buffers(self, memory):
+        """ Preallocated (max_decoder_steps, B, ...) outputs, trimmed after decoding """
+        B = memory.size(0)
+        mel_outputs = memory.new_zeros(self.max_decoder_steps, B, self.n_mel_channels * self.n_frames_per_step)
+        gate_outputs = memory.new_zeros(self.max_decoder_steps, B, 1)
+        alignments = memory.new_zeros(self.max_decoder_steps, B, memory.size(1))
         return mel_outputs, gate_outputs, alignments
 
+    _decoder_state_names = ('attention_hidden', 'attention_cell', 'decoder_hidden', 'decoder_cell',
+                            'attention_weights', 'attention_weights_cum', 'attention_context')
+
+    def get_decoder_states(self):
+        # attention_weights_cum is updated in place by decode
+        return [getattr(self, name).clone() for name in self._decoder_state_names]
+
+    def freeze_decoder_states(self, states, rows):
+        """ Puts the given states back for the rows that are set in rows """
+        for name, state in zip(self._decoder_state_names, states):
+            setattr(self, name, torch.where(rows[:, None], state, getattr(self, name)))
+
     def inference_noattention(self, memory, f0s, attention_map):
         """ Decoder inference
         PARAMS
@@ -653,17 +825,29 @@ class Tacotron2(nn.Module):
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments],
             output_lengths)
 
-    def inference(self, inputs):
-        text, style_input, speaker_ids, f0s = inputs
+    def encode(self, text, style_input, speaker_ids, input_lengths=None):
+        """
+        文本、风格和说话人编码为decoder的memory（encoder_outputs）。
+
+        Args:
+            text: (B, T_in)的文本序列。
+            style_input: int为GST的token序号，否则为参考mel频谱。
+            speaker_ids: 说话人id或者说话人向量。
+            input_lengths: 每句文本的真实长度，为None时不mask。
+
+        Returns:
+            (B, T_in, encoder_embedding_dim)的encoder_outputs。
+        """
+        batch_size = text.size(0)
         embedded_inputs = self.embedding(text).transpose(1, 2)
-        embedded_text = self.encoder.inference(embedded_inputs)
+        embedded_text = self.encoder.inference(embedded_inputs, input_lengths)
         embedded_speakers = self.speaker_embedding(speaker_ids)[:, None]
         if hasattr(self, 'gst'):
             if isinstance(style_input, int):
-                query = torch.zeros(1, 1, self.gst.encoder.ref_enc_gru_size).to(_device)  # cuda()
+                query = torch.zeros(1, 1, self.gst.encoder.ref_enc_gru_size, device=text.device)
                 GST = torch.tanh(self.gst.stl.embed)
                 key = GST[style_input].unsqueeze(0).expand(1, -1, -1)
-                embedded_gst = self.gst.stl.attention(query, key)
+                embedded_gst = self.gst.stl.attention(query, key).expand(batch_size, -1, -1)
             else:
                 embedded_gst = self.gst(style_input)
 
@@ -675,21 +859,91 @@ class Tacotron2(nn.Module):
         else:
             encoder_outputs = torch.cat(
                 (embedded_text, embedded_speakers), dim=2)
+        return encoder_outputs
+
+    def inference(self, inputs, cache=None, seed=None):
+        """
+        Args:
+            inputs: (text, style_input, speaker_ids, f0s)
+            cache: inference_cache.InferenceCache，缓存encoder_outputs和processed_memory，
+                解码确定（prenet不用dropout或者给了seed）时还缓存整个输出。
+            seed: prenet的dropout用这个种子的随机数，同样的输入和seed合成的结果相同。
+        """
+        text, style_input, speaker_ids, f0s = inputs
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=text.device).manual_seed(seed)
+
+        outputs_key = None
+        if cache is None:
+            encoder_outputs, processed_memory = self.encode(text, style_input, speaker_ids), None
+        else:
+            if drop_rate == 0 or seed is not None:
+                outputs_key = cache.outputs_key(self, inputs, seed)
+                outputs = cache.get_outputs(outputs_key, device=text.device)
+                if outputs is not None:
+                    return outputs
+            encoder_outputs, processed_memory = cache.get_memory(self, text, style_input, speaker_ids)
 
         mel_outputs, gate_outputs, alignments = self.decoder.inference(
-            encoder_outputs, f0s)
+            encoder_outputs, f0s, processed_memory=processed_memory, generator=generator)
 
         mel_outputs_postnet = self.postnet(mel_outputs)
         mel_outputs_postnet = mel_outputs + mel_outputs_postnet
 
-        return self.parse_output(
+        outputs = self.parse_output(
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments])
+        if outputs_key is not None:
+            cache.put_outputs(outputs_key, outputs)
+        return outputs
+
+    def inference_batch(self, inputs, input_lengths=None):
+        """
+        有pad的batch模式语音合成推理，每一句的结果和inference_nopad单独合成的一致。
+        GPU上耗时约为合成最长一句的时间；CPU上每步的计算量随句数增加，耗时比最长一句的长，
+        但不会比逐句合成慢（单线程，最长50字：8句0.94s、16句1.07s，最长一句0.35s，逐句1.81s、4.14s）。
+        encoder和postnet在每层卷积前把pad置零，attention用真实文本长度的mask，
+        每一句的gate超过阈值后冻结该句的decoder状态，所有句子都结束后停止。
+
+        Args:
+            inputs: (text, style_input, speaker_ids, f0s)，text为(B, T_in)，f0s所有句子共用。
+            input_lengths: 每句文本的真实长度，为None时和inference_nopad一样取第一个0的位置加1。
+
+        Returns:
+            [mel_outputs, mel_outputs_postnet, gate_outputs, alignments, output_lengths]，
+            output_lengths之后的mel填充-16，gate填充1，alignments填充0。
+        """
+        text, style_input, speaker_ids, f0s = inputs
+        if input_lengths is None:
+            input_lengths = torch.stack([torch.argmin(w) + 1 for w in text])
+        input_lengths = input_lengths.to(text.device)
+        text = text[:, :int(input_lengths.max())]
+        batch_size = text.size(0)
+        encoder_outputs = self.encode(text, style_input, speaker_ids, input_lengths)
+
+        if isinstance(f0s, torch.Tensor) and f0s.size(0) != batch_size:
+            f0s = f0s.expand(batch_size, -1, -1)
+
+        mel_outputs, gate_outputs, alignments, output_lengths = self.decoder.inference_batch(
+            encoder_outputs, f0s, input_lengths)
+
+        mask = torch.arange(mel_outputs.size(2), device=mel_outputs.device)[None] < output_lengths[:, None]
+        mel_outputs = mel_outputs * mask[:, None].to(mel_outputs.dtype)
+        mel_outputs_postnet = self.postnet(mel_outputs, mask[:, None].to(mel_outputs.dtype))
+        mel_outputs_postnet = mel_outputs + mel_outputs_postnet
+
+        # pad一个很小的负数才是静音，gate pad数字1才是截断
+        mel_outputs = mel_outputs.masked_fill(~mask[:, None], -16)
+        mel_outputs_postnet = mel_outputs_postnet.masked_fill(~mask[:, None], -16)
+        gate_outputs = gate_outputs.masked_fill(~mask[:, :, None], 1)
+        alignments = alignments.masked_fill(~mask[:, :, None], 0)
+        return [mel_outputs, mel_outputs_postnet, gate_outputs, alignments, output_lengths]
 
     def inference_nopad(self, inputs):
         """
         不用pad的语音合成推理。
         有pad的batch模式语音合成推理容易出现合成错误问题，合成效果不稳定。
-        用batch模式合成且不用pad还没打通，这个暂用非batch的合成方式。
+        用batch模式合成且不用pad还没打通，这个暂用非batch的合成方式，batch模式见inference_batch。
         Args:
             inputs:
 
@@ -786,3 +1040,82 @@ class Tacotron2(nn.Module):
 
         return self.parse_output(
             [mel_outputs, mel_outputs_postnet, gate_outputs, alignments])
+
+
+if __name__ == "__main__":
+    import time
+
+    from mellotron.hparams import create_hparams
+
+    # inference_batch和逐句inference_nopad的一致性和耗时，随机初始化的模型。
+    # 关掉prenet的dropout；gate改为在第4倍文本长度步结束，每句的长度不同。
+    drop_rate = 0.
+    torch.manual_seed(0)
+    hparams = create_hparams()
+    hparams.max_decoder_steps = 400
+    model = Tacotron2(hparams).to(_device).eval()
+    decoder = model.decoder
+    decoder.gate_layer.forward = lambda x: (decoder.attention_weights_cum.sum(1, keepdim=True)
+                                            - 4 * (decoder.attention_weights_cum > 0).sum(1, keepdim=True) + 0.5)
+
+    text_lengths = torch.tensor([40, 12, 33, 25, 7, 50, 18, 45])
+    text = torch.zeros(len(text_lengths), int(text_lengths.max()), dtype=torch.long)
+    for num, length in enumerate(text_lengths):
+        text[num, :length - 1] = torch.randint(1, hparams.n_symbols, (int(length) - 1,))
+    text = text.to(_device)
+    speakers = torch.randn(len(text_lengths), hparams.n_speakers, device=_device)
+
+    with torch.no_grad():
+        outputs_nopad = model.inference_nopad((text, [0] * len(text), speakers, None))
+        outputs = model.inference_batch((text, 0, speakers, None))
+
+    output_lengths = outputs[4]
+    diff = max((outputs_nopad[1][num, :, :n] - outputs[1][num, :, :n]).abs().max().item()
+               for num, n in enumerate(output_lengths.tolist()))
+    print('output lengths: {}'.format(output_lengths.tolist()))
+    print('max diff of mel_outputs_postnet: {:.2e}'.format(diff))
+
+    # 不同句数的耗时：batch、其中最长一句单独合成、逐句合成，最长的一句都是50字。
+    def timeit(fn):
+        start = time.time()
+        fn()
+        if _device == 'cuda':
+            torch.cuda.synchronize()
+        return time.time() - start
+
+    longest = int(text_lengths.argmax())
+    order = [longest] + [num for num in range(len(text)) if num != longest]
+    for batch_size in [1, 2, 4, 8, 16]:
+        index = torch.tensor([order[num % len(order)] for num in range(batch_size)])
+        text_b, speakers_b = text[index.to(_device)], speakers[index.to(_device)]
+        with torch.no_grad():
+            t_batch = timeit(lambda: model.inference_batch((text_b, 0, speakers_b, None)))
+            t_longest = timeit(lambda: model.inference_batch((text_b[:1], 0, speakers_b[:1], None)))
+            t_nopad = timeit(lambda: model.inference_nopad((text_b, [0] * batch_size, speakers_b, None)))
+        print('{:2d} sentences: inference_batch {:.2f}s, the longest alone {:.2f}s, inference_nopad {:.2f}s'.format(
+            batch_size, t_batch, t_longest, t_nopad))
+
+    # Decoder.inference每check_every步读一次结束标志，和每步都读（check_every=1）比较每秒的解码步数。
+    # 单线程和多线程（线程数超过核数时每次同步的代价更明显）各跑一遍，输出逐步一致。
+    text_b, speakers_b = text[longest:longest + 1], speakers[longest:longest + 1]
+    n_threads = torch.get_num_threads()
+    for threads in sorted({1, max(8, n_threads)}):
+        torch.set_num_threads(threads)
+        with torch.no_grad():
+            memory = model.encode(text_b, 0, speakers_b)
+            results = {}
+            for check_every in [1, 8]:
+                decoder.inference(memory, None, check_every=check_every)
+                n_steps, elapsed = 0, 0.
+                for _ in range(5):
+                    start = time.time()
+                    outputs = decoder.inference(memory, None, check_every=check_every)
+                    if _device == 'cuda':
+                        torch.cuda.synchronize()
+                    elapsed += time.time() - start
+                    n_steps += outputs[0].size(2)
+                results[check_every] = (n_steps / elapsed, outputs[0])
+        diff = (results[1][1] - results[8][1]).abs().max().item()
+        print('{} threads: check_every=1 {:.0f} steps/s, check_every=8 {:.0f} steps/s, max diff {:.1e}'.format(
+            threads, results[1][0], results[8][0], diff))
+    torch.set_num_threads(n_threads)
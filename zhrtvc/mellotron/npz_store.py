@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+磁盘上按名字存取npz文件的目录，FeatureCache和ResultStore共用。
+
+每个文件放在<root_dir>/<名字前两位>/<名字>.npz，多个进程可以共用同一个目录。
+写入先写临时文件再os.replace，保证读到的文件是完整的；
+命中时更新文件的mtime，总大小超过max_bytes时按mtime删除最久没用的文件（LRU）。
+"""
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(Path(__file__).stem)
+
+
+class NpzStore:
+    def __init__(self, root_dir, max_bytes=None):
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = self.total_size() if max_bytes else 0
+
+    def path(self, name):
+        return self.root_dir.joinpath(name[:2], '{}.npz'.format(name))
+
+    def load(self, name, convert):
+        """
+        打开name对应的npz，返回convert(data)，没有则返回None。
+        convert要在文件关闭前把需要的数组读出来。
+        """
+        fpath = self.path(name)
+        try:
+            with np.load(fpath, allow_pickle=False) as data:
+                out = convert(data)
+            os.utime(fpath)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            # 文件不存在、被其他进程淘汰或者写坏了，都当作没有命中。
+            self.misses += 1
+            return None
+        self.hits += 1
+        return out
+
+    def save(self, name, arrays):
+        """
+        把{名字: numpy数组}保存为name对应的npz，写入失败只记录日志。
+        """
+        fpath = self.path(name)
+        fpath.parent.mkdir(exist_ok=True, parents=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=fpath.parent)
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                np.savez(fout, **arrays)
+            os.replace(tmp_path, fpath)
+        except OSError as e:
+            logger.info('Error! {} write failed! {}'.format(type(self).__name__, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        if self.max_bytes:
+            self._size += fpath.stat().st_size
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def total_size(self):
+        return sum(f.stat().st_size for f in self.root_dir.glob('*/*.npz'))
+
+    def evict(self):
+        """
+        删除最久没用的文件，直到总大小降到max_bytes的90%以下。
+        """
+        items = []
+        for fpath in self.root_dir.glob('*/*.npz'):
+            try:
+                stat = fpath.stat()
+            except FileNotFoundError:
+                continue
+            items.append((stat.st_mtime, stat.st_size, fpath))
+        items.sort()
+
+        size = sum(w[1] for w in items)
+        target = self.max_bytes * 0.9
+        for _, fsize, fpath in items:
+            if size <= target:
+                break
+            try:
+                fpath.unlink()
+            except FileNotFoundError:
+                pass
+            size -= fsize
+        self._size = size
@@ -19,6 +19,7 @@ import numpy as np
 
 from data_utils import TextMelLoader
 from hparams import create_hparams
+from shards import ShardWriter
 
 hp = create_hparams()
 
@@ -60,6 +61,42 @@ def process_one(index, skip_existing=False):
     return index
 
 
+def load_one(index):
+    global text_mel_loader
+    global metadata_path
+    if text_mel_loader is None:
+        text_mel_loader = TextMelLoader(metadata_path, hparams=hp, mode='preprocess')
+
+    try:  # 防止少数错误语音导致生成数据失败。
+        return index, text_mel_loader[index]
+    except Exception as e:
+        logger.info('Error! The <{}> audio load failed! {}'.format(index, e))
+        return index, None
+
+
+def pack_many(n_processes):
+    """
+    把所有语音的数据打包为分片，保存在output_dir/shards，训练时设置hparams.shards_dir即可使用。
+    """
+    ids = list(range(len(text_mel_loader)))
+    if n_processes == 0:
+        job = map(load_one, ids)
+    else:
+        job = Pool(n_processes).imap(load_one, ids)
+
+    with ShardWriter(output_dir.joinpath('shards'), fields=['text', 'mel', 'speaker', 'f0']) as writer:
+        writer.info['speaker_ids'] = text_mel_loader.speaker_ids
+        for index, out in tqdm(job, "Packing", len(ids), unit="utterances"):
+            if out is None:
+                continue
+            text, mel, speaker_id, f0 = out
+            # mel和f0转置为(T, n)，沿帧的维度拼接。
+            arrays = {'text': text.numpy(), 'mel': mel.numpy().T, 'speaker': speaker_id.numpy(),
+                      'f0': None if f0 is None else f0.numpy().T}
+            tmp = text_mel_loader.audiopaths_and_text[index]
+            writer.add(arrays, name=format_index(index), audiopath=tmp[0], speaker=tmp[-1])
+
+
 def process_many(n_processes, skip_existing=False):
     # Embed the utterances in separate threads
     ids = list(range(len(text_mel_loader)))
@@ -116,6 +153,8 @@ if __name__ == "__main__":
                         help="Whether to overwrite existing files with the same name. ")
     parser.add_argument("--hparams", type=str, default="",
                         help="Hyperparameter overrides as a comma-separated list of name-value pairs")
+    parser.add_argument("--shards", action="store_true",
+                        help="打包为内存映射的分片，而不是每条语音一个文件夹。")
     args = parser.parse_args()
 
     metadata_path = args.metadata_path
@@ -129,4 +168,7 @@ if __name__ == "__main__":
     json.dump(speaker_ids, open(fpath, 'wt', encoding='utf8'), indent=4, ensure_ascii=False)
 
     # Preprocess the dataset
-    process_many(args.n_processes, skip_existing=args.skip_existing)
+    if args.shards:
+        pack_many(args.n_processes)
+    else:
+        process_many(args.n_processes, skip_existing=args.skip_existing)
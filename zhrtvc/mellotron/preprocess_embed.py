@@ -26,24 +26,34 @@ hp = create_hparams()
 
 import aukit
 from encoder import inference as encoder
+from encoder.audio import preprocess_wav
 
 
-def embed_utterance(src, skip_existing=True, encoder_model_fpath=Path()):
+def embed_utterances(srcs, skip_existing=True, encoder_model_fpath=Path()):
     if not encoder.is_loaded():
         encoder.load_model(encoder_model_fpath)
 
-    wav_fpath, embed_fpath = src
-
-    if skip_existing and embed_fpath.is_file():
+    wavs, embed_fpaths = [], []
+    for wav_fpath, embed_fpath in srcs:
+        if skip_existing and embed_fpath.is_file():
+            continue
+        try:  # 防止少数错误语音导致生成数据失败。
+            wav = aukit.load_wav(wav_fpath, sr=hp.sampling_rate)
+            wavs.append(preprocess_wav(wav))
+            embed_fpaths.append(embed_fpath)
+        except Exception as e:
+            logger.info('Error! The <{}> audio load failed! {}'.format(wav_fpath, e))
+            logger.info('=' * 50)
+
+    if not wavs:
         return
-
-    wav = aukit.load_wav(wav_fpath, sr=hp.sampling_rate)
-    wav = encoder.preprocess_wav(wav)
-    embed = encoder.embed_utterance(wav)
-    np.save(embed_fpath, embed, allow_pickle=False)
+    # 一批语音的片段一起计算语音表示向量。
+    embeds = encoder.embed_utterances(wavs)
+    for embed_fpath, embed in zip(embed_fpaths, embeds):
+        np.save(embed_fpath, embed, allow_pickle=False)
 
 
-def create_embeddings(n_processes, txt_fpath, skip_existing=False, encoder_model_fpath=Path()):
+def create_embeddings(n_processes, txt_fpath, skip_existing=False, encoder_model_fpath=Path(), batch_size=32):
     # Embed the utterances in separate threads
     # 000000	F:\github\zhrtvc\data\samples_ssml\Aiyue/000003.wav	<speak><phoneme alphabet="py" ph="bao2 ma3">宝马</phoneme>。</speak>	Aiyue
     npy_dir = Path(txt_fpath).parent.joinpath('npy')
@@ -53,18 +63,15 @@ def create_embeddings(n_processes, txt_fpath, skip_existing=False, encoder_model
             embed_fpath = npy_dir.joinpath(line.split('\t')[0], 'embed.npy')
             wav_fpath = line.split('\t')[1]
             ids.append((wav_fpath, embed_fpath))
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
 
     if n_processes <= 1:
-        for index in tqdm(ids, ncols=50):
-            try:  # 防止少数错误语音导致生成数据失败。
-                embed_utterance(index, skip_existing=skip_existing, encoder_model_fpath=encoder_model_fpath)
-            except Exception as e:
-                logger.info('Error! The <{}> audio load failed! {}'.format(index, e))
-                logger.info('=' * 50)
+        for batch in tqdm(batches, ncols=50):
+            embed_utterances(batch, skip_existing=skip_existing, encoder_model_fpath=encoder_model_fpath)
     else:
-        func = partial(embed_utterance, skip_existing=skip_existing, encoder_model_fpath=encoder_model_fpath)
-        job = Pool(n_processes).imap(func, ids)
-        list(tqdm(job, "Embedding", len(ids), unit="utterances", ncols=50))
+        func = partial(embed_utterances, skip_existing=skip_existing, encoder_model_fpath=encoder_model_fpath)
+        job = Pool(n_processes).imap(func, batches)
+        list(tqdm(job, "Embedding", len(batches), unit="batches", ncols=50))
 
 
 if __name__ == "__main__":
@@ -84,6 +91,8 @@ if __name__ == "__main__":
                         help="Whether to overwrite existing files with the same name. ")
     parser.add_argument("-n", "--n_processes", type=int, default=0,
                         help="进程数。")
+    parser.add_argument("-b", "--batch_size", type=int, default=32,
+                        help="一次前向计算的语音条数。")
     parser.add_argument("--hparams", type=str, default="",
                         help="Hyperparameter overrides as a json string.")
     args = parser.parse_args()
@@ -93,4 +102,5 @@ if __name__ == "__main__":
         n_processes=args.n_processes,
         txt_fpath=args.input_fpath,
         skip_existing=args.skip_existing,
-        encoder_model_fpath=args.encoder_model_fpath)
+        encoder_model_fpath=args.encoder_model_fpath,
+        batch_size=args.batch_size)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Mellotron decoder的连续批处理（iteration-level batching）。
+
+服务端按请求整批合成时，短句要等同批的长句合成完，结束的句子占着的位置也空转。
+DecoderScheduler在后台线程里维护一组正在合成的句子的decoder状态（attention/decoder LSTM状态、
+attention权重和累计权重、context、memory、processed_memory、mask），
+每check_every步检查一次：结束的句子移出batch并返回结果，等待中的请求补进空出的位置。
+
+每一句的结果和Tacotron2.inference单独合成的一致（prenet的dropout除外）。
+
+用法：
+    scheduler = DecoderScheduler(model, max_batch_size=8)
+    future = scheduler.submit(text, speaker)
+    mel_outputs, mel_outputs_postnet, gate_outputs, alignments = future.result()
+    scheduler.close()
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+import torch
+
+from . import model as mellotron_model
+
+logger = logging.getLogger(Path(__file__).stem)
+
+# 按时间维pad的状态，其余状态的形状为(B, dim)。
+_time_state_names = ('attention_weights', 'attention_weights_cum', 'memory', 'processed_memory', 'mask')
+
+
+class _Sequence:
+    """
+    batch中的一句：请求的输入、已经合成的步数和每次检查时保存的输出片段。
+    """
+
+    def __init__(self, future, text, style, speaker, f0, seed):
+        self.future = future
+        self.text = text
+        self.style = style
+        self.speaker = speaker
+        self.f0 = f0
+        self.seed = seed
+        self.generator = None
+        self.outputs_key = None
+        self.n_steps = 0
+        self.chunks = []
+
+
+class DecoderScheduler:
+    """
+    连续批处理的合成调度器，submit返回concurrent.futures.Future。
+
+    调度器独占模型：后台线程直接读写model.decoder的状态，运行期间不要在其他线程用同一个模型合成。
+    """
+
+    def __init__(self, model, max_batch_size=8, check_every=4, cache=None):
+        """
+        :param model: eval模式的Tacotron2。
+        :param max_batch_size: 同时合成的最多句数。
+        :param check_every: 每多少步检查一次结束的句子并补入新请求，也是等待设备结果的唯一位置。
+        :param cache: inference_cache.InferenceCache，可以和Tacotron2.inference共用。
+        """
+        self.model = model
+        self.cache = cache
+        self.decoder = model.decoder
+        self.max_batch_size = max_batch_size
+        self.check_every = check_every
+        self.use_f0 = hasattr(self.decoder, 'prenet_f0')
+        self.device = next(model.parameters()).device
+
+        self.queue = queue.Queue()
+        self.sequences = []
+        self.decoder_input = None
+        self.finished = None
+        self.lengths = None
+        self.closing = False
+        self.n_steps = 0
+        self.n_batch_steps = 0
+
+        self.thread = threading.Thread(target=self._run, name='DecoderScheduler', daemon=True)
+        self.thread.start()
+
+    def submit(self, text, speaker, f0=None, style=0, seed=None):
+        """
+        提交一句合成请求。
+
+        :param text: (T_in,)或(1, T_in)的文本序列，不含pad。
+        :param speaker: 说话人id或者说话人向量，可以带batch维。
+        :param f0: (prenet_f0_dim, T)或(1, prenet_f0_dim, T)的基频，模型不用基频时为None。
+        :param style: GST的token序号或者参考mel频谱。
+        :param seed: prenet dropout的随机数种子，结果和Tacotron2.inference用同一个seed合成的一致。
+        :return: Future，结果为[mel_outputs, mel_outputs_postnet, gate_outputs, alignments]，batch维为1。
+        """
+        if self.closing:
+            raise RuntimeError('DecoderScheduler is closed!')
+        if self.use_f0 and not isinstance(f0, torch.Tensor):
+            raise ValueError('The model uses f0 (prenet_f0_dim > 0), f0 is required!')
+
+        text = torch.as_tensor(text).long().reshape(1, -1)
+        speaker = torch.as_tensor(speaker)
+        if speaker.dim() == 0 or (speaker.dim() == 1 and speaker.is_floating_point()):
+            speaker = speaker[None]
+        if isinstance(f0, torch.Tensor) and f0.dim() == 2:
+            f0 = f0[None]
+        if isinstance(style, torch.Tensor) and style.dim() == 2:
+            style = style[None]
+
+        future = Future()
+        self.queue.put(_Sequence(future, text, style, speaker, f0, seed))
+        return future
+
+    def close(self, wait=True):
+        """
+        不再接受新请求，已经提交的请求合成完后后台线程退出。
+        """
+        if not self.closing:
+            self.closing = True
+            self.queue.put(None)
+        if wait:
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        with torch.no_grad():
+            while self.sequences or not (self.closing and self.queue.empty()):
+                try:
+                    self._admit(block=not self.sequences)
+                    if not self.sequences:
+                        continue
+                    self._decode(self.check_every)
+                    self._evict()
+                except Exception as e:
+                    logger.exception('DecoderScheduler failed!')
+                    for seq in self.sequences:
+                        seq.future.set_exception(e)
+                    self.sequences = []
+
+    def _admit(self, block):
+        """
+        从队列取请求补入空位，编码文本并初始化新句子的decoder状态，和原有的状态按时间维pad后拼接。
+        """
+        new_seqs = []
+        while len(self.sequences) + len(new_seqs) < self.max_batch_size:
+            try:
+                seq = self.queue.get(block=block and not new_seqs)
+            except queue.Empty:
+                break
+            if seq is None:
+                break
+            if not seq.future.set_running_or_notify_cancel():
+                continue
+            new_seqs.append(seq)
+        if not new_seqs:
+            return
+
+        states = [self._get_states()] if self.sequences else []
+        admitted = []
+        for seq in new_seqs:
+            try:
+                text, speaker = seq.text.to(self.device), seq.speaker.to(self.device)
+                if self.cache is None:
+                    memory, processed_memory = self.model.encode(text, seq.style, speaker), None
+                else:
+                    if mellotron_model.drop_rate == 0 or seq.seed is not None:
+                        seq.outputs_key = self.cache.outputs_key(
+                            self.model, (text, seq.style, speaker, seq.f0), seq.seed)
+                        outputs = self.cache.get_outputs(seq.outputs_key, device=self.device)
+                        if outputs is not None:
+                            seq.future.set_result(outputs)
+                            continue
+                    memory, processed_memory = self.cache.get_memory(self.model, text, seq.style, speaker)
+                if isinstance(seq.f0, torch.Tensor):
+                    seq.f0 = self.decoder.parse_f0s(seq.f0.to(self.device))[:, 0]
+                if seq.seed is not None:
+                    seq.generator = torch.Generator(device=self.device).manual_seed(seq.seed)
+            except Exception as e:
+                seq.future.set_exception(e)
+                continue
+            mask = torch.zeros(1, memory.size(1), dtype=torch.bool, device=memory.device)
+            self.decoder.initialize_decoder_states(memory, mask=mask, processed_memory=processed_memory)
+            states.append(self._get_states())
+            admitted.append(seq)
+        if not admitted:
+            if self.sequences:
+                self._set_states(states[0])
+            return
+
+        max_time = max(w['memory'].size(1) for w in states)
+        self._set_states({name: torch.cat([_pad_time(name, w[name], max_time) for w in states])
+                          for name in states[0]})
+
+        n_new = len(admitted)
+        go_frame = self.decoder.get_go_frame(states[-1]['memory'].new_zeros(n_new, 1))
+        new_finished = torch.zeros(n_new, dtype=torch.bool, device=self.device)
+        new_lengths = torch.zeros(n_new, dtype=torch.long, device=self.device)
+        if self.sequences:
+            self.decoder_input = torch.cat((self.decoder_input, go_frame))
+            self.finished = torch.cat((self.finished, new_finished))
+            self.lengths = torch.cat((self.lengths, new_lengths))
+        else:
+            self.decoder_input, self.finished, self.lengths = go_frame, new_finished, new_lengths
+        self.sequences.extend(admitted)
+
+    def _decode(self, n_steps):
+        """
+        整个batch走n_steps步，结束判断留在设备上，输出按句子切开保存。
+        """
+        decoder = self.decoder
+        generators = [seq.generator for seq in self.sequences]
+        if all(w is None for w in generators):
+            generators = None
+        mel_outputs, gate_outputs, alignments = [], [], []
+        for _ in range(n_steps):
+            decoder_input = decoder.prenet(self.decoder_input, generators)
+            if self.use_f0:
+                decoder_input = torch.cat((decoder_input, self._get_f0s()), dim=1)
+            mel_output, gate_output, alignment = decoder.decode(decoder_input)
+
+            mel_outputs.append(mel_output)
+            gate_outputs.append(gate_output)
+            alignments.append(alignment)
+
+            self.lengths += (~self.finished).long()
+            self.finished |= torch.sigmoid(gate_output.data[:, 0]) > decoder.gate_threshold
+            self.decoder_input = mel_output
+            for seq in self.sequences:
+                seq.n_steps += 1
+
+        self.n_steps += n_steps * len(self.sequences)
+        self.n_batch_steps += n_steps
+        mel_outputs = torch.stack(mel_outputs)
+        gate_outputs = torch.stack(gate_outputs)
+        alignments = torch.stack(alignments)
+        for num, seq in enumerate(self.sequences):
+            seq.chunks.append((mel_outputs[:, num], gate_outputs[:, num], alignments[:, num, :seq.text.size(1)]))
+
+    def _get_f0s(self):
+        f0s = []
+        for seq in self.sequences:
+            if seq.n_steps < len(seq.f0):
+                f0s.append(seq.f0[seq.n_steps])
+            else:
+                f0s.append(seq.f0[-1] * 0)
+        return torch.stack(f0s)
+
+    def _evict(self):
+        """
+        结束的句子移出batch：拼接输出，截到gate超过阈值的那一步，过postnet后返回结果。
+        """
+        max_steps = self.decoder.max_decoder_steps
+        finished, lengths = torch.stack((self.finished.long(), self.lengths)).tolist()
+        keep = []
+        for num, seq in enumerate(self.sequences):
+            if not finished[num] and seq.n_steps < max_steps:
+                keep.append(num)
+                continue
+            if not finished[num]:
+                logger.info('Warning! Reached max decoder steps')
+            n_frames = min(lengths[num], max_steps)
+            mel_outputs, gate_outputs, alignments = [torch.cat(w)[:n_frames, None] for w in zip(*seq.chunks)]
+            try:
+                outputs = self._postprocess(mel_outputs, gate_outputs, alignments)
+            except Exception as e:
+                seq.future.set_exception(e)
+                continue
+            if seq.outputs_key is not None:
+                self.cache.put_outputs(seq.outputs_key, outputs)
+            seq.future.set_result(outputs)
+        if len(keep) == len(self.sequences):
+            return
+
+        self.sequences = [self.sequences[num] for num in keep]
+        if not self.sequences:
+            return
+        index = torch.tensor(keep, device=self.device)
+        max_time = max(seq.text.size(1) for seq in self.sequences)
+        states = self._get_states()
+        self._set_states({name: _pad_time(name, state[index], max_time) for name, state in states.items()})
+        self.decoder_input = self.decoder_input[index]
+        self.finished = self.finished[index]
+        self.lengths = self.lengths[index]
+
+    def _postprocess(self, mel_outputs, gate_outputs, alignments):
+        mel_outputs, gate_outputs, alignments = self.decoder.parse_decoder_outputs(
+            mel_outputs, gate_outputs, alignments)
+        mel_outputs_postnet = self.model.postnet(mel_outputs)
+        mel_outputs_postnet = mel_outputs + mel_outputs_postnet
+        return self.model.parse_output([mel_outputs, mel_outputs_postnet, gate_outputs, alignments])
+
+    def _get_states(self):
+        names = self.decoder._decoder_state_names + ('memory', 'processed_memory', 'mask')
+        return {name: getattr(self.decoder, name) for name in names}
+
+    def _set_states(self, states):
+        for name, state in states.items():
+            setattr(self.decoder, name, state)
+
+
+def _pad_time(name, state, max_time):
+    """
+    按时间维（第1维）pad或截到max_time，mask pad为True，其余pad为0。
+    """
+    if name not in _time_state_names:
+        return state
+    if state.size(1) >= max_time:
+        return state[:, :max_time]
+    pad = state.new_full((state.size(0), max_time - state.size(1)) + tuple(state.shape[2:]), name == 'mask')
+    return torch.cat((state, pad), dim=1)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+打包的训练数据分片。
+
+所有语音的同一种数据（例如mel）沿第0维拼接，写入一个大的二进制文件，
+offsets.npy记录每条语音在各个文件中的起止位置，index.json记录字段的dtype和形状以及每条语音的元数据。
+读取时用np.memmap返回视图，不复制数据，每条数据不需要单独打开文件。
+
+目录结构：
+    index.json
+    offsets.npy: (n_items + 1, n_fields)
+    <field>.bin
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+
+class ShardWriter:
+    """
+    逐条写入分片，数组的第0维是拼接的维度，其余维度在所有语音中必须一致。
+    值为None的字段记为长度0，info中的数据在close时写入index.json。
+    """
+
+    def __init__(self, shard_dir, fields):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(exist_ok=True, parents=True)
+        self.fields = list(fields)
+        self.files = {k: open(self.shard_dir.joinpath('{}.bin'.format(k)), 'wb') for k in self.fields}
+        self.specs = {}
+        self.offsets = [[0] * len(self.fields)]
+        self.meta = {}
+        self.info = {}
+
+    def add(self, arrays, **meta):
+        """
+        写入一条语音。
+
+        :param arrays: dict，字段名对应np.ndarray或None。
+        :param meta: 该语音的元数据，例如name、speaker，需为可以json序列化的值。
+        """
+        offsets = []
+        for k, last in zip(self.fields, self.offsets[-1]):
+            arr = arrays.get(k)
+            if arr is None:
+                offsets.append(last)
+                continue
+
+            arr = np.ascontiguousarray(arr)
+            spec = {'dtype': arr.dtype.str, 'shape': list(arr.shape[1:])}
+            if k not in self.specs:
+                self.specs[k] = spec
+            elif self.specs[k] != spec:
+                raise ValueError('Field <{}> expected {} but got {}'.format(k, self.specs[k], spec))
+            self.files[k].write(arr.tobytes())
+            offsets.append(last + arr.shape[0])
+        self.offsets.append(offsets)
+
+        num = len(self.offsets) - 2
+        for k, v in meta.items():
+            self.meta.setdefault(k, [None] * num).append(v)
+        for k, v in self.meta.items():
+            if len(v) == num:
+                v.append(None)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        for k in self.fields:
+            self.specs.setdefault(k, {'dtype': np.dtype('float32').str, 'shape': []})
+        np.save(self.shard_dir.joinpath('offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        index = {'fields': self.fields, 'specs': self.specs, 'n_items': len(self.offsets) - 1, 'meta': self.meta,
+                 'info': self.info}
+        with open(self.shard_dir.joinpath('index.json'), 'wt', encoding='utf8') as fout:
+            json.dump(index, fout, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ShardReader:
+    """
+    读取分片，get返回np.memmap的视图（copy-on-write模式，可以直接torch.from_numpy），长度为0的字段返回None。
+
+    memmap在第一次读取时才打开，fork出来的DataLoader的worker各自打开自己的文件句柄。
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir.joinpath('index.json'), encoding='utf8') as fin:
+            index = json.load(fin)
+        self.fields = index['fields']
+        self.specs = index['specs']
+        self.meta = index['meta']
+        self.info = index.get('info', {})
+        self.offsets = np.load(self.shard_dir.joinpath('offsets.npy'))
+        self._arrays = None
+
+    @staticmethod
+    def is_shard(shard_dir):
+        return Path(shard_dir).joinpath('index.json').is_file()
+
+    def _open(self):
+        self._arrays = {}
+        for num, k in enumerate(self.fields):
+            total = int(self.offsets[-1, num])
+            shape = (total,) + tuple(self.specs[k]['shape'])
+            if total == 0:
+                self._arrays[k] = np.zeros(shape, dtype=self.specs[k]['dtype'])
+            else:
+                self._arrays[k] = np.memmap(self.shard_dir.joinpath('{}.bin'.format(k)),
+                                            dtype=self.specs[k]['dtype'], mode='c', shape=shape)
+
+    def lengths(self, field):
+        """
+        每条语音在该字段第0维的长度，不读取数据。
+        """
+        num = self.fields.index(field)
+        return np.diff(self.offsets[:, num])
+
+    def get(self, index, field):
+        if self._arrays is None:
+            self._open()
+        num = self.fields.index(field)
+        start, end = self.offsets[index, num], self.offsets[index + 1, num]
+        if start == end:
+            return None
+        return self._arrays[field][start:end]
+
+    def get_meta(self, index, key):
+        return self.meta[key][index]
+
+    def __getitem__(self, index):
+        return {k: self.get(index, k) for k in self.fields}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
@@ -16,12 +16,13 @@ from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
 
-from .data_utils import TextMelLoader, TextMelCollate
+from .data_utils import TextMelLoader, TextMelShardLoader, TextMelCollate, BucketBatchSampler
 from .distributed import apply_gradient_allreduce
 from .logger import Tacotron2Logger
 from .loss_function import Tacotron2Loss
 from .model import load_model
 from .plotting_utils import plot_mel_alignment_gate_audio
+from .shards import ShardReader
 
 _device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
@@ -62,12 +63,51 @@ def init_distributed(hparams, n_gpus, rank, group_name):
     print("Done initializing distributed")
 
 
+def split_shard_indices(reader, input_directory, hparams):
+    """
+    分片数据的训练集和验证集。
+    有validation.txt时按其中的语音编号（第一列，即分片元数据的name）划分，
+    否则用hparams.seed随机取验证集，所有进程和重启后的划分都相同。验证集的语音不参与训练。
+    """
+    n_items = len(reader)
+    val_path = os.path.join(input_directory, 'validation.txt')
+    names = reader.meta.get('name')
+    if names and os.path.isfile(val_path):
+        with open(val_path, encoding='utf8') as fin:
+            val_names = {line.split('\t')[0] for line in fin if line.strip()}
+        val_ids = [idx for idx, name in enumerate(names) if name in val_names]
+    else:
+        rng = np.random.RandomState(hparams.seed)
+        val_ids = sorted(rng.choice(n_items, min(n_items, hparams.batch_size * 2), replace=False).tolist())
+    val_set = set(val_ids)
+    train_ids = [idx for idx in range(n_items) if idx not in val_set]
+    return train_ids, val_ids
+
+
 def prepare_dataloaders(input_directory, hparams):
     # Get data, data loaders and collate function ready
-    trainset = TextMelLoader(os.path.join(input_directory, 'train.txt'), hparams, mode=hparams.train_mode)
-    valset = TextMelLoader(os.path.join(input_directory, 'validation.txt'), hparams,
-                           speaker_ids=trainset.speaker_ids, mode=hparams.train_mode)
+    if hparams.get('shards_dir'):
+        train_ids, val_ids = split_shard_indices(ShardReader(hparams.shards_dir), input_directory, hparams)
+        trainset = TextMelShardLoader(hparams.shards_dir, hparams, indices=train_ids)
+        valset = TextMelShardLoader(hparams.shards_dir, hparams, speaker_ids=trainset.speaker_ids,
+                                    indices=val_ids)
+    else:
+        trainset = TextMelLoader(os.path.join(input_directory, 'train.txt'), hparams, mode=hparams.train_mode)
+        valset = TextMelLoader(os.path.join(input_directory, 'validation.txt'), hparams,
+                               speaker_ids=trainset.speaker_ids, mode=hparams.train_mode)
     collate_fn = TextMelCollate(hparams.n_frames_per_step)
+    if hparams.dataloader_num_workers == 0:
+        # collate在主进程中运行，batch用完才会生成下一个，可以复用锁页内存，异步拷贝到显卡。
+        train_collate_fn = TextMelCollate(hparams.n_frames_per_step, pin_memory=True, n_buffers=2)
+    else:
+        train_collate_fn = collate_fn
+
+    if hparams.get('bucket_batch'):
+        train_sampler = BucketBatchSampler(trainset.get_lengths(), hparams.batch_size,
+                                           max_frames=hparams.get('batch_max_frames') or 0, seed=hparams.seed)
+        train_loader = DataLoader(trainset, num_workers=hparams.dataloader_num_workers, batch_sampler=train_sampler,
+                                  pin_memory=False, collate_fn=train_collate_fn)
+        return train_loader, valset, collate_fn, train_sampler
 
     if hparams.distributed_run:
         train_sampler = DistributedSampler(trainset)
@@ -78,7 +118,7 @@ def prepare_dataloaders(input_directory, hparams):
 
     train_loader = DataLoader(trainset, num_workers=hparams.dataloader_num_workers, shuffle=shuffle,
                               sampler=train_sampler, batch_size=hparams.batch_size, pin_memory=False,
-                              drop_last=True, collate_fn=collate_fn)
+                              drop_last=True, collate_fn=train_collate_fn)
     return train_loader, valset, collate_fn, train_sampler
 
 
@@ -348,6 +388,9 @@ def train(input_directory, output_directory, log_directory, checkpoint_path, war
             duration = time.perf_counter() - start
             if not is_overflow and rank == 0:
                 logger.log_training(reduced_loss, grad_norm, learning_rate, duration, iteration)
+                # 真实帧数 / pad后的帧数
+                padding_efficiency = batch[4].sum().item() / (batch[2].size(0) * batch[2].size(2))
+                logger.add_scalar("padding.efficiency", padding_efficiency, iteration)
 
             if not is_overflow and ((iteration % hparams.iters_per_checkpoint == 0) or (iteration == iteration_start)):
                 print("Train loss {} {:.6f} Grad Norm {:.6f} {:.2f}s/it".format(
@@ -67,6 +67,154 @@ def getPitch(cmdf, tau_min, tau_max, harmo_th=0.1):
     return 0  # if unvoiced
 
 
+def _frame_signal(sig, w_len, w_step):
+    """
+    Strided view of the analysis windows of sig, one frame per row.
+
+    :param sig: Audio signal (1-D array)
+    :param w_len: size of the analysis window (samples)
+    :param w_step: size of the lag between two consecutives windows (samples)
+    :return: frames of shape (n_frames, w_len), start times of each frame (samples)
+    :rtype: tuple
+    """
+    starts = np.arange(0, len(sig) - w_len, w_step)
+    if len(starts) == 0:
+        return np.zeros((0, w_len), dtype=sig.dtype), starts
+    frames = np.lib.stride_tricks.sliding_window_view(sig, w_len)[::w_step][:len(starts)]
+    return frames, starts
+
+
+def differenceFunctionFrames(frames, tau_max):
+    """
+    Compute difference function of every row of frames at once with a single 2-D FFT.
+
+    Same numerics as :func:`differenceFunction`, applied along the last axis.
+
+    :param frames: audio frames of shape (n_frames, w_len)
+    :param tau_max: integration window size
+    :return: difference function of shape (n_frames, min(tau_max, w_len))
+    :rtype: np.ndarray
+    """
+    x = np.asarray(frames, np.float64)
+    w = x.shape[1]
+    tau_max = min(tau_max, w)
+    x_cumsum = np.concatenate((np.zeros((x.shape[0], 1)), (x * x).cumsum(axis=1)), axis=1)
+    size = w + tau_max
+    p2 = (size // 32).bit_length()
+    nice_numbers = (16, 18, 20, 24, 25, 27, 30, 32)
+    size_pad = min(n * 2 ** p2 for n in nice_numbers if n * 2 ** p2 >= size)
+    fc = np.fft.rfft(x, size_pad, axis=1)
+    conv = np.fft.irfft(fc * fc.conjugate(), axis=1)[:, :tau_max]
+    return x_cumsum[:, w:w - tau_max:-1] + x_cumsum[:, w:w + 1] - x_cumsum[:, :tau_max] - 2 * conv
+
+
+def cumulativeMeanNormalizedDifferenceFunctionFrames(df, N):
+    """
+    Compute cumulative mean normalized difference function (CMND) of every row of df.
+
+    :param df: Difference function of shape (n_frames, N)
+    :param N: length of data
+    :return: cumulative mean normalized difference function of shape (n_frames, N)
+    :rtype: np.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cmndf = df[:, 1:] * np.arange(1, N) / np.cumsum(df[:, 1:], axis=1)
+    return np.concatenate((np.ones((df.shape[0], 1)), cmndf), axis=1)
+
+
+def getPitchFrames(cmdf, tau_min, tau_max, harmo_th=0.1):
+    """
+    Return fundamental period of every frame based on CMND function.
+
+    The first tau under the threshold is searched with array operations, then moved forward to the
+    bottom of its local descent, as :func:`getPitch` does.
+
+    :param cmdf: Cumulative Mean Normalized Difference function of shape (n_frames, tau_max)
+    :param tau_min: minimum period for speech
+    :param tau_max: maximum period for speech
+    :param harmo_th: harmonicity threshold to determine if it is necessary to compute pitch frequency
+    :return: fundamental period of every frame, 0 where unvoiced
+    :rtype: np.ndarray
+    """
+    n_frames = cmdf.shape[0]
+    if n_frames == 0 or tau_min >= tau_max:
+        return np.zeros(n_frames, dtype=int)
+
+    under = cmdf[:, tau_min:tau_max] < harmo_th
+    voiced = under.any(axis=1)
+    first = np.argmax(under, axis=1) + tau_min
+
+    # stop[:, j] 为真表示从j不能再往下走：cmdf[j + 1] >= cmdf[j] 或者已经到了 tau_max - 1。
+    stop = np.ones((n_frames, tau_max), dtype=bool)
+    stop[:, :tau_max - 1] = ~(cmdf[:, 1:tau_max] < cmdf[:, :tau_max - 1])
+    stop &= np.arange(tau_max)[None] >= first[:, None]
+    taus = np.argmax(stop, axis=1)
+    return np.where(voiced, taus, 0)
+
+
+def compute_yin_batch(sigs, sr, w_len=512, w_step=256, f0_min=100, f0_max=500,
+                      harmo_thresh=0.1, max_frames=8192):
+    """
+
+    Compute the Yin Algorithm for a list of signals. The frames of all signals are stacked into one
+    matrix and processed with array operations, max_frames rows at a time.
+
+    :param sigs: list of Audio signals (list of float or np.ndarray)
+    :param sr: sampling rate (int)
+    :param w_len: size of the analysis window (samples)
+    :param w_step: size of the lag between two consecutives windows (samples)
+    :param f0_min: Minimum fundamental frequency that can be detected (hertz)
+    :param f0_max: Maximum fundamental frequency that can be detected (hertz)
+    :param harmo_thresh: Threshold of detection. The algorithm return the first minimum of the CMND function below this treshold.
+    :param max_frames: maximum number of frames processed in one FFT. The frames of each signal are
+        strided views, only max_frames rows at a time are copied, so this bounds the working memory.
+
+    :returns: list of (pitches, harmonic_rates, argmins, times) tuples, one per signal, see :func:`compute_yin`.
+    :rtype: list
+    """
+    tau_min = int(sr / f0_max)
+    tau_max = int(sr / f0_min)
+
+    frames_lst, times_lst = [], []
+    for sig in sigs:
+        frames, starts = _frame_signal(np.asarray(sig), w_len, w_step)
+        frames_lst.append(frames)
+        times_lst.append([t / float(sr) for t in starts.tolist()])
+
+    n_frames = [len(frames) for frames in frames_lst]
+    total = sum(n_frames)
+    pitches = np.zeros(total)
+    harmonic_rates = np.zeros(total)
+    argmins = np.zeros(total)
+
+    # 所有语音的帧依次分块计算，每块只从各语音帧的strided view中复制max_frames行，控制内存。
+    offsets = np.cumsum([0] + n_frames)
+    for start in range(0, total, max_frames):
+        end = min(start + max_frames, total)
+        frames = np.concatenate([frames_lst[k][max(start - offsets[k], 0):end - offsets[k]]
+                                 for k in range(len(frames_lst)) if offsets[k] < end and offsets[k + 1] > start],
+                                axis=0)
+        df = differenceFunctionFrames(frames, tau_max)
+        cmdf = cumulativeMeanNormalizedDifferenceFunctionFrames(df, tau_max)
+        p = getPitchFrames(cmdf, tau_min, tau_max, harmo_thresh)
+
+        rows = np.arange(len(frames))
+        idx = np.argmin(cmdf, axis=1)
+        out = slice(start, start + len(frames))
+        with np.errstate(divide='ignore'):
+            argmins[out] = np.where(idx > tau_min, sr / np.maximum(idx, 1), 0.0)
+            pitches[out] = np.where(p != 0, sr / np.maximum(p, 1), 0.0)
+        harmonic_rates[out] = np.where(p != 0, cmdf[rows, p], np.nanmin(cmdf, axis=1))
+
+    outs = []
+    offset = 0
+    for num, times in zip(n_frames, times_lst):
+        out = slice(offset, offset + num)
+        outs.append((pitches[out].tolist(), harmonic_rates[out].tolist(), argmins[out].tolist(), times))
+        offset += num
+    return outs
+
+
 def compute_yin(sig, sr, w_len=512, w_step=256, f0_min=100, f0_max=500,
                 harmo_thresh=0.1):
     """
@@ -81,6 +229,33 @@ def compute_yin(sig, sr, w_len=512, w_step=256, f0_min=100, f0_max=500,
     :param f0_max: Maximum fundamental frequency that can be detected (hertz)
     :param harmo_tresh: Threshold of detection. The yalgorithmù return the first minimum of the CMND function below this treshold.
 
+    :returns:
+
+        * pitches: list of fundamental frequencies,
+        * harmonic_rates: list of harmonic rate values for each fundamental frequency value (= confidence value)
+        * argmins: minimums of the Cumulative Mean Normalized DifferenceFunction
+        * times: list of time of each estimation
+    :rtype: tuple
+    """
+    return compute_yin_batch([sig], sr, w_len, w_step, f0_min, f0_max, harmo_thresh)[0]
+
+
+def compute_yin_slow(sig, sr, w_len=512, w_step=256, f0_min=100, f0_max=500,
+                harmo_thresh=0.1):
+    """
+
+    Compute the Yin Algorithm frame by frame. Return fundamental frequency and harmonic rate.
+
+    Reference implementation, kept for parity checks of :func:`compute_yin`.
+
+    :param sig: Audio signal (list of float)
+    :param sr: sampling rate (int)
+    :param w_len: size of the analysis window (samples)
+    :param w_step: size of the lag between two consecutives windows (samples)
+    :param f0_min: Minimum fundamental frequency that can be detected (hertz)
+    :param f0_max: Maximum fundamental frequency that can be detected (hertz)
+    :param harmo_tresh: Threshold of detection. The yalgorithmù return the first minimum of the CMND function below this treshold.
+
     :returns:
 
         * pitches: list of fundamental frequencies,
@@ -117,3 +292,35 @@ def compute_yin(sig, sr, w_len=512, w_step=256, f0_min=100, f0_max=500,
             harmonic_rates[i] = min(cmdf)
 
     return pitches, harmonic_rates, argmins, times
+
+
+if __name__ == "__main__":
+    import time
+
+    # 对比逐帧实现的结果，并测试速度。
+    sr = 22050
+    t = np.arange(sr * 10) / sr
+    wav = np.sin(2 * np.pi * (150 + 50 * np.sin(2 * np.pi * 0.5 * t)) * t) * 16000
+    wav[sr * 4:sr * 5] = 0
+    wav = (wav + np.random.randn(len(wav)) * 500).astype('int16')
+    kwargs = dict(sr=sr, w_len=1024, w_step=256, f0_min=80, f0_max=880, harmo_thresh=0.25)
+
+    t0 = time.time()
+    out_slow = compute_yin_slow(wav, **kwargs)
+    t1 = time.time()
+    out_fast = compute_yin(wav, **kwargs)
+    t2 = time.time()
+    outs_batch = compute_yin_batch([wav] * 8, **kwargs)
+    t3 = time.time()
+
+    for a, b in zip(out_slow, out_fast):
+        assert np.allclose(a, b, equal_nan=True)
+    for out in outs_batch:
+        for a, b in zip(out_fast, out):
+            assert np.allclose(a, b, equal_nan=True)
+
+    n_frames = len(out_slow[0])
+    print('parity ok, frames: {}'.format(n_frames))
+    print('compute_yin_slow: {:.0f} frames/s'.format(n_frames / (t1 - t0)))
+    print('compute_yin: {:.0f} frames/s'.format(n_frames / (t2 - t1)))
+    print('compute_yin_batch: {:.0f} frames/s'.format(n_frames * 8 / (t3 - t2)))
@@ -1,7 +1,11 @@
+import logging
+import time
 from functools import partial
 from itertools import chain
 from multiprocessing.pool import Pool
 from pathlib import Path
+from queue import Queue, Empty
+from threading import Thread, Event
 
 import librosa
 import numpy as np
@@ -12,6 +16,8 @@ from encoder.audio import preprocess_wav
 from synthesizer.utils import audio
 from utils import logmmse
 
+logger = logging.getLogger(Path(__file__).stem)
+
 
 def preprocess_librispeech(datasets_root: Path, out_dir: Path, n_processes: int, skip_existing: bool, hparams):
     # Gather the input directories
@@ -276,16 +282,10 @@ def process_utterance(wav_fpath: np.ndarray, text: str, out_dir: Path, basename:
     return str(wav_fpath).replace("\\", "/"), mel_fpath.name, "embed-%s.npy" % basename, len(wav), mel_frames, text
 
 
-def embed_utterance(fpaths, encoder_model_fpath, hparams):
-    if not encoder.is_loaded():
-        encoder.load_model(encoder_model_fpath)
-
-    # Compute the speaker embedding of the utterance
-    wav_fpath, embed_fpath = fpaths
-    if embed_fpath.exists():
-        return
-    # wav = np.load(wav_fpath)
-
+def load_embed_wav(wav_fpath, hparams):
+    """
+    Loads a waveform and applies the encoder preprocessing, returns it with its duration in seconds.
+    """
     wav, source_sr = librosa.load(wav_fpath, None)
     if source_sr != hparams.sample_rate:
         wav = librosa.resample(wav, source_sr, hparams.sample_rate)
@@ -293,12 +293,18 @@ def embed_utterance(fpaths, encoder_model_fpath, hparams):
     if hparams.rescale:
         wav = wav / np.abs(wav).max() * hparams.rescaling_max
 
-    wav = preprocess_wav(wav)
-    embed = encoder.embed_utterance(wav)
-    np.save(embed_fpath, embed, allow_pickle=False)
+    return preprocess_wav(wav), len(wav) / hparams.sample_rate
 
 
-def create_embeddings(synthesizer_root: Path, encoder_model_fpath: Path, n_processes: int, hparams):
+def create_embeddings(synthesizer_root: Path, encoder_model_fpath: Path, n_processes: int, hparams,
+                      batch_size: int = 32, skip_existing: bool = True):
+    """
+    Computes the speaker embeddings of the synthesizer training data with a three-stage pipeline:
+    <n_processes> threads load, resample and trim the waveforms into a bounded queue, a single
+    consumer runs the encoder on batches of <batch_size> utterances and a writer thread saves the
+    embeddings. With <skip_existing>, utterances whose embedding already exists are skipped, so an
+    interrupted run can be resumed.
+    """
     # wav_dir = synthesizer_root.joinpath("audio")
     metadata_fpath = synthesizer_root.joinpath("train.txt")
     assert metadata_fpath.exists()
@@ -309,13 +315,93 @@ def create_embeddings(synthesizer_root: Path, encoder_model_fpath: Path, n_proce
     with metadata_fpath.open("r", encoding="utf8") as metadata_file:
         metadata = [line.split("|") for line in metadata_file]
         fpaths = [(m[0], embed_dir.joinpath(m[2])) for m in metadata]
+    if skip_existing:
+        fpaths = [(wav_fpath, embed_fpath) for wav_fpath, embed_fpath in fpaths if not embed_fpath.exists()]
+    if not fpaths:
+        return
 
-    # TODO: improve on the multiprocessing, it's terrible. Disk I/O is the bottleneck here.
-    # Embed the utterances in separate threads
-    if n_processes == 0:
-        for fpath in tqdm(fpaths):
-            embed_utterance(fpath, encoder_model_fpath=encoder_model_fpath, hparams=hparams)
-    else:
-        func = partial(embed_utterance, encoder_model_fpath=encoder_model_fpath, hparams=hparams)
-        job = Pool(n_processes).imap(func, fpaths)
-        list(tqdm(job, "Embedding", len(fpaths), unit="utterances"))
+    if not encoder.is_loaded():
+        encoder.load_model(encoder_model_fpath)
+
+    n_loaders = max(n_processes, 1)
+    todo_queue = Queue()
+    for fpath in fpaths:
+        todo_queue.put(fpath)
+    wav_queue = Queue(maxsize=batch_size * 4)
+    write_queue = Queue(maxsize=batch_size * 4)
+    # Set when a write fails: the loaders stop taking new files, the encoder stops and the writer
+    # keeps draining its queue so that no producer blocks on a full queue.
+    failed = Event()
+    write_errors = []
+
+    # Stage 1: disk I/O, resampling and VAD trimming in threads
+    def load_worker():
+        while not failed.is_set():
+            try:
+                wav_fpath, embed_fpath = todo_queue.get_nowait()
+            except Empty:
+                break
+            try:
+                wav, duration = load_embed_wav(wav_fpath, hparams)
+                wav_queue.put((embed_fpath, wav, duration))
+            except Exception as e:
+                logger.info("Error! The <{}> audio load failed! {}".format(wav_fpath, e))
+                wav_queue.put((embed_fpath, None, 0))
+        wav_queue.put(None)
+
+    # Stage 3: asynchronous writes of the embeddings
+    def write_worker():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            if failed.is_set():
+                continue
+            embed_fpath, embed = item
+            try:
+                np.save(embed_fpath, embed, allow_pickle=False)
+            except Exception as e:
+                logger.exception("Error! The <{}> embedding write failed!".format(embed_fpath))
+                write_errors.append((embed_fpath, e))
+                failed.set()
+
+    loaders = [Thread(target=load_worker, daemon=True) for _ in range(n_loaders)]
+    writer = Thread(target=write_worker, daemon=True)
+    for thread in loaders + [writer]:
+        thread.start()
+
+    # Stage 2: batched forward passes of the encoder in the current thread
+    n_done, n_utterances, n_seconds = 0, 0, 0.
+    start = time.time()
+    with tqdm(total=len(fpaths), desc="Embedding", unit="utterances") as progress:
+        while n_done < n_loaders:
+            batch = []
+            while len(batch) < batch_size and n_done < n_loaders:
+                item = wav_queue.get()
+                if item is None:
+                    n_done += 1
+                elif item[1] is None:
+                    progress.update(1)
+                else:
+                    batch.append(item)
+            if not batch or failed.is_set():
+                continue
+
+            embeds = encoder.embed_utterances([wav for _, wav, _ in batch])
+            for (embed_fpath, _, duration), embed in zip(batch, embeds):
+                write_queue.put((embed_fpath, embed))
+                n_seconds += duration
+            n_utterances += len(batch)
+            progress.update(len(batch))
+            elapsed = time.time() - start
+            progress.set_postfix(utt_s="%.1f" % (n_utterances / elapsed),
+                                 audio_h_s="%.4f" % (n_seconds / 3600 / elapsed))
+
+    write_queue.put(None)
+    writer.join()
+    if write_errors:
+        embed_fpath, e = write_errors[0]
+        raise RuntimeError("Embedding aborted, the <{}> embedding write failed! {}".format(embed_fpath, e)) from e
+    elapsed = time.time() - start
+    print("Embedded %d utterances (%.2f hours of audio) in %.1fs: %.1f utterances/sec, %.4f audio-hours/sec." % (
+        n_utterances, n_seconds / 3600, elapsed, n_utterances / elapsed, n_seconds / 3600 / elapsed))
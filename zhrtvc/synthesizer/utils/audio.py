@@ -1,9 +1,10 @@
 import numpy as np
+import torch
 from aukit.audio_griffinlim import default_hparams
-from aukit.audio_griffinlim import inv_mel_spectrogram
 from aukit.audio_griffinlim import load_wav
 from aukit.audio_io import Dict2Obj
-from aukit.audio_spectrogram import mel_spectrogram
+
+from melgan.mel2wav.interface import get_mel_frontend
 
 _sr = 22050
 my_hp = {
@@ -30,16 +31,29 @@ _pad_len = (default_hparams.n_fft - default_hparams.hop_size) // 2
 
 
 def melspectrogram(wav, hparams=None):
-    wav = np.pad(wav.flatten(), (_pad_len, _pad_len), mode="reflect")
-    mel = mel_spectrogram(wav, melgan_hparams)
-    mel = mel / 20
-    return mel
+    """
+    wav为np.ndarray时返回np.ndarray，为torch.Tensor时在其所在的设备上计算并返回torch.Tensor。
+    """
+    if isinstance(wav, torch.Tensor):
+        fft = get_mel_frontend(melgan_hparams, pad_len=_pad_len, scale=20, device=wav.device)
+        return fft(wav.flatten())
+    fft = get_mel_frontend(melgan_hparams, pad_len=_pad_len, scale=20)
+    with torch.no_grad():
+        mel = fft(torch.from_numpy(np.asarray(wav, dtype=np.float32).flatten()))
+    return mel.numpy()
 
 
 def inv_melspectrogram(mel, hparams=None):
-    mel = mel * 20
-    wav = inv_mel_spectrogram(mel, melgan_hparams)
-    return wav
+    """
+    用批量的快速Griffin-Lim把melspectrogram的输出转回语音，mel为np.ndarray时返回np.ndarray。
+    """
+    if isinstance(mel, torch.Tensor):
+        fft = get_mel_frontend(melgan_hparams, pad_len=_pad_len, scale=20, device=mel.device)
+        return fft.inverse(mel, n_iters=melgan_hparams.griffin_lim_iters)
+    fft = get_mel_frontend(melgan_hparams, pad_len=_pad_len, scale=20)
+    with torch.no_grad():
+        wav = fft.inverse(torch.from_numpy(np.asarray(mel, dtype=np.float32)), n_iters=melgan_hparams.griffin_lim_iters)
+    return wav.numpy()
 
 
 if __name__ == "__main__":
@@ -23,10 +23,15 @@ def main():
     parser.add_argument("-e", "--encoder_model_fpath", type=Path,
                         default=r"../models/encoder/saved_models/ge2e_pretrained.pt",
                         help="Path your trained encoder model.")
-    parser.add_argument("-n", "--n_processes", type=int, default=0,
-                        help="Number of parallel processes. An encoder is created for each, "
-                             "so you may need to lower this value on GPUs with low memory. "
-                             "Set it to 1 if CUDA is unhappy.")
+    parser.add_argument("-n", "--n_processes", type=int, default=4,
+                        help="Number of threads loading and trimming the audio. A single encoder "
+                             "embeds the loaded utterances in batches.")
+    parser.add_argument("-b", "--batch_size", type=int, default=32,
+                        help="Number of utterances per forward pass of the encoder.")
+    parser.add_argument("-s", "--skip_existing", action="store_true", default=True,
+                        help="Skip the utterances whose embedding already exists.")
+    parser.add_argument("--no_skip_existing", dest="skip_existing", action="store_false",
+                        help="Recompute the embeddings of all the utterances.")
     parser.add_argument("--hparams", type=str, default="",
                         help="Hyperparameter overrides as a json string, for example: '\"key1\":123,\"key2\":true'")
     args = parser.parse_args()
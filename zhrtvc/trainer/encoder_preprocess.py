@@ -7,7 +7,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(Path(__file__).stem)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from encoder.preprocess import preprocess_librispeech, preprocess_voxceleb1, preprocess_voxceleb2
+from encoder.preprocess import preprocess_librispeech, preprocess_voxceleb1, preprocess_voxceleb2, pack_shards
 from utils.argutils import print_args
 from pathlib import Path
 import argparse
@@ -46,6 +46,9 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--skip_existing", action="store_true", help= \
         "Whether to skip existing output files with the same name. Useful if this script was "
         "interrupted.")
+    parser.add_argument("--pack_shards", action="store_true", help= \
+        "Whether to also pack the preprocessed utterances into a memory-mapped shard at "
+        "<out_dir>/shards. Pass that directory as clean_data_root to train the encoder from it.")
     args = parser.parse_args()
 
     # Process the arguments
@@ -63,6 +66,10 @@ if __name__ == "__main__":
         "voxceleb2": preprocess_voxceleb2,
     }
     args = vars(args)
+    do_pack_shards = args.pop("pack_shards")
     for dataset in args.pop("datasets"):
         print("Preprocessing %s" % dataset)
         preprocess_func[dataset](**args)
+
+    if do_pack_shards:
+        pack_shards(args["out_dir"], args["out_dir"].joinpath("shards"))
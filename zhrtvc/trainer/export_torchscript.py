@@ -0,0 +1,102 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+export_torchscript
+
+把MelGAN的Generator和WaveGlow导出为TorchScript模型，导入时不需要模型代码。
+输出默认保存为模型文件旁边的<name>.script.pt，load_melgan_torch和load_waveglow_torch会优先导入。
+"""
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.torchscript import script_path
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--melgan_path", type=str, default='',
+                        help='MelGAN模型路径，torch.save保存的整个模型，或者和--melgan_args_path一起用的checkpoint')
+    parser.add_argument("--melgan_args_path", type=str, default='', help='MelGAN的模型参数文件')
+    parser.add_argument("--waveglow_path", type=str, default='',
+                        help='WaveGlow模型路径，训练的checkpoint或者torch.save保存的整个模型')
+    parser.add_argument("--melgan_output", type=str, default='', help='默认为<melgan_path>.script.pt')
+    parser.add_argument("--waveglow_output", type=str, default='', help='默认为<waveglow_path>.script.pt')
+    parser.add_argument("--benchmark", action='store_true', help='比较导入时间和每次推理的时间')
+    parser.add_argument("--n_frames", type=int, default=400, help='测试用的mel帧数')
+    return parser.parse_args()
+
+
+def benchmark(name, load_pickled, load_script, infer, n_frames, n_calls=5):
+    """
+    导入时间和每次推理的平均时间。
+    """
+    mel = torch.randn(1, 80, n_frames) * 0.5 - 5
+    for kind, load in [('pickled', load_pickled), ('script', load_script)]:
+        start = time.time()
+        model = load()
+        t_load = time.time() - start
+        with torch.no_grad():
+            start = time.time()
+            infer(model, mel)
+            t_first = time.time() - start
+            start = time.time()
+            for _ in range(n_calls):
+                infer(model, mel)
+            t_call = (time.time() - start) / n_calls
+        print('{} {}: load {:.3f}s, first call {:.3f}s, per call {:.3f}s'.format(name, kind, t_load, t_first, t_call))
+
+
+def export_melgan(args):
+    from melgan import inference
+
+    if args.melgan_args_path:
+        model = inference.load_melgan_model(args.melgan_path, args.melgan_args_path, device='cpu')
+    else:
+        model = torch.load(args.melgan_path, map_location='cpu')
+    outpath = args.melgan_output or script_path(args.melgan_path)
+    inference.export_torchscript(model, outpath)
+    print('MelGAN TorchScript saved to {}'.format(outpath))
+
+    if args.benchmark:
+        if args.melgan_args_path:
+            load_pickled = lambda: inference.load_melgan_model(args.melgan_path, args.melgan_args_path, device='cpu')
+        else:
+            load_pickled = lambda: torch.load(args.melgan_path, map_location='cpu')
+        benchmark('MelGAN', load_pickled, lambda: torch.jit.load(str(outpath), map_location='cpu'),
+                  lambda model, mel: model(mel), args.n_frames)
+
+
+def export_waveglow(args):
+    from waveglow import inference
+    from waveglow.glow import WaveGlow
+
+    def load_pickled():
+        model = torch.load(args.waveglow_path, map_location='cpu')
+        if isinstance(model, dict):
+            model = model['model']
+        if hasattr(model.WN[0].start, 'weight_g'):
+            model = WaveGlow.remove_weightnorm(model)
+        return model.eval()
+
+    model = load_pickled()
+    outpath = args.waveglow_output or script_path(args.waveglow_path)
+    inference.export_torchscript(model, outpath)
+    print('WaveGlow TorchScript saved to {}'.format(outpath))
+
+    if args.benchmark:
+        benchmark('WaveGlow', load_pickled, lambda: torch.jit.load(str(outpath), map_location='cpu'),
+                  lambda model, mel: model.infer(mel, sigma=1.0), args.n_frames)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.melgan_path:
+        export_melgan(args)
+    if args.waveglow_path:
+        export_waveglow(args)
@@ -0,0 +1,175 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+mellotron_scheduler_benchmark
+
+模拟泊松分布到达的合成请求，比较三种服务方式的吞吐量和延迟：
+    sequential: 逐句Tacotron2.inference；
+    static: 到达的请求凑成一批（最多max_batch_size句）用inference_batch合成完，再取下一批；
+    continuous: DecoderScheduler连续批处理。
+同时检查continuous每句的结果和单独inference的一致性。
+
+不给模型时用随机初始化的模型，关掉prenet的dropout，gate改为在第4倍文本长度步结束。
+"""
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('-m', '--checkpoint_path', type=str, default='', help='训练的checkpoint，为空则随机初始化模型')
+    parser.add_argument('--hparams_path', type=str, default='', help='checkpoint对应的hparams.json')
+    parser.add_argument('--n_requests', type=int, default=48)
+    parser.add_argument('--rate', type=float, default=6, help='每秒平均到达的请求数')
+    parser.add_argument('--min_length', type=int, default=5, help='文本长度下限')
+    parser.add_argument('--max_length', type=int, default=50, help='文本长度上限')
+    parser.add_argument('--max_batch_size', type=int, default=8)
+    parser.add_argument('--check_every', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1, help='torch.set_num_threads')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def load_model(args):
+    from mellotron import model as mellotron_model
+    from mellotron.hparams import create_hparams
+
+    if args.checkpoint_path:
+        hparams = create_hparams(open(args.hparams_path, encoding='utf8').read())
+        model = mellotron_model.load_model(hparams).eval()
+        model.load_state_dict(torch.load(args.checkpoint_path, map_location='cpu')['state_dict'])
+        return model, hparams
+
+    mellotron_model.drop_rate = 0.
+    hparams = create_hparams()
+    hparams.max_decoder_steps = 400
+    model = mellotron_model.Tacotron2(hparams).eval()
+    decoder = model.decoder
+    decoder.gate_layer.forward = lambda x: (decoder.attention_weights_cum.sum(1, keepdim=True)
+                                            - 4 * (decoder.attention_weights_cum > 0).sum(1, keepdim=True) + 0.5)
+    return model, hparams
+
+
+def make_requests(args, hparams):
+    rng = np.random.RandomState(args.seed)
+    requests = []
+    for _ in range(args.n_requests):
+        length = rng.randint(args.min_length, args.max_length + 1)
+        text = torch.from_numpy(rng.randint(1, hparams.n_symbols, length))
+        text[-1] = 0
+        if hparams.train_mode.endswith(('rtvc', 'mspk')):
+            speaker = torch.from_numpy(rng.randn(hparams.n_speakers).astype(np.float32))
+        else:
+            speaker = torch.tensor(rng.randint(hparams.n_speakers))
+        requests.append((text, speaker))
+    arrivals = np.cumsum(rng.exponential(1 / args.rate, args.n_requests))
+    return requests, arrivals
+
+
+def run_sequential(model, requests, arrivals):
+    finish = []
+    start = time.time()
+    with torch.no_grad():
+        for (text, speaker), arrival in zip(requests, arrivals):
+            time.sleep(max(0., arrival - (time.time() - start)))
+            model.inference((text[None], 0, speaker[None], None))
+            finish.append(time.time() - start)
+    return np.array(finish)
+
+
+def run_static(model, requests, arrivals, max_batch_size):
+    finish = [0.] * len(requests)
+    start = time.time()
+    num = 0
+    with torch.no_grad():
+        while num < len(requests):
+            time.sleep(max(0., arrivals[num] - (time.time() - start)))
+            now = time.time() - start
+            end = num + 1
+            while end < len(requests) and end - num < max_batch_size and arrivals[end] <= now:
+                end += 1
+            texts = [requests[k][0] for k in range(num, end)]
+            text = torch.zeros(len(texts), max(len(w) for w in texts), dtype=torch.long)
+            for k, w in enumerate(texts):
+                text[k, :len(w)] = w
+            speakers = torch.stack([requests[k][1] for k in range(num, end)])
+            lengths = torch.tensor([len(w) for w in texts])
+            model.inference_batch((text, 0, speakers, None), input_lengths=lengths)
+            for k in range(num, end):
+                finish[k] = time.time() - start
+            num = end
+    return np.array(finish)
+
+
+def run_continuous(model, requests, arrivals, max_batch_size, check_every):
+    from mellotron.scheduler import DecoderScheduler
+
+    finish = [0.] * len(requests)
+    futures = []
+    scheduler = DecoderScheduler(model, max_batch_size=max_batch_size, check_every=check_every)
+    start = time.time()
+
+    def on_done(num):
+        return lambda future: finish.__setitem__(num, time.time() - start)
+
+    for num, ((text, speaker), arrival) in enumerate(zip(requests, arrivals)):
+        time.sleep(max(0., arrival - (time.time() - start)))
+        future = scheduler.submit(text, speaker)
+        future.add_done_callback(on_done(num))
+        futures.append(future)
+    results = [w.result() for w in futures]
+    scheduler.close()
+    print('continuous: mean batch size {:.2f}'.format(scheduler.n_steps / max(scheduler.n_batch_steps, 1)))
+    return np.array(finish), results
+
+
+def report(name, finish, arrivals, n_frames):
+    latency = finish - arrivals
+    print('{:>10} {:>10.2f} {:>12.1f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+        name, finish.max(), n_frames / finish.max(), latency.mean(), np.percentile(latency, 50),
+        np.percentile(latency, 90)))
+
+
+def main():
+    args = parse_args()
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    model, hparams = load_model(args)
+    requests, arrivals = make_requests(args, hparams)
+    print('{} requests, {:.1f} requests/s, arrivals span {:.2f}s'.format(len(requests), args.rate, arrivals[-1]))
+
+    with torch.no_grad():
+        model.inference((requests[0][0][None], 0, requests[0][1][None], None))
+        references = [model.inference((text[None], 0, speaker[None], None)) for text, speaker in requests]
+    n_frames = sum(w[1].size(2) for w in references)
+
+    finish_sequential = run_sequential(model, requests, arrivals)
+    finish_static = run_static(model, requests, arrivals, args.max_batch_size)
+    finish_continuous, results = run_continuous(model, requests, arrivals, args.max_batch_size, args.check_every)
+
+    diff = 0.
+    for ref, out in zip(references, results):
+        if ref[1].shape != out[1].shape:
+            diff = float('inf')
+            break
+        diff = max(diff, (ref[1] - out[1]).abs().max().item())
+    print('continuous vs inference: max diff of mel_outputs_postnet {:.2e}'.format(diff))
+
+    print('{:>10} {:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'mode', 'total (s)', 'frames/s', 'latency (s)', 'p50 (s)', 'p90 (s)'))
+    report('sequential', finish_sequential, arrivals, n_frames)
+    report('static', finish_static, arrivals, n_frames)
+    report('continuous', finish_continuous, arrivals, n_frames)
+    print(json.dumps(vars(args), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,7 +43,7 @@ def parse_args():
 
 # 要把glow所在目录包含进来，否则导致glow缺失报错。
 def inference(input_path, waveglow_path, config_path, output_path, save_model_path, is_simple=1, **kwargs):
-    from waveglow.inference import Denoiser
+    from waveglow.denoiser import Denoiser
     # from mellotron.layers import TacotronSTFT
     from waveglow.mel2samp import MAX_WAV_VALUE, Mel2Samp, load_wav_to_torch
 
@@ -51,13 +51,13 @@ def inference(input_path, waveglow_path, config_path, output_path, save_model_pa
     sigma = kwargs.get('sigma', 1.0)
 
     waveglow = torch.load(waveglow_path)['model']
-    waveglow = waveglow.remove_weightnorm(waveglow)
+    waveglow = waveglow.compile_inference(waveglow)
     # waveglow.cuda().eval()
     if save_model_path:
         torch.save(waveglow, save_model_path)
 
     # denoiser = Denoiser(waveglow).cuda()
-    denoiser = Denoiser(waveglow)
+    denoiser = Denoiser(waveglow, model_path=waveglow_path)
 
     # waveglow = torch.load('../waveglow_v5_model.pt', map_location='cuda')
     with open(config_path) as f:
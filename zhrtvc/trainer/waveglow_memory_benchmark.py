@@ -0,0 +1,72 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+waveglow_memory_benchmark
+
+比较WaveGlow整段推理和分段推理（generate_wave的max_memory）的峰值内存（RSS）和耗时随语音长度的变化。
+每个测试在单独的子进程中运行，峰值内存取推理后ru_maxrss减去推理前的值。
+"""
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('-w', '--waveglow_path', type=str, default='',
+                        help='torch.save保存的模型，为空则用config.json随机初始化的模型')
+    parser.add_argument('-c', '--config_path', type=str, default='waveglow/config.json')
+    parser.add_argument('--seconds', type=str, default='2,5,10,20', help='测试的语音长度（秒），逗号分隔')
+    parser.add_argument('--max_memory', type=float, default=256, help='分段推理的内存上限（MB）')
+    return parser.parse_args()
+
+
+def run(args, seconds, max_memory, queue):
+    from waveglow import inference
+    from waveglow.glow import WaveGlow
+
+    torch.set_num_threads(1)
+    with open(args.config_path) as fin:
+        config = json.load(fin)
+    if args.waveglow_path:
+        inference.load_waveglow_torch(args.waveglow_path, device='cpu')
+    else:
+        inference._model = WaveGlow.compile_inference(WaveGlow(**config['waveglow_config']))
+    data_config = config['data_config']
+    n_frames = int(seconds * data_config['sampling_rate'] / data_config['hop_length'])
+    mel = torch.randn(1, 80, n_frames) * 0.5 - 5
+    inference.generate_wave(mel[:, :, :8], max_memory=max_memory)
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    inference.generate_wave(mel, max_memory=max_memory)
+    queue.put(((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024, time.time() - start))
+
+
+def main():
+    args = parse_args()
+    ctx = multiprocessing.get_context('spawn')
+    print('{:>8} {:>10} {:>14} {:>10}'.format('seconds', 'mode', 'peak RSS (MB)', 'time (s)'))
+    for seconds in [float(w) for w in args.seconds.split(',')]:
+        for mode, max_memory in [('full', 0), ('chunked', args.max_memory)]:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run, args=(args, seconds, max_memory, queue))
+            proc.start()
+            proc.join()
+            if proc.exitcode != 0:
+                print('{:>8} {:>10} {:>14}'.format(seconds, mode, 'failed'))
+                continue
+            peak, cost = queue.get()
+            print('{:>8} {:>10} {:>14.1f} {:>10.2f}'.format(seconds, mode, peak, cost))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import io
+import zipfile
+from pathlib import Path
+
+import torch
+
+
+def script_path(model_path):
+    """
+    模型文件对应的TorchScript文件路径：xxx.pt -> xxx.script.pt
+    """
+    return Path(model_path).with_suffix('.script.pt')
+
+
+def is_torchscript(fpath):
+    """
+    判断文件是否是torch.jit.save保存的模型。
+    """
+    if not zipfile.is_zipfile(fpath):
+        return False
+    with zipfile.ZipFile(fpath) as zf:
+        return any(name.endswith('/constants.pkl') for name in zf.namelist())
+
+
+def copy_model(model):
+    """
+    经torch.save/torch.load在内存中复制一份cpu上的模型。
+    带weight norm的新建模型不支持copy.deepcopy，导出前用它复制，不改动传入的模型。
+    """
+    buffer = io.BytesIO()
+    torch.save(model, buffer)
+    buffer.seek(0)
+    return torch.load(buffer, map_location='cpu')
@@ -5,12 +5,11 @@ from vocoder.models.fatchord_version import WaveRNN
 def gen_testset(model: WaveRNN, test_set, samples, batched, target, overlap, save_path):
     k = model.get_step() // 1000
 
+    mels, save_strs = [], []
     for i, (m, x) in enumerate(test_set, 1):
         if i > samples:
             break
 
-        print('\n| Generating: %i/%i' % (i, samples))
-
         x = x[0].numpy()
 
         bits = 16 if hp.voc_mode == 'MOL' else hp.bits
@@ -24,7 +23,17 @@ def gen_testset(model: WaveRNN, test_set, samples, batched, target, overlap, sav
 
         batch_str = "gen_batched_target%d_overlap%d" % (target, overlap) if batched else \
             "gen_not_batched"
-        save_str = save_path.joinpath("%dk_steps_%d_%s.wav" % (k, i, batch_str))
-
-        wav = model.generate(m, batched, target, overlap, hp.mu_law)
-        save_wav(wav, save_str)
+        save_strs.append(save_path.joinpath("%dk_steps_%d_%s.wav" % (k, i, batch_str)))
+        mels.append(m)
+
+    if batched:
+        # All test samples are generated in one batch
+        print('\n| Generating: %i samples' % len(mels))
+        wavs = model.generate_many(mels, target, overlap, hp.mu_law)
+        for wav, save_str in zip(wavs, save_strs):
+            save_wav(wav, save_str)
+    else:
+        for i, (m, save_str) in enumerate(zip(mels, save_strs), 1):
+            print('\n| Generating: %i/%i' % (i, len(mels)))
+            wav = model.generate(m, batched, target, overlap, hp.mu_law)
+            save_wav(wav, save_str)
@@ -1,16 +1,31 @@
 import torch
 
 from vocoder import hparams as hp
-from vocoder.models.fatchord_version import WaveRNN
+from vocoder.models.fatchord_version import WaveRNN, quantize_model
 
 _model = None  # type: WaveRNN
 # _device = torch.device('cpu')  # None # type: torch.device
 _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
-def load_model(weights_fpath, verbose=True):
+def load_model(weights_fpath, verbose=True, quantize=False):
+    """
+    :param quantize: load the model with int8 dynamic quantization for CPU inference. Checkpoints
+    saved by save_quantized_model are always loaded quantized.
+    """
     global _model, _device
 
+    if verbose:
+        print("Loading model weights at %s" % weights_fpath)
+    # Quantized checkpoints hold CPU-only int8 packed params, so load to cpu and move the model afterwards
+    checkpoint = torch.load(weights_fpath, map_location='cpu')
+    quantized = bool(checkpoint.get('quantized'))
+    if quantized or quantize:
+        # The int8 kernels only run on CPU
+        _device = torch.device('cpu')
+    else:
+        _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
     if verbose:
         print("Building Wave-RNN")
     _model = WaveRNN(
@@ -26,13 +41,25 @@ def load_model(weights_fpath, verbose=True):
         hop_length=hp.hop_length,
         sample_rate=hp.sample_rate,
         mode=hp.voc_mode
-    ).to(_device)
+    )
 
-    if verbose:
-        print("Loading model weights at %s" % weights_fpath)
-    checkpoint = torch.load(weights_fpath, map_location=_device.type)
-    _model.load_state_dict(checkpoint['model_state'])
-    _model.eval()
+    if quantized:
+        quantize_model(_model)
+        _model.load_state_dict(checkpoint['model_state'])
+    else:
+        _model.load_state_dict(checkpoint['model_state'])
+        if quantize:
+            quantize_model(_model)
+    _model.to(_device).eval()
+
+
+def save_quantized_model(weights_fpath):
+    """
+    Saves the loaded quantized model, load_model loads it directly without quantizing again.
+    """
+    if _model is None or isinstance(_model.I, torch.nn.Linear):
+        raise Exception("Please load Wave-RNN with quantize=True before saving it")
+    torch.save({'model_state': _model.state_dict(), 'quantized': True}, weights_fpath)
 
 
 def is_loaded():
@@ -59,3 +86,100 @@ def infer_waveform(mel, normalize=True, batched=True, target=8000, overlap=800,
     mel = torch.from_numpy(mel[None, ...])
     wav = _model.generate(mel, batched, target, overlap, hp.mu_law, progress_callback)
     return wav
+
+
+def infer_waveform_stream(mel, normalize=True, target=8000, overlap=800, fold_batch_size=1,
+                          progress_callback=None):
+    """
+    Generator version of infer_waveform (batched mode only). Yields pieces of the waveform as
+    soon as they are final, concatenating them gives the whole waveform.
+
+    :param fold_batch_size: number of folds generated together, larger is faster overall but
+    the first piece comes later
+    :param target: a smaller target lowers the latency of the first piece
+    """
+    if _model is None:
+        raise Exception("Please load Wave-RNN in memory before using it")
+
+    if normalize:
+        mel = mel / hp.mel_max_abs_value
+    mel = torch.from_numpy(mel[None, ...])
+    for wav in _model.generate_stream(mel, target, overlap, hp.mu_law, fold_batch_size, progress_callback):
+        yield wav
+
+
+def infer_waveforms(mels, normalize=True, target=8000, overlap=800, progress_callback=None, max_folds=None):
+    """
+    Infers the waveforms of several mel spectrograms together (batched mode only). The folds of
+    all mels are generated in one batch, which is much faster than calling infer_waveform on
+    each of them.
+
+    :param mels: list of mel spectrograms, lengths may differ
+    :param max_folds: generate at most this many folds at a time to bound the memory
+    :return: list of waveforms
+    """
+    if _model is None:
+        raise Exception("Please load Wave-RNN in memory before using it")
+
+    if normalize:
+        mels = [mel / hp.mel_max_abs_value for mel in mels]
+    mels = [torch.from_numpy(mel[None, ...]) for mel in mels]
+    wavs = _model.generate_many(mels, target, overlap, hp.mu_law, progress_callback, max_folds)
+    return wavs
+
+
+if __name__ == "__main__":
+    # Spectral distance and speed of the int8 model against fp32
+    # python -m vocoder.inference [weights.pt [mel.npy ...]]
+    import sys
+    import tempfile
+    import time
+
+    import numpy as np
+
+    from vocoder.audio import melspectrogram
+
+    if len(sys.argv) > 1:
+        weights_fpath = sys.argv[1]
+    else:
+        weights_fpath = tempfile.mktemp(suffix='.pt')
+        torch.save({'model_state': WaveRNN(
+            rnn_dims=hp.voc_rnn_dims, fc_dims=hp.voc_fc_dims, bits=hp.bits, pad=hp.voc_pad,
+            upsample_factors=hp.voc_upsample_factors, feat_dims=hp.num_mels, compute_dims=hp.voc_compute_dims,
+            res_out_dims=hp.voc_res_out_dims, res_blocks=hp.voc_res_blocks, hop_length=hp.hop_length,
+            sample_rate=hp.sample_rate, mode=hp.voc_mode).state_dict()}, weights_fpath)
+    if len(sys.argv) > 2:
+        mels = [np.load(w) for w in sys.argv[2:]]
+    else:
+        rng = np.random.RandomState(0)
+        mels = [np.clip(np.cumsum(rng.randn(hp.num_mels, 80), axis=1) * 0.3, -4, 4).astype(np.float32)
+                for _ in range(2)]
+    quiet = lambda *args: None
+
+    def log_mel(wav):
+        return np.log(np.maximum(melspectrogram(wav.astype(np.float32)), 1e-5))
+
+    def run(func):
+        start = time.time()
+        wavs = [func(torch.from_numpy(mel[None] / hp.mel_max_abs_value)) for mel in mels]
+        return wavs, (time.time() - start) / (sum(len(w) for w in wavs) / hp.sample_rate)
+
+    _device = torch.device('cpu')
+    load_model(weights_fpath, verbose=False)
+    runs = {
+        'fp32 generate': run(lambda m: _model.generate(m, True, hp.voc_target, hp.voc_overlap, hp.mu_law, quiet)),
+        'fp32 generate again': run(lambda m: _model.generate(m, True, hp.voc_target, hp.voc_overlap, hp.mu_law, quiet)),
+        'fp32 generate_fast': run(
+            lambda m: _model.generate_fast(m, True, hp.voc_target, hp.voc_overlap, hp.mu_law, quiet)),
+    }
+    load_model(weights_fpath, verbose=False, quantize=True)
+    quantized_fpath = tempfile.mktemp(suffix='.pt')
+    save_quantized_model(quantized_fpath)
+    load_model(quantized_fpath, verbose=False)
+    runs['int8 generate'] = run(lambda m: _model.generate(m, True, hp.voc_target, hp.voc_overlap, hp.mu_law, quiet))
+
+    # Sampling is random, the distance between two fp32 runs is the reference
+    ref_wavs, ref_rtf = runs['fp32 generate']
+    for name, (wavs, rtf) in runs.items():
+        dist = np.mean([np.mean(np.abs(log_mel(a) - log_mel(b))) for a, b in zip(ref_wavs, wavs)])
+        print('{}: RTF {:.3f} ({:.2f}x), log-mel L1 to fp32 {:.4f}'.format(name, rtf, ref_rtf / rtf, dist))
@@ -221,14 +221,164 @@ class WaveRNN(nn.Module):
                     progress_callback(i, seq_len, b_size, gen_rate)
 
         output = torch.stack(output).transpose(0, 1)
-        output = output.cpu().numpy()
-        output = output.astype(np.float64)
+        output = self.finish_output(output, batched, target, overlap, mu_law, wave_len)
+
+        self.train()
+
+        return output
+
+    def generate_fast(self, mels, batched, target, overlap, mu_law, progress_callback=None):
+        ''' Same as generate() but the autoregressive loop runs in infer_folds(),
+            which avoids the per-sample allocations of generate().
+        '''
+        mu_law = mu_law if self.mode == 'RAW' else False
+        progress_callback = progress_callback or self.gen_display
+
+        self.eval()
+        with torch.no_grad():
+            mels = mels.to(self.device)
+            wave_len = (mels.size(-1) - 1) * self.hop_length
+            mels = self.pad_tensor(mels.transpose(1, 2), pad=self.pad, side='both')
+            mels, aux = self.upsample(mels.transpose(1, 2))
+
+            if batched:
+                mels = self.fold_with_overlap(mels, target, overlap)
+                aux = self.fold_with_overlap(aux, target, overlap)
 
+            output = self.infer_folds(mels, aux, progress_callback).transpose(0, 1)
+
+        output = self.finish_output(output, batched, target, overlap, mu_law, wave_len)
+        self.train()
+        return output
+
+    def generate_many(self, mels, target, overlap, mu_law, progress_callback=None, max_folds=None):
+        ''' Batched generation of several utterances in one autoregressive loop.
+
+            Every utterance is upsampled and folded on its own, the folds of all
+            utterances are stacked along the batch dimension and generated
+            together by infer_folds(), then split and unfolded per utterance.
+
+        Args:
+            mels (list)     : Mels of shape=(1, feat_dims, frames), any lengths
+            max_folds (int) : Generate at most this many folds at a time
+
+        Return:
+            (list) : audio samples of each utterance, dtype=np.float64
+        '''
+        mu_law = mu_law if self.mode == 'RAW' else False
+        progress_callback = progress_callback or self.gen_display
+
+        self.eval()
+        wave_lens, folded_mels, folded_aux = [], [], []
+        with torch.no_grad():
+            for mel in mels:
+                mel = mel.to(self.device)
+                wave_lens.append((mel.size(-1) - 1) * self.hop_length)
+                mel = self.pad_tensor(mel.transpose(1, 2), pad=self.pad, side='both')
+                mel, aux = self.upsample(mel.transpose(1, 2))
+                folded_mels.append(self.fold_with_overlap(mel, target, overlap))
+                folded_aux.append(self.fold_with_overlap(aux, target, overlap))
+
+            num_folds = [m.size(0) for m in folded_mels]
+            folded_mels = torch.cat(folded_mels)
+            folded_aux = torch.cat(folded_aux)
+            max_folds = max_folds or folded_mels.size(0)
+            output = torch.cat([self.infer_folds(folded_mels[k:k + max_folds], folded_aux[k:k + max_folds],
+                                                 progress_callback).transpose(0, 1)
+                                for k in range(0, folded_mels.size(0), max_folds)])
+
+        wavs = [self.finish_output(y, True, target, overlap, mu_law, wave_len)
+                for y, wave_len in zip(output.split(num_folds), wave_lens)]
+        self.train()
+        return wavs
+
+    def generate_stream(self, mels, target, overlap, mu_law, fold_batch_size=1, progress_callback=None):
+        ''' Batched generation that yields audio while it is being generated.
+
+            The folds are generated in order, fold_batch_size folds at a time.
+            After each group the samples before the start of the next fold are
+            final, so they are crossfaded, decoded, de-emphasized and faded out
+            right away and yielded. Concatenating the chunks gives the same
+            waveform as generate_fast(mels, True, target, overlap, mu_law).
+
+            The first chunk is available after target + 2 * overlap steps, so a
+            smaller target gives a lower latency.
+
+        Yield:
+            (ndarry) : audio samples in a 1d array, dtype=np.float64
+        '''
+        mu_law = mu_law if self.mode == 'RAW' else False
+
+        self.eval()
+        # try/finally so a consumer that stops early (closes the generator) still restores train mode
+        try:
+            with torch.no_grad():
+                mels = mels.to(self.device)
+                wave_len = (mels.size(-1) - 1) * self.hop_length
+                mels = self.pad_tensor(mels.transpose(1, 2), pad=self.pad, side='both')
+                mels, aux = self.upsample(mels.transpose(1, 2))
+                mels = self.fold_with_overlap(mels, target, overlap)
+                aux = self.fold_with_overlap(aux, target, overlap)
+
+            num_folds = mels.size(0)
+            fade_in, fade_out = self.xfade_envelopes(overlap)
+            end_fade_len = 20 * self.hop_length
+            end_fade = np.linspace(1, 0, end_fade_len)
+            # The de-emphasis filter state is carried from chunk to chunk
+            zi = np.zeros(1)
+            tail = np.zeros(overlap, dtype=np.float64)
+            pos = 0
+
+            for k in range(0, num_folds, fold_batch_size):
+                with torch.no_grad():
+                    y = self.infer_folds(mels[k:k + fold_batch_size], aux[k:k + fold_batch_size], progress_callback)
+                y = y.transpose(0, 1).cpu().numpy().astype(np.float64)
+                y[:, :overlap] *= fade_in
+                y[:, -overlap:] *= fade_out
+
+                chunks = []
+                for row in y:
+                    row[:overlap] += tail
+                    chunks.append(row[:-overlap])
+                    tail = row[-overlap:]
+                if k + fold_batch_size >= num_folds:
+                    chunks.append(tail)
+                output = np.concatenate(chunks)[:max(wave_len - pos, 0)]
+
+                if mu_law:
+                    output = decode_mu_law(output, self.n_classes, False)
+                if hp.apply_preemphasis:
+                    output, zi = lfilter([1], [1, -hp.preemphasis], output, zi=zi)
+
+                # Fade-out at the end to avoid signal cutting out suddenly
+                fade_start = wave_len - end_fade_len
+                a, b = max(pos, fade_start), pos + len(output)
+                if a < b:
+                    output[a - pos:] *= end_fade[a - fade_start:b - fade_start]
+
+                pos += len(output)
+                yield output
+        finally:
+            self.train()
+
+    def finish_output(self, output, batched, target, overlap, mu_law, wave_len):
+        ''' Unfold (on the device of output), decode and fade out the generated samples.
+
+        Args:
+            output (tensor) : Generated samples, shape=(num_folds, timesteps)
+            wave_len (int)  : Length of the waveform to return
+
+        Return:
+            (ndarry) : audio samples in a 1d array, dtype=np.float64
+        '''
         if batched:
             output = self.xfade_and_unfold(output, target, overlap)
         else:
             output = output[0]
 
+        output = output.cpu().numpy()
+        output = output.astype(np.float64)
+
         if mu_law:
             output = decode_mu_law(output, self.n_classes, False)
         if hp.apply_preemphasis:
@@ -238,8 +388,197 @@ class WaveRNN(nn.Module):
         fade_out = np.linspace(1, 0, 20 * self.hop_length)
         output = output[:wave_len]
         output[-20 * self.hop_length:] *= fade_out
+        return output
 
-        self.train()
+    def split_weights(self):
+        ''' Split the input weights of I, rnn2, fc1 and fc2 into the parts that
+            multiply the previous sample / hidden state and the parts that only
+            multiply the conditioning features, so that torch.cat is not needed
+            and the conditioning can be projected for many timesteps at once.
+            Matrices are returned as transposed views for addmm, which keeps
+            the (out_features, in_features) layout that is faster for small batches.
+        '''
+        feat_dims = self.I.in_features - self.aux_dims - 1
+        r = self.rnn_dims
+        w_i = self.I.weight
+        w_2 = self.rnn2.weight_ih_l0
+        return {
+            'I_x': w_i[:, 0].contiguous(),
+            'I_m': w_i[:, 1:1 + feat_dims].contiguous().t(),
+            'I_a': w_i[:, 1 + feat_dims:].contiguous().t(),
+            'I_b': self.I.bias,
+            'rnn1_ih': self.rnn1.weight_ih_l0.contiguous().t(),
+            'rnn1_ix': torch.mv(self.rnn1.weight_ih_l0, w_i[:, 0]),
+            'rnn1_hh': self.rnn1.weight_hh_l0.contiguous().t(),
+            'rnn1_bih': self.rnn1.bias_ih_l0,
+            'rnn1_bhh': self.rnn1.bias_hh_l0,
+            'rnn2_ih': w_2[:, :r].contiguous().t(),
+            'rnn2_ia': w_2[:, r:].contiguous().t(),
+            'rnn2_hh': self.rnn2.weight_hh_l0.contiguous().t(),
+            'rnn2_bih': self.rnn2.bias_ih_l0,
+            'rnn2_bhh': self.rnn2.bias_hh_l0,
+            'fc1_x': self.fc1.weight[:, :r].contiguous().t(),
+            'fc1_a': self.fc1.weight[:, r:].contiguous().t(),
+            'fc1_b': self.fc1.bias,
+            'fc2_x': self.fc2.weight[:, :self.fc2.in_features - self.aux_dims].contiguous().t(),
+            'fc2_a': self.fc2.weight[:, self.fc2.in_features - self.aux_dims:].contiguous().t(),
+            'fc2_b': self.fc2.bias,
+            'fc3_x': self.fc3.weight.contiguous().t(),
+            'fc3_b': self.fc3.bias,
+        }
+
+    def infer_folds(self, mels, aux, progress_callback=None, chunk_size=256):
+        ''' Autoregressive loop of generate() without per-sample allocations.
+
+            Every intermediate buffer is allocated once. The conditioning parts of
+            I, rnn2, fc1 and fc2 are projected for chunk_size timesteps at a time,
+            the GRU cells are computed in place and RAW samples are drawn by
+            inverse-CDF sampling on pre-drawn uniforms. Since I is linear, the
+            input projection of rnn1 is also projected per chunk and only the
+            rank-one term of the previous sample is added at each step.
+
+        Args:
+            mels (tensor) : Upsampled mels, shape=(num_folds, timesteps, feat_dims)
+            aux (tensor)  : Aux features, shape=(num_folds, timesteps, res_out_dims)
+
+        Return:
+            (tensor) : samples in [-1, 1], shape=(timesteps, num_folds)
+        '''
+        if not isinstance(self.I, nn.Linear):
+            return self.infer_folds_modules(mels, aux, progress_callback)
+
+        b_size, seq_len, _ = mels.size()
+        device, dtype = mels.device, mels.dtype
+        d, r = self.aux_dims, self.rnn_dims
+        fc_dims = self.fc1.out_features
+        w = self.split_weights()
+        start = time.time()
+
+        def empty(*size):
+            return torch.empty(*size, device=device, dtype=dtype)
+
+        x = torch.zeros(b_size, 1, device=device, dtype=dtype)
+        h1 = torch.zeros(b_size, r, device=device, dtype=dtype)
+        h2 = torch.zeros(b_size, r, device=device, dtype=dtype)
+        x_in, res, n_gate = empty(b_size, r), empty(b_size, r), empty(b_size, r)
+        gi, gh, rz = empty(b_size, 3 * r), empty(b_size, 3 * r), empty(b_size, 2 * r)
+        f1, f2 = empty(b_size, fc_dims), empty(b_size, fc_dims)
+        logits, cdf = empty(b_size, self.n_classes), empty(b_size, self.n_classes)
+        top, thresh = empty(b_size, 1), empty(b_size, 1)
+        index = torch.empty(b_size, 1, device=device, dtype=torch.long)
+        output = empty(seq_len, b_size)
+
+        chunk_size = min(chunk_size, seq_len)
+        cond_i, cond_1 = empty(chunk_size, b_size, r), empty(chunk_size, b_size, 3 * r)
+        cond_2 = empty(chunk_size, b_size, 3 * r)
+        cond_f1, cond_f2 = empty(chunk_size, b_size, fc_dims), empty(chunk_size, b_size, fc_dims)
+        uniform = empty(chunk_size, b_size, 1)
+
+        def gru_step(h, w_hh, b_hh):
+            # gi holds the input projection, gate order is r, z, n as in nn.GRU
+            torch.addmm(b_hh, h, w_hh, out=gh)
+            torch.add(gi[:, :2 * r], gh[:, :2 * r], out=rz).sigmoid_()
+            torch.mul(rz[:, :r], gh[:, 2 * r:], out=n_gate).add_(gi[:, 2 * r:]).tanh_()
+            h.sub_(n_gate).mul_(rz[:, r:]).add_(n_gate)
+
+        for c_start in range(0, seq_len, chunk_size):
+            c_len = min(chunk_size, seq_len - c_start)
+            m_c = mels[:, c_start:c_start + c_len].transpose(0, 1)
+            a_c = aux[:, c_start:c_start + c_len].transpose(0, 1)
+            torch.matmul(m_c, w['I_m'], out=cond_i[:c_len])
+            cond_i[:c_len].add_(torch.matmul(a_c[..., :d], w['I_a'])).add_(w['I_b'])
+            torch.matmul(cond_i[:c_len], w['rnn1_ih'], out=cond_1[:c_len])
+            cond_1[:c_len].add_(w['rnn1_bih'])
+            torch.matmul(a_c[..., d:2 * d], w['rnn2_ia'], out=cond_2[:c_len])
+            cond_2[:c_len].add_(w['rnn2_bih'])
+            torch.matmul(a_c[..., 2 * d:3 * d], w['fc1_a'], out=cond_f1[:c_len])
+            cond_f1[:c_len].add_(w['fc1_b'])
+            torch.matmul(a_c[..., 3 * d:4 * d], w['fc2_a'], out=cond_f2[:c_len])
+            cond_f2[:c_len].add_(w['fc2_b'])
+            if self.mode == 'RAW':
+                uniform.uniform_()
+
+            for j in range(c_len):
+                i = c_start + j
+
+                torch.addcmul(cond_i[j], x, w['I_x'], out=x_in)
+                torch.addcmul(cond_1[j], x, w['rnn1_ix'], out=gi)
+                gru_step(h1, w['rnn1_hh'], w['rnn1_bhh'])
+
+                torch.add(x_in, h1, out=res)
+                torch.addmm(cond_2[j], res, w['rnn2_ih'], out=gi)
+                gru_step(h2, w['rnn2_hh'], w['rnn2_bhh'])
+
+                res.add_(h2)
+                torch.addmm(cond_f1[j], res, w['fc1_x'], out=f1).relu_()
+                torch.addmm(cond_f2[j], f1, w['fc2_x'], out=f2).relu_()
+                torch.addmm(w['fc3_b'], f2, w['fc3_x'], out=logits)
+
+                if self.mode == 'MOL':
+                    sample = sample_from_discretized_mix_logistic(logits.unsqueeze(0).transpose(1, 2))
+                    x.copy_(sample.view(-1, 1))
+                elif self.mode == 'RAW':
+                    # Inverse-CDF sampling of softmax(logits), the cdf is left unnormalized
+                    torch.amax(logits, dim=1, keepdim=True, out=top)
+                    logits.sub_(top).exp_()
+                    torch.cumsum(logits, dim=1, out=cdf)
+                    torch.mul(uniform[j], cdf[:, -1:], out=thresh)
+                    torch.searchsorted(cdf, thresh, right=True, out=index)
+                    index.clamp_(max=self.n_classes - 1)
+                    x.copy_(index).mul_(2).div_(self.n_classes - 1.).sub_(1.)
+                else:
+                    raise RuntimeError("Unknown model mode value - ", self.mode)
+                output[i].copy_(x.view(-1))
+
+                if progress_callback is not None and i % 100 == 0:
+                    gen_rate = (i + 1) / (time.time() - start) * b_size / 1000
+                    progress_callback(i, seq_len, b_size, gen_rate)
+
+        return output
+
+    def infer_folds_modules(self, mels, aux, progress_callback=None):
+        ''' Same as infer_folds() but calling the layers as modules, like generate().
+            Used when the layers have been replaced by quantized ones, whose weights
+            cannot be split.
+        '''
+        b_size, seq_len, _ = mels.size()
+        rnn1 = self.get_gru_cell(self.rnn1)
+        rnn2 = self.get_gru_cell(self.rnn2)
+        start = time.time()
+
+        h1 = torch.zeros(b_size, self.rnn_dims, device=mels.device, dtype=mels.dtype)
+        h2 = torch.zeros(b_size, self.rnn_dims, device=mels.device, dtype=mels.dtype)
+        x = torch.zeros(b_size, 1, device=mels.device, dtype=mels.dtype)
+        output = torch.empty(seq_len, b_size, device=mels.device, dtype=mels.dtype)
+
+        d = self.aux_dims
+        aux_split = [aux[:, :, d * i:d * (i + 1)] for i in range(4)]
+
+        for i in range(seq_len):
+            a1_t, a2_t, a3_t, a4_t = (a[:, i, :] for a in aux_split)
+
+            x = self.I(torch.cat([x, mels[:, i, :], a1_t], dim=1))
+            h1 = rnn1(x, h1)
+            x = x + h1
+            h2 = rnn2(torch.cat([x, a2_t], dim=1), h2)
+            x = x + h2
+            x = F.relu(self.fc1(torch.cat([x, a3_t], dim=1)))
+            x = F.relu(self.fc2(torch.cat([x, a4_t], dim=1)))
+            logits = self.fc3(x)
+
+            if self.mode == 'MOL':
+                sample = sample_from_discretized_mix_logistic(logits.unsqueeze(0).transpose(1, 2)).view(-1)
+            elif self.mode == 'RAW':
+                sample = torch.multinomial(F.softmax(logits, dim=1), 1).view(-1)
+                sample = 2 * sample.float() / (self.n_classes - 1.) - 1.
+            else:
+                raise RuntimeError("Unknown model mode value - ", self.mode)
+            output[i] = sample
+            x = sample.unsqueeze(-1)
+
+            if progress_callback is not None and i % 100 == 0:
+                gen_rate = (i + 1) / (time.time() - start) * b_size / 1000
+                progress_callback(i, seq_len, b_size, gen_rate)
 
         return output
 
@@ -249,6 +588,9 @@ class WaveRNN(nn.Module):
         stream(msg)
 
     def get_gru_cell(self, gru):
+        if not hasattr(gru, 'weight_hh_l0'):
+            # Already a cell, e.g. after quantize_model()
+            return gru
         gru_cell = nn.GRUCell(gru.input_size, gru.hidden_size)
         gru_cell.weight_hh.data = gru.weight_hh_l0.data
         gru_cell.weight_ih.data = gru.weight_ih_l0.data
@@ -281,6 +623,7 @@ class WaveRNN(nn.Module):
 
         Return:
             (tensor) : shape=(num_folds, target + 2 * overlap, features)
+                       a strided view of x (padded if needed)
 
         Details:
             x = [[h1, h2, ... hn]]
@@ -305,16 +648,10 @@ class WaveRNN(nn.Module):
         if remaining != 0:
             num_folds += 1
             padding = target + 2 * overlap - remaining
-            x = self.pad_tensor(x, padding, side='after')
-
-        folded = torch.zeros(num_folds, target + 2 * overlap, features).to(self.device)
-
-        # Get the values for the folded tensor
-        for i in range(num_folds):
-            start = i * (target + overlap)
-            end = start + target + 2 * overlap
-            folded[i] = x[:, start:end, :]
+            x = F.pad(x, (0, 0, 0, padding))
 
+        # Strided view of the folds, no copy is made
+        folded = x[0].unfold(0, target + 2 * overlap, target + overlap).transpose(1, 2)
         return folded
 
     def xfade_and_unfold(self, y, target, overlap):
@@ -322,15 +659,15 @@ class WaveRNN(nn.Module):
         ''' Applies a crossfade and unfolds into a 1d array.
 
         Args:
-            y (ndarry)    : Batched sequences of audio samples
+            y (tensor)    : Batched sequences of audio samples
                             shape=(num_folds, target + 2 * overlap)
-                            dtype=np.float64
+                            the gain is applied in place, an ndarray
+                            gives an ndarray back
             overlap (int) : Timesteps for both xfade and rnn warmup
 
         Return:
-            (ndarry) : audio samples in a 1d array
+            (tensor) : audio samples in a 1d array, same dtype and device as y
                        shape=(total_len)
-                       dtype=np.float64
 
         Details:
             y = [[seq1],
@@ -349,10 +686,32 @@ class WaveRNN(nn.Module):
 
         '''
 
+        if isinstance(y, np.ndarray):
+            return self.xfade_and_unfold(torch.from_numpy(y), target, overlap).numpy()
+
         num_folds, length = y.shape
         target = length - 2 * overlap
-        total_len = num_folds * (target + overlap) + overlap
 
+        fade_in, fade_out = (torch.from_numpy(w).to(y) for w in self.xfade_envelopes(overlap))
+
+        # Apply the gain to the overlap samples
+        y[:, :overlap] *= fade_in
+        y[:, -overlap:] *= fade_out
+
+        # The first target + overlap samples of the folds tile the output without
+        # overlapping, only the last overlap samples of each fold are added to the
+        # beginning of the next one
+        unfolded = y.new_empty(num_folds * (target + overlap) + overlap)
+        body = unfolded[:-overlap].view(num_folds, target + overlap)
+        body.copy_(y[:, :-overlap])
+        body[1:, :overlap] += y[:-1, -overlap:]
+        unfolded[-overlap:] = y[-1, -overlap:]
+        return unfolded
+
+    def xfade_envelopes(self, overlap):
+        ''' Equal power crossfade gains for the overlap samples of each fold,
+            shape=(overlap,), dtype=np.float64.
+        '''
         # Need some silence for the rnn warmup
         silence_len = overlap // 2
         fade_len = overlap - silence_len
@@ -366,20 +725,7 @@ class WaveRNN(nn.Module):
         # Concat the silence to the fades
         fade_in = np.concatenate([silence, fade_in])
         fade_out = np.concatenate([fade_out, silence])
-
-        # Apply the gain to the overlap samples
-        y[:, :overlap] *= fade_in
-        y[:, -overlap:] *= fade_out
-
-        unfolded = np.zeros((total_len), dtype=np.float64)
-
-        # Loop to add up all the samples
-        for i in range(num_folds):
-            start = i * (target + overlap)
-            end = start + target + 2 * overlap
-            unfolded[start:end] += y[i]
-
-        return unfolded
+        return fade_in, fade_out
 
     def get_step(self):
         return self.step.data.item()
@@ -412,3 +758,74 @@ class WaveRNN(nn.Module):
         parameters = sum([np.prod(p.size()) for p in parameters]) / 1_000_000
         if print_out:
             print('Trainable Parameters: %.3fM' % parameters)
+
+
+def quantize_model(model: WaveRNN):
+    ''' Dynamic int8 quantization of the GRU cells and linear layers for CPU
+        inference, in place. The GRUs are replaced by GRUCells first, so the
+        model can only be used for generation afterwards.
+    '''
+    model.cpu()
+    model.device = torch.device('cpu')
+    model.rnn1 = model.get_gru_cell(model.rnn1)
+    model.rnn2 = model.get_gru_cell(model.rnn2)
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {nn.GRUCell, nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+if __name__ == "__main__":
+    # python -m vocoder.models.fatchord_version
+    model = WaveRNN(rnn_dims=hp.voc_rnn_dims, fc_dims=hp.voc_fc_dims, bits=hp.bits, pad=hp.voc_pad,
+                    upsample_factors=hp.voc_upsample_factors, feat_dims=hp.num_mels,
+                    compute_dims=hp.voc_compute_dims, res_out_dims=hp.voc_res_out_dims,
+                    res_blocks=hp.voc_res_blocks, hop_length=hp.hop_length, sample_rate=hp.sample_rate,
+                    mode=hp.voc_mode)
+    target, overlap = hp.voc_target, hp.voc_overlap
+
+    # Folding and unfolding against the former per-fold loops, 10 s to 10 min of audio
+    def fold_loop(x):
+        num_folds = -(-(x.size(1) - overlap) // (target + overlap))
+        x = model.pad_tensor(x, num_folds * (target + overlap) + overlap - x.size(1), side='after')
+        folded = torch.zeros(num_folds, target + 2 * overlap, x.size(2)).to(x.device)
+        for i in range(num_folds):
+            folded[i] = x[:, i * (target + overlap):i * (target + overlap) + target + 2 * overlap, :]
+        return folded
+
+    def unfold_loop(y):
+        fade_in, fade_out = model.xfade_envelopes(overlap)
+        y[:, :overlap] *= fade_in
+        y[:, -overlap:] *= fade_out
+        unfolded = np.zeros(y.shape[0] * (target + overlap) + overlap, dtype=np.float64)
+        for i in range(y.shape[0]):
+            unfolded[i * (target + overlap):i * (target + overlap) + target + 2 * overlap] += y[i]
+        return unfolded
+
+    for seconds in [10, 60, 600]:
+        x = torch.rand(1, seconds * hp.sample_rate, 8, device=model.device)
+        start = time.time()
+        ref = fold_loop(x)
+        t_loop = time.time() - start
+        start = time.time()
+        out = model.fold_with_overlap(x, target, overlap)
+        t_fold = time.time() - start
+        assert torch.equal(ref, out)
+
+        y = np.random.uniform(-1, 1, (out.size(0), target + 2 * overlap))
+        start = time.time()
+        ref = unfold_loop(y.copy())
+        t_unfold_loop = time.time() - start
+        y = torch.from_numpy(y).float().to(model.device)
+        start = time.time()
+        out = model.xfade_and_unfold(y, target, overlap).cpu().numpy()
+        t_unfold = time.time() - start
+        print("{:4d}s {:4d} folds: fold {:.4f}s -> {:.4f}s, xfade_and_unfold {:.4f}s -> {:.4f}s, max diff {:.1e}".format(
+            seconds, y.size(0), t_loop, t_fold, t_unfold_loop, t_unfold, np.abs(ref - out).max()))
+
+    # Real-time factor of generate() and generate_fast() with random weights
+    mels = torch.rand(1, hp.num_mels, 2 * hp.sample_rate // hp.hop_length)
+    for batched in [False, True]:
+        for name, func in [("generate", model.generate), ("generate_fast", model.generate_fast)]:
+            start = time.time()
+            wav = func(mels, batched, target, overlap, hp.mu_law, lambda *args: None)
+            rtf = (time.time() - start) / (len(wav) / hp.sample_rate)
+            print("batched={} {}: {:.2f}s audio, RTF {:.3f}".format(batched, name, len(wav) / hp.sample_rate, rtf))
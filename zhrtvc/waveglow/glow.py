@@ -26,9 +26,6 @@
 # *****************************************************************************
 import torch
 import torch.nn.functional as F
-from torch.autograd import Variable
-
-_device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 
 @torch.jit.script
@@ -81,6 +78,17 @@ class Invertible1x1Conv(torch.nn.Module):
         W = W.view(c, c, 1)
         self.conv.weight.data = W
 
+    def compile_inverse(self):
+        """
+        Compute the inverse of the weight once and register it as a buffer,
+        so it follows .to(device/dtype) and is saved with the model.
+        """
+        W = self.conv.weight.detach().squeeze()
+        if 'W_inverse' in self.__dict__:
+            # stashed as a plain attribute by older versions of forward()
+            del self.__dict__['W_inverse']
+        self.register_buffer('W_inverse', W.float().inverse()[..., None].to(W.dtype))
+
     def forward(self, z, reverse=False):
         # shape
         batch_size, group_size, n_of_groups = z.size()
@@ -88,14 +96,12 @@ class Invertible1x1Conv(torch.nn.Module):
         W = self.conv.weight.squeeze()
 
         if reverse:
-            if not hasattr(self, 'W_inverse'):
-                # Reverse computation
-                W_inverse = W.float().inverse()
-                W_inverse = Variable(W_inverse[..., None])
-                if z.type() == 'torch.cuda.HalfTensor':
-                    W_inverse = W_inverse.half()
-                self.W_inverse = W_inverse
-            z = F.conv1d(z, self.W_inverse, bias=None, stride=1, padding=0)
+            if hasattr(self, 'W_inverse'):
+                W_inverse = self.W_inverse
+            else:
+                # Reverse computation, W may still be training so nothing is cached
+                W_inverse = W.float().inverse()[..., None]
+            z = F.conv1d(z, W_inverse.to(z.dtype), bias=None, stride=1, padding=0)
             return z
         else:
             # Forward computation
@@ -259,16 +265,8 @@ class WaveGlow(torch.nn.Module):
         spect = spect.unfold(2, self.n_group, self.n_group).permute(0, 2, 1, 3)
         spect = spect.contiguous().view(spect.size(0), spect.size(1), -1).permute(0, 2, 1)
 
-        if spect.type() in {'torch.cuda.HalfTensor', 'torch.HalfTensor'}:
-            audio = torch.HalfTensor(spect.size(0),
-                                     self.n_remaining_channels,
-                                     spect.size(2)).normal_().to(_device)
-        else:
-            audio = torch.FloatTensor(spect.size(0),
-                                      self.n_remaining_channels,
-                                      spect.size(2)).normal_().to(_device)
-
-        audio = torch.autograd.Variable(sigma * audio)
+        audio = sigma * torch.randn(spect.size(0), self.n_remaining_channels, spect.size(2),
+                                    dtype=spect.dtype, device=spect.device)
 
         for k in reversed(range(self.n_flows)):
             n_half = int(audio.size(1) / 2)
@@ -285,10 +283,7 @@ class WaveGlow(torch.nn.Module):
             audio = self.convinv[k](audio, reverse=True)
 
             if k % self.n_early_every == 0 and k > 0:
-                if spect.type() in {'torch.cuda.HalfTensor', 'torch.HalfTensor'}:
-                    z = torch.HalfTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_().to(_device)
-                else:
-                    z = torch.FloatTensor(spect.size(0), self.n_early_size, spect.size(2)).normal_().to(_device)
+                z = torch.randn(spect.size(0), self.n_early_size, spect.size(2), dtype=spect.dtype, device=spect.device)
                 audio = torch.cat((sigma * z, audio), 1)
 
         audio = audio.permute(0, 2, 1).contiguous().view(audio.size(0), -1).data
@@ -304,6 +299,139 @@ class WaveGlow(torch.nn.Module):
             WN.res_skip_layers = remove(WN.res_skip_layers)
         return waveglow
 
+    @staticmethod
+    def compile_inference(model, dtype=None):
+        """
+        Load-time preparation for inference: remove weight norm, register the
+        inverses of all Invertible1x1Conv weights as buffers and optionally
+        cast to torch.float16 / torch.bfloat16. Calling it again is a no-op
+        apart from the cast, and the result can be saved with torch.save.
+        """
+        if hasattr(model.WN[0].start, 'weight_g'):
+            model = WaveGlow.remove_weightnorm(model)
+        for convinv in model.convinv:
+            if 'W_inverse' not in convinv._buffers:
+                convinv.compile_inverse()
+        if dtype is not None:
+            model = model.to(dtype)
+        return model.eval()
+
+
+class WNInfer(torch.nn.Module):
+    """
+    Inference copy of a WN layer (weight norm already removed) that can be
+    compiled with torch.jit.script.
+    """
+
+    def __init__(self, wn):
+        super(WNInfer, self).__init__()
+        self.n_layers = wn.n_layers
+        self.n_channels = wn.n_channels
+        self.start = wn.start
+        self.end = wn.end
+        self.cond_layer = wn.cond_layer
+        self.in_layers = wn.in_layers
+        self.res_skip_layers = wn.res_skip_layers
+
+    def forward(self, audio, spect):
+        audio = self.start(audio)
+        output = torch.zeros_like(audio)
+        spect = self.cond_layer(spect)
+        n_channels = self.n_channels
+
+        i = 0
+        for in_layer, res_skip_layer in zip(self.in_layers, self.res_skip_layers):
+            spect_offset = i * 2 * n_channels
+            in_act = in_layer(audio) + spect[:, spect_offset:spect_offset + 2 * n_channels, :]
+            acts = torch.tanh(in_act[:, :n_channels, :]) * torch.sigmoid(in_act[:, n_channels:, :])
+
+            res_skip_acts = res_skip_layer(acts)
+            if i < self.n_layers - 1:
+                audio = audio + res_skip_acts[:, :n_channels, :]
+                output = output + res_skip_acts[:, n_channels:, :]
+            else:
+                output = output + res_skip_acts
+            i += 1
+
+        return self.end(output)
+
+
+class FlowInfer(torch.nn.Module):
+    """
+    One reversed flow of WaveGlow.infer: affine coupling, then the inverse
+    1x1 convolution with its weight inverted once here, then the early
+    noise if this flow has one.
+    """
+
+    def __init__(self, wn, convinv, n_early_size):
+        super(FlowInfer, self).__init__()
+        self.WN = WNInfer(wn)
+        W = convinv.conv.weight.squeeze()
+        self.register_buffer('W_inverse', W.float().inverse()[..., None].to(W.dtype))
+        self.n_early_size = n_early_size
+
+    def forward(self, audio, spect, sigma: float):
+        n_half = int(audio.size(1) / 2)
+        audio_0 = audio[:, :n_half, :]
+        audio_1 = audio[:, n_half:, :]
+
+        output = self.WN(audio_0, spect)
+
+        s = output[:, n_half:, :]
+        b = output[:, :n_half, :]
+        audio_1 = (audio_1 - b) / torch.exp(s)
+        audio = torch.cat([audio_0, audio_1], 1)
+
+        audio = F.conv1d(audio, self.W_inverse, bias=None, stride=1, padding=0)
+
+        if self.n_early_size > 0:
+            z = torch.randn(spect.size(0), self.n_early_size, spect.size(2), dtype=spect.dtype, device=spect.device)
+            audio = torch.cat((sigma * z, audio), 1)
+        return audio
+
+
+class WaveGlowInfer(torch.nn.Module):
+    """
+    Inference-only WaveGlow built from a trained WaveGlow, for torch.jit.script.
+    Weight norm is removed and the inverses of the Invertible1x1Conv weights
+    are precomputed. infer() gives the same result as WaveGlow.infer() and
+    the noise is drawn on the device and in the dtype of spect.
+    """
+
+    def __init__(self, waveglow):
+        super(WaveGlowInfer, self).__init__()
+        if hasattr(waveglow.WN[0].start, 'weight_g'):
+            waveglow = WaveGlow.remove_weightnorm(waveglow)
+        self.upsample = waveglow.upsample
+        self.n_group = waveglow.n_group
+        self.n_remaining_channels = waveglow.n_remaining_channels
+        self.time_cutoff = waveglow.upsample.kernel_size[0] - waveglow.upsample.stride[0]
+        flows = []
+        for k in reversed(range(waveglow.n_flows)):
+            n_early_size = waveglow.n_early_size if k % waveglow.n_early_every == 0 and k > 0 else 0
+            flows.append(FlowInfer(waveglow.WN[k], waveglow.convinv[k], n_early_size))
+        self.flows = torch.nn.ModuleList(flows)
+
+    def forward(self, spect, sigma: float = 1.0):
+        return self.infer(spect, sigma)
+
+    @torch.jit.export
+    def infer(self, spect, sigma: float = 1.0):
+        spect = self.upsample(spect)
+        # trim conv artifacts. maybe pad spec to kernel multiple
+        spect = spect[:, :, :-self.time_cutoff]
+
+        spect = spect.unfold(2, self.n_group, self.n_group).permute(0, 2, 1, 3)
+        spect = spect.contiguous().view(spect.size(0), spect.size(1), -1).permute(0, 2, 1)
+
+        audio = sigma * torch.randn(spect.size(0), self.n_remaining_channels, spect.size(2),
+                                    dtype=spect.dtype, device=spect.device)
+        for flow in self.flows:
+            audio = flow(audio, spect, sigma)
+
+        audio = audio.permute(0, 2, 1).contiguous().view(audio.size(0), -1)
+        return audio
+
 
 def remove(conv_list):
     new_conv_list = torch.nn.ModuleList()
@@ -26,19 +26,23 @@
 # *****************************************************************************
 import os
 import sys
+from pathlib import Path
 
 import torch
 from scipy.io.wavfile import write
 
+from utils.torchscript import script_path, is_torchscript, copy_model
+
 sys.path.append('waveglow')
 
 _model = None
 _denoiser = None
 
 
-def load_waveglow_model(model_path, device=None):
+def load_waveglow_model(model_path, device=None, dtype=None):
     """
     导入训练模型得到的checkpoint模型文件。
+    导入时用WaveGlow.compile_inference去掉weight norm、预先计算逆矩阵，dtype可选torch.float16或torch.bfloat16。
     """
     from .denoiser import Denoiser
 
@@ -48,14 +52,16 @@ def load_waveglow_model(model_path, device=None):
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
     if _model is None:
         _model = torch.load(model_path, map_location=device)['model']
-        _model = _model.remove_weightnorm(_model)
-        _model.to(device).eval()
-        _denoiser = Denoiser(_model).to(device)
+        _model = _model.compile_inference(_model, dtype=dtype)
+        _model.to(device)
+        _denoiser = Denoiser(_model, model_path=model_path).to(device)
 
 
-def load_waveglow_torch(model_path, device=None):
+def load_waveglow_torch(model_path, device=None, dtype=None):
     """
     用torch.load直接导入模型文件，不需要导入模型代码。
+    如果有export_torchscript导出的<name>.script.pt，优先导入TorchScript模型。
+    save_waveglow_torch保存的模型已经做过compile_inference，导入后不需要再做准备工作。
     """
     from .denoiser import Denoiser
 
@@ -63,12 +69,45 @@ def load_waveglow_torch(model_path, device=None):
     global _denoiser
     if device is None:
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    _model = torch.load(model_path, map_location=device)
-    _denoiser = Denoiser(_model).to(device)
+    fpath = script_path(model_path)
+    if not fpath.is_file():
+        fpath = Path(model_path)
+    if is_torchscript(fpath):
+        _model = torch.jit.load(str(fpath), map_location=device)
+        if dtype is not None:
+            _model.to(dtype)
+    else:
+        _model = torch.load(model_path, map_location=device)
+        _model = _model.compile_inference(_model, dtype=dtype)
+    _denoiser = Denoiser(_model, model_path=fpath).to(device)
 
     return _model
 
 
+def save_waveglow_torch(outpath):
+    """
+    保存当前导入的模型（已经做过compile_inference），可以用load_waveglow_torch直接导入。
+    """
+    if isinstance(_model, torch.jit.ScriptModule):
+        torch.jit.save(_model, str(outpath))
+    else:
+        torch.save(_model, outpath)
+
+
+def export_torchscript(model, outpath):
+    """
+    把WaveGlow转为WaveGlowInfer（去掉weight norm，预先计算Invertible1x1Conv的逆矩阵），
+    用torch.jit.script编译并保存，导入时不需要模型代码。
+    传入的模型不变，在copy_model复制的模型上去掉weight norm。
+    """
+    from .glow import WaveGlowInfer
+
+    model = WaveGlowInfer(copy_model(model)).eval()
+    script = torch.jit.script(model)
+    torch.jit.save(script, str(outpath))
+    return script
+
+
 def is_loaded():
     """
     判断模型是否已经导入。
@@ -77,25 +116,91 @@ def is_loaded():
     return _model is not None
 
 
+def frame_nbytes(model):
+    """
+    估计infer时每帧mel占用的峰值内存（字节）。
+    主要是WN的cond_layer输出（每个group有2*n_channels*n_layers个值），以及上采样后的mel和它的几份拷贝。
+    """
+    wn = model.WN[0] if hasattr(model, 'WN') else model.flows[0].WN
+    weight = model.upsample.weight
+    n_groups = model.upsample.stride[0] // model.n_group
+    n_values = n_groups * (wn.cond_layer.weight.shape[0] + 4 * weight.shape[0] * model.n_group)
+    return n_values * weight.element_size()
+
+
+def infer_chunked(model, mel, sigma=1.0, chunk_frames=256, pad_frames=16, overlap_frames=8, batch_size=1):
+    """
+    分段推理，峰值内存只和chunk_frames+2*pad_frames以及batch_size有关，和语音长度无关。
+    mel分成chunk_frames帧一段，每段两边各多取pad_frames帧作为上下文，
+    分别infer后截掉上下文，在段的边界做overlap_frames帧的交叉淡入淡出拼接。
+
+    :param mel: (B, n_mel_channels, T)
+    :param batch_size: 每次infer合并的段数。
+    :return: (B, T * hop_length)，float32
+    """
+    hop_length = model.upsample.stride[0]
+    n_frames = mel.shape[-1]
+    overlap_frames = min(overlap_frames, pad_frames, chunk_frames)
+    win_frames = min(n_frames, chunk_frames + 2 * pad_frames)
+    if win_frames == n_frames:
+        return model.infer(mel, sigma=sigma).float()
+
+    # 段的边界，最后一段不足pad_frames帧时并入前一段
+    bounds = list(range(0, n_frames, chunk_frames)) + [n_frames]
+    if n_frames - bounds[-2] < pad_frames:
+        del bounds[-2]
+    segments = [(start, end, min(max(start - pad_frames, 0), n_frames - win_frames))
+                for start, end in zip(bounds[:-1], bounds[1:])]
+
+    fade_len = overlap_frames * hop_length
+    fade_half = fade_len // 2
+    fade_in = torch.linspace(0, 1, fade_len + 2, device=mel.device)[1:-1]
+    fade_out = fade_in.flip(0)
+
+    audio = torch.zeros(mel.shape[0], n_frames * hop_length, device=mel.device)
+    for num in range(0, len(segments), batch_size):
+        batch = segments[num:num + batch_size]
+        wavs = model.infer(torch.cat([mel[:, :, w:w + win_frames] for _, _, w in batch]), sigma=sigma).float()
+        for wav, (start, end, w) in zip(wavs.split(mel.shape[0]), batch):
+            a = start * hop_length - fade_half if start > 0 else 0
+            b = end * hop_length + fade_len - fade_half if end < n_frames else n_frames * hop_length
+            wav = wav[:, a - w * hop_length:b - w * hop_length]
+            if start > 0:
+                wav[:, :fade_len] *= fade_in
+            if end < n_frames:
+                wav[:, -fade_len:] *= fade_out
+            audio[:, a:b] += wav
+    return audio
+
+
 def generate_wave(mel, **kwargs):
     """
     用声码器模型把mel频谱转为音频信号。
+    max_memory（MB）大于0时，按frame_nbytes估计的内存分段推理，避免长语音内存不足。
     """
     global _model
     global _denoiser
     sigma = kwargs.get('sigma', 1.0)
     denoiser_strength = kwargs.get('denoiser_strength', 0)
+    max_memory = kwargs.get('max_memory', 0)
+    pad_frames = kwargs.get('pad_frames', 16)
     if not is_loaded():
         load_waveglow_model(**kwargs)
-    mel = torch.autograd.Variable(mel)
+    weight = _model.upsample.weight
+    mel = mel.to(weight.device, weight.dtype)
 
     with torch.no_grad():
-        wav = _model.infer(mel, sigma=sigma)
+        if max_memory > 0:
+            win_frames = int(max_memory * 2 ** 20 // (frame_nbytes(_model) * mel.shape[0]))
+            chunk_frames = max(win_frames - 2 * pad_frames, 2 * pad_frames)
+            wav = infer_chunked(_model, mel, sigma=sigma, chunk_frames=chunk_frames, pad_frames=pad_frames)
+        else:
+            wav = _model.infer(mel, sigma=sigma)
         if denoiser_strength > 0:
             wav = _denoiser(wav, denoiser_strength)
             wav = wav.squeeze(0)
 
-        return wav
+        return wav.float()
 
 
 def main(mel_files, waveglow_path, sigma, output_dir, sampling_rate, is_fp16, denoiser_strength):
@@ -104,14 +209,11 @@ def main(mel_files, waveglow_path, sigma, output_dir, sampling_rate, is_fp16, de
 
     mel_files = files_to_list(mel_files)
     waveglow = torch.load(waveglow_path)['model']
-    waveglow = waveglow.remove_weightnorm(waveglow)
-    waveglow.cuda().eval()
-    # if is_fp16:
-    #     from apex import amp
-    #     waveglow, _ = amp.initialize(waveglow, [], opt_level="O3")
+    waveglow = waveglow.compile_inference(waveglow, dtype=torch.float16 if is_fp16 else None)
+    waveglow.cuda()
 
     if denoiser_strength > 0:
-        denoiser = Denoiser(waveglow).cuda()
+        denoiser = Denoiser(waveglow, model_path=waveglow_path).cuda()
 
     for i, file_path in enumerate(mel_files):
         file_name = os.path.splitext(os.path.basename(file_path))[0]
@@ -124,7 +226,7 @@ def main(mel_files, waveglow_path, sigma, output_dir, sampling_rate, is_fp16, de
             if denoiser_strength > 0:
                 audio = denoiser(audio, denoiser_strength)
 
-            audio = audio * MAX_WAV_VALUE
+            audio = audio.float() * MAX_WAV_VALUE
         audio = audio.squeeze()
         audio = audio.cpu().numpy()
         audio = audio.astype('int16')